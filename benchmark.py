@@ -0,0 +1,312 @@
+# %%
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import boto3
+import transform_data
+from instrumentation import PipelineProfile, git_commit
+from mongo_utils import to_storage_document, write_in_threads
+from s3_utils import check_weather_data_format, iter_weather_data
+from transform_utils import WIND_DIRECTION_DEGREES
+
+# Répertoire des résultats (un fichier JSON par exécution, à comparer d'un commit à l'autre)
+BENCHMARK_RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "benchmark_results")
+
+# Bucket dédié aux données synthétiques (jamais celui de production : la sauvegarde y écrit
+# data_transformed/weather_data.*), avec les mêmes flux et le même nommage des parties qu'Airbyte
+BENCHMARK_BUCKET = os.getenv("BENCHMARK_BUCKET", "p8-airbyte-greenandcoop-benchmark")
+BENCHMARK_SYNC_ID = "2025_01_01_1735689600000"
+BENCHMARK_STREAMS = {
+    name: {"prefix": stream["prefix"], "sync_id": BENCHMARK_SYNC_ID}
+    for name, stream in transform_data.airbyte_streams.items()
+}
+# Stations Weather Underground de chaque flux, dans l'ordre attendu par transform_data.transform
+WEATHER_UNDERGROUND_STREAMS = {"weather_underground_be": "IICHTE19", "weather_underground_fr": "ILAMAD25"}
+BENCHMARK_START_DATE = "2024-10-01"
+
+
+# %%
+# Générateur de données Airbyte synthétiques
+def synthetic_infoclimat_station(id_station, rng):
+    """Station InfoClimat brute, telle que fournie sous "stations"."""
+    return {
+        "id": id_station,
+        "name": f"Station {id_station}",
+        "latitude": round(rng.uniform(42, 51), 4),
+        "longitude": round(rng.uniform(-4, 8), 4),
+        "elevation": rng.randint(0, 1500),
+        "type": "static",
+        "license": {"license": "CC BY", "url": None, "source": "synthétique", "metadonnees": None},
+    }
+
+
+def synthetic_infoclimat_row(id_station, date_time, rng):
+    """Relevé horaire InfoClimat brut (valeurs en chaînes, comme dans l'API)."""
+    return {
+        "id_station": id_station,
+        "dh_utc": date_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "temperature": f"{rng.uniform(-10, 35):.1f}",
+        "pression": f"{rng.uniform(980, 1040):.1f}",
+        "humidite": str(rng.randint(20, 100)),
+        "point_de_rosee": f"{rng.uniform(-15, 25):.1f}",
+        "visibilite": str(rng.randint(0, 60) * 1000),
+        "vent_moyen": f"{rng.uniform(0, 60):.1f}",
+        "vent_rafales": f"{rng.uniform(0, 90):.1f}" if rng.random() < 0.7 else None,
+        "vent_direction": str(rng.randint(0, 35) * 10),
+        "pluie_3h": f"{rng.uniform(0, 5):.1f}" if rng.random() < 0.3 else None,
+        "pluie_1h": f"{rng.uniform(0, 2):.1f}",
+        "neige_au_sol": None,
+        "nebulosite": str(rng.randint(0, 8)) if rng.random() < 0.5 else None,
+        "temps_omm": None,
+    }
+
+
+def synthetic_weather_underground_row(time_of_day, rng):
+    """Relevé Weather Underground brut, avec ses unités."""
+    return {
+        "Time": time_of_day,
+        "Temperature": f"{rng.uniform(14, 95):.1f}\xa0°F",
+        "Dew Point": f"{rng.uniform(5, 77):.1f}\xa0°F",
+        "Humidity": f"{rng.randint(20, 100)}\xa0%",
+        "Wind": rng.choice(list(WIND_DIRECTION_DEGREES)),
+        "Speed": f"{rng.uniform(0, 30):.1f}\xa0mph",
+        "Gust": f"{rng.uniform(0, 45):.1f}\xa0mph",
+        "Pressure": f"{rng.uniform(29, 30.8):.2f}\xa0in",
+        "Precip. Rate.": f"{rng.uniform(0, 0.2):.2f}\xa0in",
+        "Precip. Accum.": f"{rng.uniform(0, 1):.2f}\xa0in",
+        "UV": str(rng.randint(0, 11)),
+        "Solar": f"{rng.uniform(0, 900):.1f}\xa0w/m²",
+    }
+
+
+def generate_infoclimat_records(station_ids, days, start_date=BENCHMARK_START_DATE, days_per_record=7, seed=0):
+    """
+    Génère les données "_airbyte_data" InfoClimat de N stations sur M jours : un enregistrement
+    par période de days_per_record jours, avec les stations dans le premier enregistrement et
+    les relevés horaires de chaque station sous "hourly".
+    """
+    rng = random.Random(seed)
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    for first_day in range(0, days, days_per_record):
+        hours = range(first_day * 24, min(days, first_day + days_per_record) * 24)
+        hourly = {
+            id_station: [synthetic_infoclimat_row(id_station, start + timedelta(hours=hour), rng) for hour in hours]
+            for id_station in station_ids
+        }
+        hourly["_params"] = ["start", "end"]
+        yield {
+            "stations": [synthetic_infoclimat_station(id_station, rng) for id_station in station_ids] if first_day == 0 else [],
+            "hourly": hourly,
+        }
+
+
+def generate_weather_underground_records(days, readings_per_day=288, seed=0):
+    """
+    Génère les lignes "_airbyte_data" Weather Underground d'une station sur M jours : la première
+    ligne est ignorée par la transformation et une ligne vide sépare chaque jour.
+    """
+    rng = random.Random(seed)
+    empty_row = dict.fromkeys(synthetic_weather_underground_row("00:00:00", rng))
+    interval = 24 * 60 // readings_per_day
+    yield empty_row
+    for day in range(days):
+        if day:
+            yield empty_row
+        for reading in range(readings_per_day):
+            minutes = reading * interval
+            yield synthetic_weather_underground_row(f"{minutes // 60:02d}:{minutes % 60:02d}:00", rng)
+
+
+def put_airbyte_parts(s3_client, bucket_name, prefix, records, part_size, sync_id=BENCHMARK_SYNC_ID):
+    """Écrit les enregistrements en parties JSONL '<sync_id>_<part>.jsonl' et renvoie leurs clés."""
+    file_keys = []
+    part = []
+
+    def flush():
+        file_key = f"{prefix}{sync_id}_{len(file_keys)}.jsonl"
+        body = "".join(json.dumps({"_airbyte_data": record}, ensure_ascii=False) + "\n" for record in part)
+        s3_client.put_object(Bucket=bucket_name, Key=file_key, Body=body.encode("utf-8"))
+        file_keys.append(file_key)
+
+    for record in records:
+        part.append(record)
+        if len(part) >= part_size:
+            flush()
+            part = []
+    if part or not file_keys:
+        flush()
+    return file_keys
+
+
+def check_benchmark_bucket(bucket_name):
+    """Refuse d'écrire les données synthétiques dans le bucket de production du pipeline."""
+    if bucket_name == transform_data.bucket_name:
+        raise ValueError(f"Le benchmark ne peut pas utiliser le bucket de production {bucket_name} (voir BENCHMARK_BUCKET)")
+
+
+def generate_dataset(s3_client, bucket_name, stations, days, readings_per_day=288, part_size=5000, seed=0):
+    """
+    Génère un jeu de données synthétique de N stations InfoClimat et des deux stations
+    Weather Underground sur M jours, et l'écrit sur S3 dans les flux de BENCHMARK_STREAMS.
+
+    Paramètres :
+    - s3_client : Client boto3 S3.
+    - bucket_name (str) : Bucket de destination (autre que celui de production).
+    - stations (int) : Nombre de stations InfoClimat (relevés horaires).
+    - days (int) : Nombre de jours de relevés.
+    - readings_per_day (int) : Nombre de relevés Weather Underground par jour.
+    - part_size (int) : Nombre d'enregistrements par partie JSONL.
+    - seed (int) : Graine du générateur aléatoire.
+
+    Retourne :
+    - dict : Les identifiants des stations et le nombre de relevés générés.
+    """
+    check_benchmark_bucket(bucket_name)
+    station_ids = [f"SYN{index:05d}" for index in range(stations)]
+
+    put_airbyte_parts(s3_client, bucket_name, BENCHMARK_STREAMS["infoclimat"]["prefix"],
+                      generate_infoclimat_records(station_ids, days, seed=seed), part_size=1)
+    for index, stream in enumerate(WEATHER_UNDERGROUND_STREAMS):
+        put_airbyte_parts(s3_client, bucket_name, BENCHMARK_STREAMS[stream]["prefix"],
+                          generate_weather_underground_records(days, readings_per_day, seed=seed + index + 1), part_size)
+
+    return {
+        "station_ids": station_ids,
+        "wu_station_ids": list(WEATHER_UNDERGROUND_STREAMS.values()),
+        "expected_documents": stations * days * 24 + len(WEATHER_UNDERGROUND_STREAMS) * days * readings_per_day,
+    }
+
+
+# %%
+# Étapes du pipeline : extraction, transformation et sauvegarde de transform_data.py, chargement comme insert_data.py
+def load_stage(s3_client, bucket_name, data_format, mongo_uri, workers, batch_size):
+    """Relit le fichier intermédiaire et insère les documents dans une base de benchmark (vidée au préalable)."""
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri, maxPoolSize=max(workers, 1) * 2)
+    collection = client["weather_benchmark"]["weather_data"]
+    collection.drop()
+
+    def insert_batches(worker, batches):
+        return sum(len(collection.insert_many(batch, ordered=False).inserted_ids) for batch in batches)
+
+    documents = (to_storage_document(doc) for chunk in iter_weather_data(s3_client, bucket_name, data_format) for doc in chunk)
+    try:
+        return sum(write_in_threads(documents, insert_batches, workers, batch_size=batch_size))
+    finally:
+        client.close()
+
+
+def run_pipeline(s3_client, bucket_name, dataset, data_format="jsonl.gz", mongo_uri=None, load_workers=1, batch_size=1000):
+    """
+    Exécute les fonctions extract, transform et save de transform_data.py sur le bucket du benchmark
+    et, avec mongo_uri, le chargement ; renvoie les mesures de chaque étape (voir instrumentation.py).
+    """
+    check_benchmark_bucket(bucket_name)
+    profile = PipelineProfile("benchmark")
+
+    etags = {}
+    stream_file_keys = transform_data.list_sources(s3_client, bucket_name, BENCHMARK_STREAMS, etags)
+    extracted = transform_data.extract(s3_client, profile, stream_file_keys, bucket_name, dataset["station_ids"], etags)
+    documents, _ = transform_data.transform(extracted, profile)
+    transform_data.save(s3_client, documents, profile, data_format, bucket_name)
+    if mongo_uri:
+        with profile.stage("load", rows_in=len(documents)) as metrics:
+            metrics.rows_out = load_stage(s3_client, bucket_name, data_format, mongo_uri, load_workers, batch_size)
+
+    return profile.summary()["stages"]
+
+
+# %%
+# Stockage S3 local et résultats
+def import_moto():
+    """Importe moto, dépendance optionnelle qui simule S3 en mémoire."""
+    try:
+        from moto import mock_aws
+    except ImportError as e:
+        raise ImportError("Le benchmark sans --s3-endpoint nécessite moto : poetry install --extras bench ou pip install 'moto[s3]'") from e
+    return mock_aws
+
+
+def save_results(results, results_dir=BENCHMARK_RESULTS_DIR):
+    """Écrit les résultats dans un fichier JSON horodaté et renvoie son chemin."""
+    os.makedirs(results_dir, exist_ok=True)
+    params = results["params"]
+    name = f"pipeline_{params['stations']}x{params['days']}_{results['commit'] or 'nogit'}_{results['created_at'][:19].replace(':', '')}.json"
+    path = os.path.join(results_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    return path
+
+
+def compare_results(results, baseline):
+    """Renvoie, par étape, la variation relative du temps réel par rapport à une exécution de référence."""
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    return {
+        stage["stage"]: round((stage["wall_s"] - baseline_stages[stage["stage"]]["wall_s"]) / baseline_stages[stage["stage"]]["wall_s"] * 100, 1)
+        for stage in results["stages"]
+        if baseline_stages.get(stage["stage"], {}).get("wall_s")
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline sur des données Airbyte synthétiques")
+    parser.add_argument("--stations", type=int, default=10, help="Nombre de stations InfoClimat")
+    parser.add_argument("--days", type=int, default=30, help="Nombre de jours de relevés")
+    parser.add_argument("--readings-per-day", type=int, default=288, help="Relevés Weather Underground par jour")
+    parser.add_argument("--format", default="jsonl.gz", choices=["json", "jsonl.gz", "parquet"], help="Format intermédiaire")
+    parser.add_argument("--s3-endpoint", help="S3 local (MinIO, moto_server...) ; moto en mémoire si absent")
+    parser.add_argument("--mongo-uri", help="mongod local pour l'étape load (ignorée si absent)")
+    parser.add_argument("--load-workers", type=int, default=1, help="Threads d'écriture de l'étape load")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents par lot de l'étape load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="Fichier de résultats de référence")
+    args = parser.parse_args(argv)
+
+    check_benchmark_bucket(BENCHMARK_BUCKET)
+    check_weather_data_format(args.format)
+    mock = None
+    if args.s3_endpoint:
+        s3_client = boto3.client("s3", endpoint_url=args.s3_endpoint)
+    else:
+        mock = import_moto()()
+        mock.start()
+        s3_client = boto3.client("s3", region_name="us-east-1")
+    try:
+        if BENCHMARK_BUCKET not in [bucket["Name"] for bucket in s3_client.list_buckets().get("Buckets", [])]:
+            s3_client.create_bucket(Bucket=BENCHMARK_BUCKET)
+
+        generate_start = time.perf_counter()
+        dataset = generate_dataset(s3_client, BENCHMARK_BUCKET, args.stations, args.days, args.readings_per_day, seed=args.seed)
+        print(f"Données générées : {dataset['expected_documents']} relevés en {time.perf_counter() - generate_start:.2f} s")
+
+        stages = run_pipeline(s3_client, BENCHMARK_BUCKET, dataset, args.format, args.mongo_uri, args.load_workers, args.batch_size)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    results = {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key != "compare"},
+        "documents": dataset["expected_documents"],
+        "total_wall_s": round(sum(stage["wall_s"] for stage in stages), 4),
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in stages),
+        "stages": stages,
+    }
+    print(f"Résultats enregistrés : {save_results(results)}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            for stage, change in compare_results(results, json.load(f)).items():
+                print(f"{stage:<10} {change:+.1f} % de temps par rapport à la référence")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
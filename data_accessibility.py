@@ -1,35 +1,237 @@
 # %%
 import time
+import json
 import logging
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import os
-
-# Configuration du logger
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from instrumentation import PipelineProfile, git_commit, percentile
+from mongo_utils import STATIONS_LAYOUT, STORAGE_LAYOUT, StationCache, connect, day_filter, find_weather_data, station_day_query
+from queries import READ_PREFERENCES, daily_summary_pipeline, get_hourly, query_cache, read_collection, read_preference
 
 # Paramètres de connexion à MongoDB
 MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
 DB_NAME = "weather_db"
 COLLECTION_NAME = "weather_data"
 
-# %%
-# Connexion à MongoDB
-try:
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    client.admin.command('ping')
-    logging.info("\n Connexion réussie à MongoDB")
-except ConnectionFailure as e:
-    logging.error(f"\n Impossible de se connecter à MongoDB : {e}")
-    exit(1)
+# Mode benchmark : mesures répétées de chaque type de requête, pour chaque préférence de lecture
+ACCESS_BENCHMARK_QUERIES = os.getenv("ACCESS_BENCHMARK_QUERIES", "point,station_day,multi_station,aggregation").split(",")
+ACCESS_BENCHMARK_READ_PREFERENCES = os.getenv("ACCESS_BENCHMARK_READ_PREFERENCES", "primary,secondaryPreferred,nearest").split(",")
+ACCESS_BENCHMARK_ITERATIONS = int(os.getenv("ACCESS_BENCHMARK_ITERATIONS", "200"))  # Requêtes mesurées par type
+ACCESS_BENCHMARK_WARMUP = int(os.getenv("ACCESS_BENCHMARK_WARMUP", "20"))  # Requêtes d'échauffement, non mesurées
+ACCESS_BENCHMARK_THREADS = int(os.getenv("ACCESS_BENCHMARK_THREADS", "1"))  # Requêtes concurrentes
+ACCESS_BENCHMARK_SAMPLE_SIZE = int(os.getenv("ACCESS_BENCHMARK_SAMPLE_SIZE", "500"))  # Relevés tirés pour paramétrer les requêtes
+ACCESS_BENCHMARK_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "benchmark_results")
 
 # %%
 # Mesurer le temps d'exécution d'une requête
-query = {"datetime": {"$regex": "^2024-10-02"}, "id_station": "ILAMAD25"}  # Ex : données météo du 2 octobre 2024 à La Madeleine
-start_time = time.time()
-result = list(db[COLLECTION_NAME].find(query))
-elapsed_time = round((time.time() - start_time) * 1000, 2)  # Convertir en ms
+def measure_query(db, station_cache, profile, query, label):
+    """Exécute une requête, journalise son temps d'accès et renvoie le temps en ms."""
+    with profile.stage(f"query[{label}]") as metrics:
+        collection = read_collection(db, COLLECTION_NAME, "operational")
+        result = find_weather_data(collection, query, stations_layout=STATIONS_LAYOUT, station_cache=station_cache)
+        metrics.rows_out = len(result)
+    elapsed_time = round(metrics.wall_s * 1000, 2)  # Temps réel de l'étape (perf_counter), en ms
+
+    logging.info(f"[{label}] Temps d'accès aux données : {elapsed_time} ms - Documents retournés : {len(result)}")
+    return elapsed_time
+
+# %%
+# Mode benchmark : latences p50 / p95 / p99 et débit par type de requête et préférence de lecture
+def sample_keys(collection, size=ACCESS_BENCHMARK_SAMPLE_SIZE):
+    """Tire au hasard (côté serveur) des couples (id_station, datetime) existants pour paramétrer les requêtes."""
+    return list(collection.aggregate([{"$sample": {"size": size}}, {"$project": {"_id": 0, "id_station": 1, "datetime": 1}}]))
+
+
+def query_mix(keys, storage_layout=STORAGE_LAYOUT, rng=None):
+    """
+    Construit les requêtes du benchmark : chacune tire un relevé existant et interroge la
+    collection qui lui est passée.
+
+    Retourne :
+    - dict : {type de requête: fonction(collection)}
+    """
+    rng = rng or random.Random(0)
+
+    def pick():
+        key = rng.choice(keys)
+        value = key["datetime"]
+        day = value.strftime("%Y-%m-%d") if isinstance(value, datetime) else value[:10]
+        return key, day
+
+    def point(collection):  # Un relevé par sa clé (id_station, datetime)
+        key, _ = pick()
+        return collection.find_one({"id_station": key["id_station"], "datetime": key["datetime"]})
+
+    def station_day(collection):  # Une station sur une journée
+        key, day = pick()
+        return list(collection.find(station_day_query(key["id_station"], day, storage_layout)))
+
+    def multi_station(collection):  # Toutes les stations sur une journée
+        _, day = pick()
+        return list(collection.find({"datetime": day_filter(day, storage_layout)}))
+
+    def aggregation(collection):  # Résumé journalier d'une station sur une semaine
+        key, day = pick()
+        end = (datetime.fromisoformat(day) + timedelta(days=7)).strftime("%Y-%m-%d")
+        return list(collection.aggregate(daily_summary_pipeline(key["id_station"], day, end, storage_layout)))
+
+    return {"point": point, "station_day": station_day, "multi_station": multi_station, "aggregation": aggregation}
+
+
+def timed_call(run, collection):
+    """Exécute une requête et renvoie sa durée en nanosecondes."""
+    start = time.perf_counter_ns()
+    run(collection)
+    return time.perf_counter_ns() - start
+
+
+def benchmark_query(run, collection, iterations=ACCESS_BENCHMARK_ITERATIONS, warmup=ACCESS_BENCHMARK_WARMUP,
+                    threads=ACCESS_BENCHMARK_THREADS):
+    """
+    Mesure une requête : warmup exécutions non mesurées (caches, connexions du pool), puis
+    iterations exécutions mesurées, réparties sur threads requêtes concurrentes.
+
+    Retourne :
+    - dict : Latences p50 / p95 / p99 / max / moyenne (ms) et débit (requêtes par seconde).
+    """
+    for _ in range(warmup):
+        run(collection)
+
+    start = time.perf_counter_ns()
+    if threads <= 1:
+        latencies = [timed_call(run, collection) for _ in range(iterations)]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(lambda _: timed_call(run, collection), range(iterations)))
+    return latency_stats(latencies, time.perf_counter_ns() - start)
+
+
+def latency_stats(latencies_ns, wall_ns):
+    """Résume des latences (ns) mesurées pendant wall_ns nanosecondes."""
+    latencies_ms = [latency / 1e6 for latency in latencies_ns]
+    return {
+        "iterations": len(latencies_ms),
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "max_ms": round(max(latencies_ms), 3),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 3),
+        "qps": round(len(latencies_ms) / (wall_ns / 1e9), 1) if wall_ns else None,
+    }
+
+
+def run_latency_benchmark(db, query_types=ACCESS_BENCHMARK_QUERIES, read_preferences=ACCESS_BENCHMARK_READ_PREFERENCES,
+                          iterations=ACCESS_BENCHMARK_ITERATIONS, warmup=ACCESS_BENCHMARK_WARMUP,
+                          threads=ACCESS_BENCHMARK_THREADS, storage_layout=STORAGE_LAYOUT, seed=0):
+    """
+    Mesure chaque type de requête du mélange pour chaque préférence de lecture.
+
+    Retourne :
+    - list : Un résultat par (préférence de lecture, type de requête).
+    """
+    unknown = [name for name in read_preferences if name not in READ_PREFERENCES]
+    if unknown:
+        raise ValueError(f"Préférence de lecture inconnue : {', '.join(unknown)} (préférences : {', '.join(READ_PREFERENCES)})")
+
+    keys = sample_keys(db[COLLECTION_NAME])
+    if not keys:
+        raise ValueError(f"La collection {COLLECTION_NAME} est vide : aucune requête à mesurer")
+    queries = query_mix(keys, storage_layout, random.Random(seed))
+    unknown = [name for name in query_types if name not in queries]
+    if unknown:
+        raise ValueError(f"Type de requête inconnu : {', '.join(unknown)} (types : {', '.join(queries)})")
+
+    results = []
+    for mode in read_preferences:
+        # Préférence imposée (avec READ_TAG_SETS et READ_MAX_STALENESS_SECONDS), sans repli sur le primaire
+        collection = read_collection(db, COLLECTION_NAME, read_preference=read_preference(mode))
+        for query_type in query_types:
+            stats = benchmark_query(queries[query_type], collection, iterations, warmup, threads)
+            results.append({"read_preference": mode, "query": query_type, "threads": threads, **stats})
+            logging.info(
+                f"[{mode}, {query_type}] p50 {stats['p50_ms']} ms - p95 {stats['p95_ms']} ms - "
+                f"p99 {stats['p99_ms']} ms - {stats['qps']} requêtes/s"
+            )
+    return results
+
+
+def save_benchmark(db, results, results_dir=ACCESS_BENCHMARK_DIR):
+    """Enregistre les résultats en JSON, avec le stockage et les index en place, et renvoie le chemin du fichier."""
+    created_at = datetime.now(timezone.utc).isoformat()
+    commit = git_commit()
+    report = {
+        "benchmark": "read_path",
+        "commit": commit,
+        "created_at": created_at,
+        "storage_layout": STORAGE_LAYOUT,
+        "stations_layout": STATIONS_LAYOUT,
+        "indexes": sorted(db[COLLECTION_NAME].index_information()),
+        "params": {
+            "iterations": ACCESS_BENCHMARK_ITERATIONS,
+            "warmup": ACCESS_BENCHMARK_WARMUP,
+            "threads": ACCESS_BENCHMARK_THREADS,
+            "sample_size": ACCESS_BENCHMARK_SAMPLE_SIZE,
+        },
+        "results": results,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"read_path_{STORAGE_LAYOUT}_{commit or 'nogit'}_{created_at[:19].replace(':', '')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    return path
+
+
+# %%
+def main(benchmark=False):
+    """
+    Mesure les temps d'accès aux données de requêtes représentatives ; avec benchmark=True,
+    mesure les latences et le débit du mélange de requêtes (ACCESS_BENCHMARK_*).
+    """
+    # Configuration du logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if benchmark:
+        db = connect(MONGO_URI)[DB_NAME]
+        results = run_latency_benchmark(db)
+        logging.info(f"Résultats enregistrés : {save_benchmark(db, results)}")
+        return results
+
+    # Profil de performance de l'exécution (journal JSON par requête, voir instrumentation.py)
+    profile = PipelineProfile("data_accessibility")
+    db = connect(MONGO_URI)[DB_NAME]
+
+    # Cache des stations (stockage normalisé), chargé avant la mesure
+    station_cache = StationCache(db)
+    if STATIONS_LAYOUT == "normalized":
+        logging.info(f"Stations en cache : {len(station_cache.stations)}")
+
+    # Ex : données météo du 2 octobre 2024 à La Madeleine
+    range_query = station_day_query("ILAMAD25", "2024-10-02", STORAGE_LAYOUT)  # Intervalle de dates (bornes d'index)
+    range_time = measure_query(db, station_cache, profile, range_query, f"intervalle, {STORAGE_LAYOUT}")
+
+    # Comparaison avec l'ancienne requête par expression régulière (datetime stocké en chaîne uniquement)
+    if STORAGE_LAYOUT == "standard":
+        regex_query = {"datetime": {"$regex": "^2024-10-02"}, "id_station": "ILAMAD25"}
+        regex_time = measure_query(db, station_cache, profile, regex_query, "regex")
+        logging.info(f"Requête par intervalle : {range_time} ms contre {regex_time} ms par regex")
+
+    # Même requête via l'API de requêtes : le second appel est servi par le cache des résultats
+    for attempt in ("premier appel", "second appel"):
+        with profile.stage(f"get_hourly[{attempt}]") as metrics:
+            result = get_hourly(db, "ILAMAD25", "2024-10-02", "2024-10-03")
+            metrics.rows_out = len(result)
+        elapsed_time = round(metrics.wall_s * 1000, 2)
+        logging.info(f"[get_hourly, {attempt}] Temps d'accès aux données : {elapsed_time} ms - Documents retournés : {len(result)}")
+
+    logging.info(f"Cache des requêtes : {query_cache.stats()}")
+
+    # Profil de performance de l'exécution (résumé JSON, et profil / fichier Prometheus si configurés)
+    profile.write()
+
+    logging.info("Test d'accessibilité terminé avec succès !")
+
 
-logging.info(f"Temps d'accès aux données : {elapsed_time} ms - Documents retournés : {len(result)}")
-logging.info("Test d'accessibilité terminé avec succès !")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# %%
+import logging
+import os
+from datetime import datetime
+from s3_utils import batched, import_pyarrow
+from mongo_utils import STORAGE_LAYOUT, connect, datetime_range_filter, weather_data_schema
+from queries import read_collection
+
+# Paramètres de connexion à MongoDB
+MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
+DB_NAME = "weather_db"
+COLLECTION_NAME = "weather_data"
+
+# Export en colonnes : moteur ("auto" : pymongoarrow s'il est installé, sinon curseur par lots), taille des lots
+# et répertoire des fichiers parquet par station et par mois
+EXPORT_ENGINE = os.getenv("EXPORT_ENGINE", "auto")
+EXPORT_ENGINES = ("auto", "pymongoarrow", "cursor")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "weather_export")
+
+# Types Arrow des champs de weather_data, d'après les bsonType du $jsonSchema
+BSON_TO_ARROW_TYPES = {"double": "float64", "int": "int64"}
+
+
+# %%
+def import_pymongoarrow():
+    """Importe pymongoarrow, dépendance optionnelle du moteur "pymongoarrow"."""
+    try:
+        import pymongoarrow.api
+    except ImportError as e:
+        raise ImportError("Le moteur d'export 'pymongoarrow' nécessite pymongoarrow : poetry install --extras export ou pip install pymongoarrow") from e
+    return pymongoarrow.api
+
+
+def resolve_engine(engine=EXPORT_ENGINE):
+    """Renvoie le moteur d'export effectif ("pymongoarrow" ou "cursor")."""
+    if engine not in EXPORT_ENGINES:
+        raise ValueError(f"Moteur d'export inconnu : {engine} (moteurs : {', '.join(EXPORT_ENGINES)})")
+    if engine != "auto":
+        return engine
+    try:
+        import_pymongoarrow()
+        return "pymongoarrow"
+    except ImportError:
+        return "cursor"
+
+
+def weather_fields(schema=weather_data_schema):
+    """Renvoie {champ: type Arrow} des mesures de weather_data, dans l'ordre du schéma."""
+    properties = schema["validator"]["$jsonSchema"]["properties"]["weather_data"]["properties"]
+    fields = {}
+    for field, rule in properties.items():
+        bson_types = rule["bsonType"] if isinstance(rule["bsonType"], list) else [rule["bsonType"]]
+        fields[field] = next(BSON_TO_ARROW_TYPES[bson_type] for bson_type in bson_types if bson_type != "null")
+    return fields
+
+
+def arrow_schema(fields=None):
+    """Schéma Arrow des relevés à plat : id_station, datetime (horodatage) puis une colonne typée par mesure."""
+    pa, _ = import_pyarrow()
+    fields = fields or weather_fields()
+    return pa.schema(
+        [("id_station", pa.string()), ("datetime", pa.timestamp("ms"))]
+        + [(field, getattr(pa, arrow_type)()) for field, arrow_type in fields.items()]
+    )
+
+
+def flat_pipeline(query, fields, storage_layout=STORAGE_LAYOUT):
+    """
+    Pipeline d'agrégation qui filtre les relevés, les trie par datetime et remonte côté serveur
+    les champs weather_data.* au premier niveau ; datetime est converti en date BSON quel que
+    soit le stockage.
+    """
+    if storage_layout == "timeseries":
+        datetime_value = "$datetime"
+    else:
+        datetime_value = {"$dateFromString": {"dateString": "$datetime", "format": "%Y-%m-%d %H:%M:%S"}}
+    return [
+        {"$match": query},
+        {"$sort": {"id_station": 1, "datetime": 1}},
+        {"$project": {
+            "_id": 0,
+            "id_station": 1,
+            "datetime": datetime_value,
+            **{field: f"$weather_data.{field}" for field in fields},
+        }},
+    ]
+
+
+# %%
+# Lecture en colonnes
+def iter_record_batches(collection, query, fields=None, storage_layout=STORAGE_LAYOUT,
+                        batch_size=EXPORT_BATCH_SIZE, engine=EXPORT_ENGINE):
+    """
+    Lit les relevés correspondant à la requête sous forme de lots Arrow typés, sans construire
+    de documents imbriqués : pymongoarrow décode directement le BSON ; à défaut, un curseur
+    par lots lit les documents déjà mis à plat par le serveur et les convertit lot par lot.
+
+    Paramètres :
+    - collection (Collection) : Collection weather_data.
+    - query (dict) : Filtre des relevés.
+    - fields (dict) : Mesures exportées et leur type Arrow (toutes par défaut).
+    - batch_size (int) : Relevés par lot.
+    - engine (str) : "auto", "pymongoarrow" ou "cursor".
+
+    Yields:
+    - pyarrow.RecordBatch : Un lot de relevés.
+    """
+    pa, _ = import_pyarrow()
+    fields = fields or weather_fields()
+    schema = arrow_schema(fields)
+    pipeline = flat_pipeline(query, fields, storage_layout)
+
+    if resolve_engine(engine) == "pymongoarrow":
+        api = import_pymongoarrow()
+        table = api.aggregate_arrow_all(collection, pipeline, schema=api.Schema(dict(zip(schema.names, schema.types))))
+        yield from table.cast(schema).to_batches(max_chunksize=batch_size)
+        return
+
+    for batch in batched(collection.aggregate(pipeline, batchSize=batch_size), batch_size):
+        yield pa.RecordBatch.from_pydict({name: [doc.get(name) for doc in batch] for name in schema.names}, schema=schema)
+
+
+def find_arrow(collection, query, fields=None, storage_layout=STORAGE_LAYOUT, batch_size=EXPORT_BATCH_SIZE, engine=EXPORT_ENGINE):
+    """Renvoie les relevés correspondant à la requête dans une table Arrow typée."""
+    pa, _ = import_pyarrow()
+    fields = fields or weather_fields()
+    batches = list(iter_record_batches(collection, query, fields, storage_layout, batch_size, engine))
+    return pa.Table.from_batches(batches, schema=arrow_schema(fields))
+
+
+def find_dataframe(collection, query, fields=None, storage_layout=STORAGE_LAYOUT, batch_size=EXPORT_BATCH_SIZE, engine=EXPORT_ENGINE):
+    """Renvoie les relevés correspondant à la requête dans un DataFrame pandas (une colonne par mesure)."""
+    return find_arrow(collection, query, fields, storage_layout, batch_size, engine).to_pandas()
+
+
+# %%
+# Export parquet par station et par mois
+def station_months(collection, id_station):
+    """Renvoie les mois 'YYYY-MM' couverts par les relevés d'une station (premier et dernier relevés via l'index)."""
+    first = collection.find_one({"id_station": id_station}, {"datetime": 1}, sort=[("datetime", 1)])
+    last = collection.find_one({"id_station": id_station}, {"datetime": 1}, sort=[("datetime", -1)])
+    if first is None:
+        return []
+    months = []
+    month, last_month = str(first["datetime"])[:7], str(last["datetime"])[:7]
+    while month <= last_month:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def next_month(month):
+    """Renvoie le mois suivant un mois 'YYYY-MM'."""
+    value = datetime.strptime(month, "%Y-%m")
+    return f"{value.year + value.month // 12:04d}-{value.month % 12 + 1:02d}"
+
+
+def export_parquet(collection, output_dir=EXPORT_DIR, stations=None, start_month=None, end_month=None,
+                   storage_layout=STORAGE_LAYOUT, batch_size=EXPORT_BATCH_SIZE, engine=EXPORT_ENGINE):
+    """
+    Écrit les relevés en parquet, un fichier par station et par mois
+    (output_dir/<id_station>/<YYYY-MM>.parquet), lot par lot :
+    la mémoire utilisée est bornée par batch_size (curseur) ou par un mois d'une station (pymongoarrow).
+
+    Paramètres :
+    - collection (Collection) : Collection weather_data.
+    - output_dir (str) : Répertoire de l'export, lisible directement avec pandas.read_parquet.
+    - stations (list) : Stations exportées (toutes par défaut).
+    - start_month, end_month (str) : Premier et dernier mois 'YYYY-MM' exportés (inclus), tous par défaut.
+
+    Retourne :
+    - list : Un dictionnaire par fichier écrit (station, mois, chemin, nombre de relevés).
+    """
+    _, pq = import_pyarrow()
+    fields = weather_fields()
+    schema = arrow_schema(fields)
+    written = []
+    for id_station in stations or sorted(collection.distinct("id_station")):
+        for month in station_months(collection, id_station):
+            if (start_month and month < start_month) or (end_month and month > end_month):
+                continue
+            query = {"id_station": id_station, "datetime": datetime_range_filter(f"{month}-01", f"{next_month(month)}-01", storage_layout)}
+            os.makedirs(os.path.join(output_dir, id_station), exist_ok=True)
+            path = os.path.join(output_dir, id_station, f"{month}.parquet")
+            rows = 0
+            with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+                for batch in iter_record_batches(collection, query, fields, storage_layout, batch_size, engine):
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            written.append({"id_station": id_station, "month": month, "path": path, "rows": rows})
+    return written
+
+
+# %%
+def main(output_dir=EXPORT_DIR, stations=None, start_month=None, end_month=None):
+    """Exporte les relevés de MongoDB en parquet, par station et par mois."""
+    # Configuration du logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    client = connect(MONGO_URI)
+    # Lecture analytique : routée vers les secondaires (ANALYTIC_READ_PREFERENCE)
+    collection = read_collection(client[DB_NAME], COLLECTION_NAME, "analytic")
+    written = export_parquet(collection, output_dir, stations, start_month, end_month)
+    client.close()
+
+    logging.info(
+        f"Export parquet ({resolve_engine()}) : {sum(item['rows'] for item in written)} relevés, "
+        f"{len(written)} fichiers dans {output_dir}"
+    )
+    return written
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# %%
+import logging
+from mongo_utils import STORAGE_LAYOUT, connect, explain_query, representative_queries
+
+# Paramètres de connexion à MongoDB
+MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
+DB_NAME = "weather_db"
+COLLECTION_NAME = "weather_data"
+
+# %%
+def main():
+    """
+    Plan d'exécution des requêtes représentatives : une requête est bien couverte si son index
+    n'examine pas plus de documents qu'elle n'en renvoie.
+
+    Retourne :
+    - list : Les requêtes mal couvertes par les index.
+    """
+    # Configuration du logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = connect(MONGO_URI)[DB_NAME]
+    uncovered = []
+    for label, query, sort in representative_queries(STORAGE_LAYOUT):
+        summary = explain_query(db[COLLECTION_NAME], query, sort)
+        logging.info(
+            f"[{label}] index : {summary['index']} - documents examinés / renvoyés : "
+            f"{summary['docs_examined']} / {summary['returned']} - clés examinées : {summary['keys_examined']} - "
+            f"{summary['time_ms']} ms"
+        )
+        if summary["index"] == "COLLSCAN" or summary["docs_examined"] > summary["returned"]:
+            uncovered.append(label)
+
+    if uncovered:
+        logging.warning(f"Requêtes mal couvertes par les index : {', '.join(uncovered)}")
+    else:
+        logging.info("Toutes les requêtes représentatives sont couvertes par un index.")
+    return uncovered
+
+
+if __name__ == "__main__":
+    main()
@@ -1,140 +1,450 @@
 #%%
+import copy
 import os
 import boto3
 import json
-from pymongo import MongoClient
-from pymongo.errors import WriteError
-from bson import ObjectId
-from datetime import datetime
-from bson import Timestamp
-import pandas as pd
+import time
+import hashlib
+from functools import lru_cache
+from pymongo import ReplaceOne, WriteConcern
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timezone
+from instrumentation import PipelineProfile, timed_iter
+from s3_utils import WEATHER_DATA_FORMAT, check_weather_data_format, iter_weather_data
+from rollups import BUILD_ROLLUPS, DAILY_ROLLUP_COLLECTION_NAME, MONTHLY_ROLLUP_COLLECTION_NAME, refresh_rollups
+from mongo_utils import (
+    LOAD_METADATA_COLLECTION_NAME, STATIONS_COLLECTION_NAME, STATIONS_LAYOUT, STORAGE_LAYOUT, TIMESERIES_OPTIONS,
+    check_load_partition, check_stations_layout, check_storage_layout, connect, ensure_indexes, stations_schema,
+    to_storage_document, weather_data_schema, write_in_threads
+)
 
 #%%
-# Configurer le client S3
-s3 = boto3.client('s3')
-
-# Détails du bucket et des fichiers JSON
+# Détails du bucket S3
 bucket_name = "p8-airbyte-greenandcoop"
-weather_data_file_key = "data_transformed/weather_data.json" 
+
+@lru_cache(maxsize=None)
+def s3_client():
+    """Client S3, créé au premier usage."""
+    return boto3.client('s3')
 
 #%%
-# Fonction pour charger les données depuis S3 dans un objet Python
-def load_json_from_s3(bucket_name, file_key):
-    obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-    data = obj['Body'].read().decode('utf-8')  
-    return json.loads(data)  
+# Paramètres d'insertion en masse
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "1000"))  # Nombre de documents par lot
+INSERT_WRITE_CONCERN = os.getenv("INSERT_WRITE_CONCERN", "majority")  # "majority" ou nombre de noeuds
+INSERT_JOURNAL = os.getenv("INSERT_JOURNAL")  # "true" / "false" : attendre (ou non) l'écriture dans le journal
+INSERT_JOURNAL = None if INSERT_JOURNAL is None else INSERT_JOURNAL.lower() in ("1", "true", "yes")
 
-# Charger les données des fichiers JSON
-weather_data = load_json_from_s3(bucket_name, weather_data_file_key)
+# Chargement parallèle : nombre de threads d'écriture (1 = un seul thread) et répartition des documents
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "1"))
+LOAD_PARTITION = os.getenv("LOAD_PARTITION", "station")  # "station" ou "hash"
+
+# Taille du pool de connexions partagé par les threads d'écriture
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
 
-#%%
 #Connexion à MongoDB
 MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
-client = MongoClient(MONGO_URI) #connexion au serveur mongodb
-db = client["weather_db"]  # Nom de la base de données
 
-#%%
-# Définition des schémas
-weather_data_schema = {
-    "validator": {
-        "$jsonSchema": {
-            "bsonType": "object",
-            "required": ["id_station", "datetime"],
-            "properties": {
-                "id_station": {"bsonType": "string"},
-                "station_info": {
-                    "bsonType": "object",
-                    "properties": {
-                        "name": {"bsonType": "string"},
-                        "latitude": {"bsonType": "double", "minimum": -90, "maximum": 90},
-                        "longitude": {"bsonType": "double", "minimum": -180, "maximum": 180},
-                        "elevation": {"bsonType": "int", "minimum": 0},
-                        "city": {"bsonType": "string"},
-                        "state": {"bsonType": "string"},
-                        "type": {"bsonType": ["string", "null"]},
-                        "hardware": {"bsonType": ["string", "null"]},
-                        "software": {"bsonType": ["string", "null"]},
-                        "license": {
-                            "bsonType": "object",
-                            "properties": {
-                                "license": {"bsonType": ["string", "null"]},
-                                "url": {"bsonType": ["string", "null"]},
-                                "source": {"bsonType": ["string", "null"]},
-                                "metadonnees": {"bsonType": ["string", "null"]},
-                            }
-                        }
-                    }
-                },
-                "datetime": {"bsonType": "string"},
-                "weather_data": {
-                    "bsonType": "object",
-                    "properties": {
-                        "temperature": {"bsonType": "double"},
-                        "pressure": {"bsonType": "double"},
-                        "humidity": {"bsonType": "int", "minimum": 0, "maximum": 100},
-                        "dew_point": {"bsonType": "double"},
-                        "visibility": {"bsonType": ["double", "null"], "minimum": 0},
-                        "wind_speed": {"bsonType": "double", "minimum": 0},
-                        "wind_gust": {"bsonType": ["double", "null"], "minimum": 0},
-                        "wind_direction": {"bsonType": ["double", "null"], "minimum": 0, "maximum": 337.5},
-                        "precip_1h": {"bsonType": ["double", "null"], "minimum": 0},
-                        "precip_3h": {"bsonType": ["double", "null"], "minimum": 0},
-                        "precip_accum": {"bsonType": ["double", "null"], "minimum": 0},
-                        "precip_rate": {"bsonType": ["double", "null"], "minimum": 0},
-                        "solar": {"bsonType": ["double", "null"], "minimum": 0},
-                        "uv": {"bsonType": ["int", "null"], "minimum": 0, "maximum": 11},
-                        "snow_depth": {"bsonType": ["double", "null"], "minimum": 0},
-                        "nebulosity": {"bsonType": ["double", "null"], "minimum": 0},
-                        "weather_wmo": {"bsonType": ["double", "null"], "minimum": 0}
-                    }
-                }
-            }
-        }
+# Mode de chargement : "full" (suppression et rechargement complet) ou "incremental" (upsert des nouveautés)
+LOAD_MODE = os.getenv("LOAD_MODE", "full")
+
+def check_load_settings(load_mode=LOAD_MODE, storage_layout=STORAGE_LAYOUT, stations_layout=STATIONS_LAYOUT, partition=LOAD_PARTITION,
+                        data_format=WEATHER_DATA_FORMAT):
+    """Vérifie la configuration du chargement avant toute écriture."""
+    # Format du fichier intermédiaire (pyarrow installé pour "parquet"), avant la suppression des collections
+    check_weather_data_format(data_format)
+
+    # Organisation du stockage : "standard" ou "timeseries" (datetime en date BSON, voir mongo_utils)
+    check_storage_layout(storage_layout)
+    if storage_layout == "timeseries" and load_mode == "incremental":
+        raise ValueError("Le mode incrémental nécessite un index unique, non disponible sur une collection time-series")
+
+    # Stockage des stations : "embedded" (station_info dans chaque relevé) ou "normalized" (collection stations)
+    check_stations_layout(stations_layout)
+    check_load_partition(partition)
+
+def client_options():
+    """Options du MongoClient partagé par tous les threads d'écriture (pool de connexions, write concern)."""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "w": int(INSERT_WRITE_CONCERN) if INSERT_WRITE_CONCERN.isdigit() else INSERT_WRITE_CONCERN,
+        **({} if INSERT_JOURNAL is None else {"journal": INSERT_JOURNAL}),
     }
-}
 
 #%%
-# Suppression des collections existantes
-db.drop_collection("weather_data")
+def storage_schema(storage_layout=STORAGE_LAYOUT):
+    """
+    Options de création de weather_data selon l'organisation du stockage : validation $jsonSchema
+    pour la collection classique ; options time-series seules pour la collection time-series,
+    qui n'accepte pas de validateur (la transformation reste contrôlée par le rapport qualité).
+    """
+    if storage_layout == "timeseries":
+        return {"timeseries": dict(TIMESERIES_OPTIONS)}
+    return copy.deepcopy(weather_data_schema)
 
 #%%
-# Création de la collection avec validation
-db.create_collection("weather_data", **weather_data_schema)
+def setup_collections(db, profile, load_mode=LOAD_MODE, storage_layout=STORAGE_LAYOUT, stations_layout=STATIONS_LAYOUT):
+    """
+    Prépare les collections : suppression (rechargement complet uniquement), création avec
+    validation et index.
+
+    Retourne :
+    - tuple : (weather_data, stations, load_metadata)
+    """
+    # Suppression des collections existantes (rechargement complet uniquement)
+    if load_mode == "full":
+        db.drop_collection("weather_data")
+        db.drop_collection(DAILY_ROLLUP_COLLECTION_NAME)
+        db.drop_collection(MONTHLY_ROLLUP_COLLECTION_NAME)
+
+    # Création de la collection (avec validation, hors time-series)
+    if "weather_data" not in db.list_collection_names():
+        db.create_collection("weather_data", **storage_schema(storage_layout))
 
-weather_data_collection = db["weather_data"] 
+    if stations_layout == "normalized" and STATIONS_COLLECTION_NAME not in db.list_collection_names():
+        db.create_collection(STATIONS_COLLECTION_NAME, **stations_schema)
 
-# Création des index pour optimiser les recherches
-weather_data_collection.create_index([("id_station", 1)])  
-weather_data_collection.create_index([("datetime", 1)])
+    weather_data_collection = db["weather_data"] 
+    stations_collection = db[STATIONS_COLLECTION_NAME]
+
+    # Collection des métadonnées de chargement : dernier relevé chargé (high-water mark) et
+    # dernière plage écrite par station (utilisée pour invalider le cache des requêtes)
+    load_metadata_collection = db[LOAD_METADATA_COLLECTION_NAME]
+
+    # Création des index pour optimiser les recherches : index composé (id_station, datetime),
+    # unique en mode incrémental pour les upserts, et index datetime pour les requêtes multi-stations
+    with profile.stage("indexes"):
+        ensure_indexes(weather_data_collection, unique=(load_mode == "incremental"))
+
+    return weather_data_collection, stations_collection, load_metadata_collection
 
 #%%
-def insert_documents(collection, data, collection_name):
-    total_docs = len(data)
-    inserted_count = 0
-    rejected_docs = []
-    
+def parse_write_concern(value, journal=INSERT_JOURNAL):
+    """Construit un WriteConcern à partir de "majority" ou d'un nombre de noeuds (et de l'option journal)."""
+    return WriteConcern(w=int(value) if str(value).isdigit() else value, j=journal)
+
+def content_hash(doc):
+    """Calcule l'empreinte du contenu d'un document (hors _id et content_hash)."""
+    content = {key: value for key, value in doc.items() if key not in ("_id", "content_hash")}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def track_high_water_marks(data, high_water_marks):
+    """
+    Met à jour, au fil de la lecture, le dernier datetime rencontré pour chaque station.
+    Les documents ne sont pas modifiés : content_hash n'est ajouté qu'en chargement incrémental.
+    """
     for doc in data:
-        try:
-            collection.insert_one(doc)
-            inserted_count += 1
-        except WriteError as e:
-            print(f"Document rejeté : {doc} - Erreur : {e}")
-            rejected_docs.append(doc)
-    
+        if doc["datetime"] > high_water_marks.get(doc["id_station"], ""):
+            high_water_marks[doc["id_station"]] = doc["datetime"]
+        yield doc
+
+def save_high_water_marks(metadata_collection, high_water_marks, written_ranges=None):
+    """
+    Enregistre, pour chaque station, le dernier datetime chargé et la plage (premier, dernier
+    datetime) des relevés écrits. Sans plage, tout l'historique de la station est considéré modifié.
+    """
+    now = datetime.now(timezone.utc)
+    written_ranges = written_ranges or {}
+    for id_station in high_water_marks.keys() | written_ranges.keys():
+        fields = {"updated_at": now}
+        if id_station in high_water_marks:
+            fields["last_datetime"] = high_water_marks[id_station]
+        if id_station in written_ranges:
+            fields["written_from"], fields["written_to"] = written_ranges[id_station]
+        metadata_collection.update_one({"_id": id_station}, {"$set": fields}, upsert=True)
+
+def split_stations(data, stations):
+    """
+    Retire station_info de chaque relevé (stockage normalisé) et le conserve une seule fois
+    par station dans le dictionnaire stations.
+    """
+    for doc in data:
+        stations[doc["id_station"]] = doc.pop("station_info", {})
+        yield doc
+
+def save_stations(collection, stations):
+    """Enregistre (insère ou remplace) les stations dans la collection stations."""
+    operations = [
+        ReplaceOne({"_id": id_station}, {"_id": id_station, "station_info": station_info}, upsert=True)
+        for id_station, station_info in stations.items()
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    print(f"Nombre de stations enregistrées dans {collection.name} : {len(operations)}")
+
+def save_rejected_docs(rejected_docs, collection_name):
+    """Sauvegarde les documents rejetés sur S3."""
+    s3_object_key = f"rejected_doc/{collection_name}_rejected_docs.json"
+    rejected_json = json.dumps(rejected_docs, indent=4, default=str)
+    s3_client().put_object(Bucket=bucket_name, Key=s3_object_key, Body=rejected_json, ContentType="application/json")
+    print(f"Documents {collection_name} rejetés sauvegardés sur S3 : s3://{bucket_name}/{s3_object_key}")
+
+def print_worker_stats(worker_stats):
+    """Affiche le débit de chaque thread d'écriture (temps passé à écrire ses lots)."""
+    if len(worker_stats) < 2:
+        return
+    for stats in worker_stats:
+        throughput = stats["written"] / stats["elapsed"] if stats["elapsed"] else 0
+        print(f"  Thread {stats['worker']} : {stats['total']} documents, {stats['written']} écrits, "
+              f"{len(stats['rejected'])} rejetés, {throughput:.0f} docs/s")
+
+def insert_documents(collection, data, collection_name, batch_size=INSERT_BATCH_SIZE, write_concern=INSERT_WRITE_CONCERN,
+                     workers=LOAD_WORKERS, partition=LOAD_PARTITION):
+    """
+    Insère les documents par lots avec insert_many(ordered=False) : un document rejeté
+    n'interrompt pas le reste du lot. Avec plusieurs threads, les documents sont répartis
+    entre les threads (par station ou par empreinte), qui partagent le pool de connexions.
+
+    Paramètres :
+    - collection (Collection) : Collection MongoDB cible.
+    - data (iterable) : Documents à insérer.
+    - collection_name (str) : Nom utilisé pour les statistiques et le rapport S3 des rejets.
+    - batch_size (int) : Nombre de documents envoyés par aller-retour réseau.
+    - write_concern (str | int) : Write concern appliqué aux insertions ("majority", 1, ...).
+    - workers (int) : Nombre de threads d'écriture.
+    - partition (str) : Répartition des documents entre les threads ("station" ou "hash").
+
+    Retourne :
+    - tuple : (nombre de documents insérés, nombre de documents rejetés)
+    """
+    collection = collection.with_options(write_concern=parse_write_concern(write_concern))
+
+    def insert_batches(worker, batches):
+        stats = {"worker": worker, "total": 0, "written": 0, "rejected": [], "elapsed": 0.0}
+        for batch in batches:
+            batch_start = time.perf_counter()
+            stats["total"] += len(batch)
+            try:
+                result = collection.insert_many(batch, ordered=False)
+                stats["written"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Avec ordered=False, tous les documents valides du lot sont insérés
+                stats["written"] += e.details.get("nInserted", 0)
+                for error in e.details.get("writeErrors", []):
+                    doc = error.get("op", batch[error["index"]])
+                    print(f"Document rejeté : {doc} - Erreur : {error.get('errmsg')}")
+                    stats["rejected"].append(doc)
+            stats["elapsed"] += time.perf_counter() - batch_start
+        return stats
+
+    start_time = time.perf_counter()
+    worker_stats = write_in_threads(data, insert_batches, workers, partition, batch_size)
+    elapsed_time = time.perf_counter() - start_time
+
+    total_docs = sum(stats["total"] for stats in worker_stats)
+    inserted_count = sum(stats["written"] for stats in worker_stats)
+    rejected_docs = [doc for stats in worker_stats for doc in stats["rejected"]]
     success_rate = (inserted_count / total_docs) * 100 if total_docs else 0
+    throughput = inserted_count / elapsed_time if elapsed_time else 0
     print(f"\n{collection_name.upper()}: ")
     print(f"Total de documents dans le fichier : {total_docs}")
     print(f"Nombre de documents insérés : {inserted_count}")
     print(f"Nombre de documents rejetés : {len(rejected_docs)}")
     print(f"Taux de succès de l'insertion : {success_rate:.2f}%")
+    print(f"Débit d'insertion : {throughput:.0f} docs/s (lots de {batch_size}, w={write_concern}, {len(worker_stats)} thread(s))")
+    print_worker_stats(worker_stats)
 
     if rejected_docs:
-        s3_object_key = f"rejected_doc/{collection_name}_rejected_docs.json"
-        rejected_json = json.dumps(rejected_docs, indent=4, default=str)
-        s3.put_object(Bucket=bucket_name, Key=s3_object_key, Body=rejected_json, ContentType="application/json")
-        print(f"Documents {collection_name} rejetés sauvegardés sur S3 : s3://{bucket_name}/{s3_object_key}")
+        save_rejected_docs(rejected_docs, collection_name)
     
     return inserted_count, len(rejected_docs)
 
-insert_documents(weather_data_collection, weather_data, "weather_data")
-# %%
+def upsert_documents(collection, metadata_collection, data, collection_name, batch_size=INSERT_BATCH_SIZE, write_concern=INSERT_WRITE_CONCERN,
+                     workers=LOAD_WORKERS, partition=LOAD_PARTITION):
+    """
+    Charge de façon incrémentale les documents, identifiés par (id_station, datetime) :
+    - les relevés antérieurs au dernier datetime chargé pour la station sont ignorés ;
+    - les relevés dont l'empreinte est identique à celle stockée en base sont ignorés ;
+    - les autres sont insérés ou remplacés par lots avec bulk_write(ordered=False) ;
+    - le dernier datetime chargé d'une station n'avance pas si l'un de ses relevés est rejeté.
+    Avec plusieurs threads, chaque thread suit ses propres derniers datetime et plages écrites,
+    fusionnés à la fin du chargement.
+
+    Paramètres :
+    - collection (Collection) : Collection MongoDB cible.
+    - metadata_collection (Collection) : Collection des derniers datetime chargés par station.
+    - data (iterable) : Documents à charger.
+    - collection_name (str) : Nom utilisé pour les statistiques et le rapport S3 des rejets.
+    - batch_size (int) : Nombre de documents envoyés par aller-retour réseau.
+    - write_concern (str | int) : Write concern appliqué aux écritures ("majority", 1, ...).
+    - workers (int) : Nombre de threads d'écriture.
+    - partition (str) : Répartition des documents entre les threads ("station" ou "hash").
+
+    Retourne :
+    - tuple : (nombre de documents écrits, nombre de documents rejetés)
+    """
+    collection = collection.with_options(write_concern=parse_write_concern(write_concern))
+    high_water_marks = {mark["_id"]: mark["last_datetime"] for mark in metadata_collection.find()}
+
+    def upsert_batches(worker, batches):
+        stats = {
+            "worker": worker, "total": 0, "written": 0, "rejected": [], "elapsed": 0.0,
+            "skipped": 0, "unchanged": 0, "upserted": 0, "modified": 0,
+            "high_water_marks": {}, "written_ranges": {}, "rejected_stations": set(),
+        }
+        new_high_water_marks = stats["high_water_marks"]
+        written_ranges = stats["written_ranges"]
+
+        for batch in batches:
+            batch_start = time.perf_counter()
+            stats["total"] += len(batch)
+
+            # Relevés postérieurs (ou égaux) au dernier datetime chargé pour leur station
+            candidates = [doc for doc in batch if doc["datetime"] >= high_water_marks.get(doc["id_station"], "")]
+            stats["skipped"] += len(batch) - len(candidates)
+            if not candidates:
+                continue
+
+            # Empreintes déjà stockées pour ces relevés, en une seule requête
+            datetimes_by_station = {}
+            for doc in candidates:
+                doc["content_hash"] = content_hash(doc)
+                datetimes_by_station.setdefault(doc["id_station"], []).append(doc["datetime"])
+            existing_hashes = {
+                (doc["id_station"], doc["datetime"]): doc.get("content_hash")
+                for doc in collection.find(
+                    {"$or": [{"id_station": id_station, "datetime": {"$in": datetimes}} for id_station, datetimes in datetimes_by_station.items()]},
+                    {"_id": 0, "id_station": 1, "datetime": 1, "content_hash": 1}
+                )
+            }
+
+            operations = []
+            operation_docs = []
+            loaded_docs = []  # Relevés inchangés ou écrits, qui font avancer le dernier datetime chargé
+            for doc in candidates:
+                if existing_hashes.get((doc["id_station"], doc["datetime"])) == doc["content_hash"]:
+                    stats["unchanged"] += 1
+                    loaded_docs.append(doc)
+                    continue
+                operations.append(ReplaceOne({"id_station": doc["id_station"], "datetime": doc["datetime"]}, doc, upsert=True))
+                operation_docs.append(doc)
+                first, last = written_ranges.get(doc["id_station"], (doc["datetime"], doc["datetime"]))
+                written_ranges[doc["id_station"]] = (min(first, doc["datetime"]), max(last, doc["datetime"]))
+
+            if operations:
+                rejected_indexes = set()
+                try:
+                    result = collection.bulk_write(operations, ordered=False)
+                    stats["upserted"] += result.upserted_count
+                    stats["modified"] += result.modified_count
+                except BulkWriteError as e:
+                    stats["upserted"] += e.details.get("nUpserted", 0)
+                    stats["modified"] += e.details.get("nModified", 0)
+                    for error in e.details.get("writeErrors", []):
+                        rejected_indexes.add(error["index"])
+                        doc = operation_docs[error["index"]]
+                        print(f"Document rejeté : {doc} - Erreur : {error.get('errmsg')}")
+                        stats["rejected"].append(doc)
+                        stats["rejected_stations"].add(doc["id_station"])
+                loaded_docs.extend(doc for index, doc in enumerate(operation_docs) if index not in rejected_indexes)
+
+            for doc in loaded_docs:
+                if doc["datetime"] > new_high_water_marks.get(doc["id_station"], ""):
+                    new_high_water_marks[doc["id_station"]] = doc["datetime"]
+            stats["written"] = stats["upserted"] + stats["modified"]
+            stats["elapsed"] += time.perf_counter() - batch_start
+        return stats
+
+    start_time = time.perf_counter()
+    worker_stats = write_in_threads(data, upsert_batches, workers, partition, batch_size)
+    elapsed_time = time.perf_counter() - start_time
+
+    # Fusion des derniers datetime et des plages écrites de chaque thread. Le dernier datetime d'une
+    # station dont un relevé a été rejeté n'avance pas : le relevé sera retenté au prochain chargement
+    # (les relevés déjà écrits seront alors reconnus inchangés grâce à leur empreinte)
+    rejected_stations = set().union(*(stats["rejected_stations"] for stats in worker_stats))
+    new_high_water_marks = dict(high_water_marks)
+    written_ranges = {}
+    for stats in worker_stats:
+        for id_station, last_datetime in stats["high_water_marks"].items():
+            if id_station in rejected_stations:
+                continue
+            new_high_water_marks[id_station] = max(new_high_water_marks.get(id_station, ""), last_datetime)
+        for id_station, (first, last) in stats["written_ranges"].items():
+            merged_first, merged_last = written_ranges.get(id_station, (first, last))
+            written_ranges[id_station] = (min(first, merged_first), max(last, merged_last))
+
+    save_high_water_marks(metadata_collection, {
+        id_station: last_datetime
+        for id_station, last_datetime in new_high_water_marks.items()
+        if high_water_marks.get(id_station) != last_datetime
+    }, written_ranges)
+
+    total_docs = sum(stats["total"] for stats in worker_stats)
+    upserted_count = sum(stats["upserted"] for stats in worker_stats)
+    modified_count = sum(stats["modified"] for stats in worker_stats)
+    rejected_docs = [doc for stats in worker_stats for doc in stats["rejected"]]
+    written_count = upserted_count + modified_count
+    success_rate = ((total_docs - len(rejected_docs)) / total_docs) * 100 if total_docs else 0
+    throughput = total_docs / elapsed_time if elapsed_time else 0
+    print(f"\n{collection_name.upper()} (incrémental): ")
+    print(f"Total de documents dans le fichier : {total_docs}")
+    print(f"Nombre de documents antérieurs au dernier chargement : {sum(stats['skipped'] for stats in worker_stats)}")
+    print(f"Nombre de documents inchangés : {sum(stats['unchanged'] for stats in worker_stats)}")
+    print(f"Nombre de documents insérés : {upserted_count}")
+    print(f"Nombre de documents mis à jour : {modified_count}")
+    print(f"Nombre de documents rejetés : {len(rejected_docs)}")
+    print(f"Taux de succès de l'insertion : {success_rate:.2f}%")
+    print(f"Débit de traitement : {throughput:.0f} docs/s (lots de {batch_size}, w={write_concern}, {len(worker_stats)} thread(s))")
+    print_worker_stats(worker_stats)
+
+    if rejected_docs:
+        save_rejected_docs(rejected_docs, collection_name)
+
+    return written_count, len(rejected_docs)
+
+#%%
+def main():
+    """Charge dans MongoDB les documents transformés par transform_data.py (voir LOAD_MODE)."""
+    check_load_settings()
+    profile = PipelineProfile("insert_data")
+    client = connect(MONGO_URI, **client_options())
+    db = client["weather_db"]  # Nom de la base de données
+    weather_data_collection, stations_collection, load_metadata_collection = setup_collections(db, profile)
+
+    # Relire les documents transformés au fil de l'eau, dans le format choisi (WEATHER_DATA_FORMAT)
+    weather_data = (doc for chunk in iter_weather_data(s3_client(), bucket_name, WEATHER_DATA_FORMAT) for doc in chunk)
+
+    load_started_at = datetime.now(timezone.utc)
+
+    with profile.stage("load") as metrics:
+        # Temps passé à relire le fichier S3 (le reste de l'étape est consacré aux écritures MongoDB)
+        weather_data = timed_iter(weather_data, metrics, "read_s")
+
+        # Stockage normalisé : station_info est retiré des relevés et chargé une seule fois dans stations
+        stations = {}
+        if STATIONS_LAYOUT == "normalized":
+            weather_data = split_stations(weather_data, stations)
+
+        if LOAD_MODE == "incremental":
+            written_count, rejected_count = upsert_documents(weather_data_collection, load_metadata_collection, weather_data, "weather_data")
+        else:
+            # Rechargement complet : les derniers datetime sont enregistrés pour les chargements incrémentaux suivants
+            # (sans content_hash, les relevés sont chargés tels que transformés)
+            high_water_marks = {}
+            documents = (to_storage_document(doc, STORAGE_LAYOUT) for doc in track_high_water_marks(weather_data, high_water_marks))
+            written_count, rejected_count = insert_documents(weather_data_collection, documents, "weather_data")
+            load_metadata_collection.delete_many({})
+            save_high_water_marks(load_metadata_collection, high_water_marks)
+        metrics.rows_out = written_count
+        metrics.details["rejected"] = rejected_count
+
+    if stations:
+        with profile.stage("save_stations", rows_in=len(stations)) as metrics:
+            save_stations(stations_collection, stations)
+            metrics.rows_out = len(stations)
+
+    # Agrégats journaliers et mensuels : seuls les jours et mois des stations écrites sont recalculés
+    if BUILD_ROLLUPS:
+        with profile.stage("rollups") as metrics:
+            start_time = time.perf_counter()
+            refreshed_stations = refresh_rollups(db, load_started_at, STORAGE_LAYOUT)
+            metrics.rows_out = refreshed_stations
+        print(f"Agrégats {DAILY_ROLLUP_COLLECTION_NAME} / {MONTHLY_ROLLUP_COLLECTION_NAME} mis à jour pour {refreshed_stations} stations en {time.perf_counter() - start_time:.2f} s")
+
+    # Profil de performance de l'exécution (résumé JSON, et profil / fichier Prometheus si configurés)
+    profile.write()
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# %%
+import functools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Journal JSON des mesures : une ligne par étape, puis un résumé en fin d'exécution
+logger = logging.getLogger("pipeline.metrics")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Fichier texte Prometheus optionnel (collecteur textfile de node_exporter), écrit en fin d'exécution :
+# un fichier par script, nommé d'après ce chemin (ex. pipeline.prom -> pipeline_insert_data.prom)
+PIPELINE_METRICS_TEXTFILE = os.getenv("PIPELINE_METRICS_TEXTFILE") or None
+
+# Répertoire optionnel du profil JSON complet de chaque exécution
+PIPELINE_PROFILE_DIR = os.getenv("PIPELINE_PROFILE_DIR") or None
+
+# Intervalle d'échantillonnage de la mémoire résidente pendant une étape (secondes)
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "0.05"))
+
+
+# %%
+# Mesure de la mémoire
+def current_rss_mb():
+    """Mémoire résidente actuelle du processus (Mo), ou son pic si /proc n'est pas disponible."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Pic de mémoire résidente (Mo) du processus et de ses processus enfants terminés."""
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak_kb / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class MemorySampler:
+    """Relève la mémoire résidente à intervalle régulier dans un thread et conserve le maximum."""
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+# %%
+# Contexte d'exécution des résultats enregistrés (benchmarks)
+def git_commit():
+    """Renvoie le commit courant (ou None hors dépôt git)."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# %%
+# Distribution des mesures répétées (latences, retards de réplication)
+def percentile(values, q):
+    """Percentile q (0 à 100) des valeurs, par interpolation linéaire ; None si la liste est vide."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# %%
+# Profil d'exécution
+def script_textfile(textfile, script):
+    """Chemin du fichier texte Prometheus d'un script : le nom du script est ajouté avant l'extension."""
+    root, extension = os.path.splitext(textfile)
+    return f"{root}_{script}{extension or '.prom'}"
+
+
+class StageMetrics:
+    """Mesures d'une étape ; rows_out est renseigné par le code mesuré."""
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_rss_mb = None
+        self.status = "ok"
+        self.details = {}  # Mesures complémentaires de l'étape (ex. temps de lecture S3)
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_s": round(self.rows_out / self.wall_s) if self.rows_out is not None and self.wall_s else None,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self.details.items()},
+        }
+
+
+def timed_iter(iterable, metrics, field):
+    """
+    Parcourt un itérable en cumulant dans metrics.details[field] le temps passé à produire
+    ses éléments : dans une étape qui lit et écrit au fil de l'eau, cela sépare la lecture
+    (téléchargement S3, analyse) du reste du traitement.
+    """
+    iterator = iter(iterable)
+    metrics.details.setdefault(field, 0.0)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            metrics.details[field] += time.perf_counter() - start
+        yield item
+
+
+class PipelineProfile:
+    """
+    Profil de performance d'une exécution : chaque étape mesurée (temps réel, temps CPU,
+    lignes en entrée et en sortie, pic de mémoire) est journalisée en JSON et conservée
+    pour le résumé, le profil JSON et le fichier texte Prometheus.
+    """
+    def __init__(self, script):
+        self.script = script
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Mesure un bloc de code comme une étape nommée.
+
+        Paramètres :
+        - name (str) : Nom de l'étape (ex. "extract", "transform", "load").
+        - rows_in (int) : Nombre de lignes en entrée, si connu.
+
+        Retourne :
+        - StageMetrics : Les mesures de l'étape, dont rows_out est à renseigner.
+        """
+        metrics = StageMetrics(name, rows_in)
+        sampler = MemorySampler()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            with sampler:
+                yield metrics
+        except BaseException:
+            metrics.status = "error"
+            raise
+        finally:
+            metrics.wall_s = time.perf_counter() - wall_start
+            metrics.cpu_s = time.process_time() - cpu_start
+            metrics.peak_rss_mb = sampler.peak
+            self.stages.append(metrics)
+            logger.info(json.dumps({"event": "stage", "script": self.script, **metrics.to_dict()}, ensure_ascii=False))
+
+    def instrument(self, name=None, rows_in=None, rows_out=len):
+        """
+        Décorateur : mesure chaque appel de la fonction comme une étape ; rows_out calcule
+        le nombre de lignes produites à partir du résultat (None pour ne pas compter).
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__, rows_in) as metrics:
+                    result = function(*args, **kwargs)
+                    metrics.rows_out = rows_out(result) if rows_out else None
+                return result
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Renvoie le profil complet de l'exécution."""
+        return {
+            "script": self.script,
+            "started_at": self.started_at.isoformat(),
+            "wall_s": round(sum(metrics.wall_s for metrics in self.stages), 4),
+            "peak_rss_mb": round(max((metrics.peak_rss_mb for metrics in self.stages), default=current_rss_mb()), 1),
+            "stages": [metrics.to_dict() for metrics in self.stages],
+        }
+
+    def to_prometheus(self):
+        """Renvoie les mesures au format d'exposition texte Prometheus."""
+        metrics = [
+            ("wall_seconds", "Temps réel de l'étape", "wall_s"),
+            ("cpu_seconds", "Temps CPU de l'étape", "cpu_s"),
+            ("rows_in", "Lignes en entrée de l'étape", "rows_in"),
+            ("rows_out", "Lignes en sortie de l'étape", "rows_out"),
+            ("peak_rss_megabytes", "Pic de mémoire résidente pendant l'étape", "peak_rss_mb"),
+        ]
+        lines = []
+        stages = self.summary()["stages"]
+        for metric, description, field in metrics:
+            lines.append(f"# HELP pipeline_stage_{metric} {description}")
+            lines.append(f"# TYPE pipeline_stage_{metric} gauge")
+            for stage in stages:
+                if stage[field] is not None:
+                    lines.append(f'pipeline_stage_{metric}{{script="{self.script}",stage="{stage["stage"]}"}} {stage[field]}')
+        lines.append("# HELP pipeline_last_run_timestamp_seconds Début de la dernière exécution")
+        lines.append("# TYPE pipeline_last_run_timestamp_seconds gauge")
+        lines.append(f'pipeline_last_run_timestamp_seconds{{script="{self.script}"}} {self.started_at.timestamp():.0f}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, textfile=PIPELINE_METRICS_TEXTFILE, profile_dir=PIPELINE_PROFILE_DIR):
+        """
+        Journalise le résumé de l'exécution et, si configurés, écrit le profil JSON et le fichier
+        texte Prometheus du script (voir script_textfile), remplacé de façon atomique pour le
+        collecteur textfile : les exécutions des autres scripts ne l'écrasent pas.
+        """
+        summary = self.summary()
+        logger.info(json.dumps({"event": "summary", **summary}, ensure_ascii=False))
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f"{self.script}_{self.started_at.strftime('%Y%m%dT%H%M%S')}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=4, ensure_ascii=False)
+
+        if textfile:
+            path = script_textfile(textfile, self.script)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(temporary_path, path)
+        return summary
+
@@ -0,0 +1,183 @@
+# %%
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+import boto3
+from s3_utils import WEATHER_DATA_FORMAT, iter_weather_data
+from mongo_utils import STATIONS_LAYOUT, STORAGE_LAYOUT, StationCache, connect, station_day_query, to_storage_document
+from queries import read_collection
+
+# Paramètres de connexion à MongoDB et bucket S3 des données transformées
+MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
+DB_NAME = "weather_db"
+COLLECTION_NAME = "weather_data"
+bucket_name = "p8-airbyte-greenandcoop"
+
+# Documents par lot du curseur MongoDB lors du calcul des empreintes
+INTEGRITY_BATCH_SIZE = int(os.getenv("INTEGRITY_BATCH_SIZE", "10000"))
+
+# Champs ajoutés par le chargement, absents des données transformées
+LOAD_ONLY_FIELDS = ("_id", "content_hash")
+
+DIGEST_MODULUS = 2 ** 64
+
+
+# %%
+# Empreintes des documents et des groupes (station, jour)
+def document_digest(doc):
+    """Empreinte 64 bits du contenu d'un document (hors champs ajoutés par le chargement)."""
+    content = {key: value for key, value in doc.items() if key not in LOAD_ONLY_FIELDS}
+    encoded = json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "big")
+
+
+def bucket_key(doc):
+    """Groupe (id_station, jour 'YYYY-MM-DD') d'un relevé, quel que soit le type stocké de datetime."""
+    value = doc["datetime"]
+    day = value.strftime("%Y-%m-%d") if isinstance(value, datetime) else value[:10]
+    return doc["id_station"], day
+
+
+def digest_buckets(docs):
+    """
+    Calcule en une passe, pour chaque groupe (station, jour), le nombre de documents et
+    la somme modulo 2**64 de leurs empreintes : le résultat ne dépend pas de l'ordre de lecture.
+
+    Retourne :
+    - dict : {(id_station, jour): (nombre de documents, empreinte du groupe)}
+    """
+    buckets = {}
+    for doc in docs:
+        key = bucket_key(doc)
+        count, digest = buckets.get(key, (0, 0))
+        buckets[key] = (count + 1, (digest + document_digest(doc)) % DIGEST_MODULUS)
+    return buckets
+
+
+def mismatched_buckets(expected, actual):
+    """Renvoie, triés, les groupes dont le nombre de documents ou l'empreinte diffère."""
+    return sorted(key for key in expected.keys() | actual.keys() if expected.get(key) != actual.get(key))
+
+
+# %%
+# Lecture des deux côtés
+def json_documents(json_chunks, storage_layout=STORAGE_LAYOUT, buckets=None):
+    """
+    Parcourt les documents transformés, bloc par bloc, au type stocké en base ;
+    seulement ceux des groupes indiqués si buckets est renseigné.
+    """
+    for chunk in json_chunks():
+        for doc in chunk:
+            doc = to_storage_document(doc, storage_layout)
+            if buckets is None or bucket_key(doc) in buckets:
+                yield doc
+
+
+def mongo_documents(collection, query=None, stations_layout=STATIONS_LAYOUT, station_cache=None,
+                    batch_size=INTEGRITY_BATCH_SIZE):
+    """
+    Parcourt les relevés de MongoDB avec un curseur par lots, sans les champs ajoutés par le
+    chargement ; station_info est rattaché depuis le cache des stations en stockage normalisé.
+    """
+    projection = {field: 0 for field in LOAD_ONLY_FIELDS}
+    for doc in collection.find(query or {}, projection, batch_size=batch_size):
+        yield station_cache.attach(doc) if stations_layout == "normalized" else doc
+
+
+def diff_bucket(expected_docs, actual_docs):
+    """
+    Compare document par document les relevés d'un groupe, identifiés par (id_station, datetime).
+
+    Retourne :
+    - dict : Les datetime manquants dans MongoDB, en trop dans MongoDB, et dont le contenu diffère.
+    """
+    expected = {str(doc["datetime"]): document_digest(doc) for doc in expected_docs}
+    actual = {str(doc["datetime"]): document_digest(doc) for doc in actual_docs}
+    return {
+        "missing": sorted(expected.keys() - actual.keys()),
+        "unexpected": sorted(actual.keys() - expected.keys()),
+        "different": sorted(key for key in expected.keys() & actual.keys() if expected[key] != actual[key]),
+    }
+
+
+# %%
+def verify_integrity(json_chunks, collection, storage_layout=STORAGE_LAYOUT, stations_layout=STATIONS_LAYOUT,
+                     station_cache=None, batch_size=INTEGRITY_BATCH_SIZE):
+    """
+    Vérifie l'intégrité de tous les documents : les empreintes par station et par jour sont
+    calculées en une lecture des données transformées et un curseur par lots sur MongoDB,
+    puis seuls les groupes dont l'empreinte diffère sont comparés document par document.
+
+    Paramètres :
+    - json_chunks (callable) : Renvoie un itérable de blocs de documents transformés (relu pour le détail).
+    - collection (Collection) : Collection weather_data.
+    - storage_layout (str) : "standard" ou "timeseries".
+    - stations_layout (str) : "embedded" ou "normalized".
+    - station_cache (StationCache) : Cache des stations, requis en stockage normalisé.
+    - batch_size (int) : Documents par lot du curseur MongoDB.
+
+    Retourne :
+    - dict : Nombre de documents et de groupes de chaque côté, groupes en écart avec leur détail, durée.
+    """
+    start = time.perf_counter()
+    if stations_layout == "normalized" and station_cache is None:
+        station_cache = StationCache(collection.database)
+
+    expected = digest_buckets(json_documents(json_chunks, storage_layout))
+    actual = digest_buckets(mongo_documents(collection, None, stations_layout, station_cache, batch_size))
+    mismatched = mismatched_buckets(expected, actual)
+
+    # Détail des seuls groupes en écart : une relecture filtrée des données transformées, une requête indexée par groupe
+    details = []
+    if mismatched:
+        expected_docs = {}
+        for doc in json_documents(json_chunks, storage_layout, set(mismatched)):
+            expected_docs.setdefault(bucket_key(doc), []).append(doc)
+        for id_station, day in mismatched:
+            query = station_day_query(id_station, day, storage_layout)
+            actual_docs = mongo_documents(collection, query, stations_layout, station_cache, batch_size)
+            details.append({
+                "id_station": id_station,
+                "day": day,
+                "json_count": expected.get((id_station, day), (0, 0))[0],
+                "mongo_count": actual.get((id_station, day), (0, 0))[0],
+                **diff_bucket(expected_docs.get((id_station, day), []), actual_docs),
+            })
+
+    return {
+        "json_documents": sum(count for count, _ in expected.values()),
+        "mongo_documents": sum(count for count, _ in actual.values()),
+        "json_buckets": len(expected),
+        "mongo_buckets": len(actual),
+        "mismatched": details,
+        "elapsed_s": round(time.perf_counter() - start, 3),
+    }
+
+
+# %%
+def main():
+    """Vérifie que tous les documents transformés sur S3 sont identiques dans MongoDB."""
+    # Configuration du logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    s3_client = boto3.client("s3")
+    client = connect(MONGO_URI)
+    # Parcours complet lu sur les secondaires (ANALYTIC_READ_PREFERENCE), pour laisser le primaire aux écritures
+    collection = read_collection(client[DB_NAME], COLLECTION_NAME, "analytic")
+    report = verify_integrity(lambda: iter_weather_data(s3_client, bucket_name, WEATHER_DATA_FORMAT), collection)
+    client.close()
+
+    logging.info(
+        f"Intégrité : {report['json_documents']} documents transformés, {report['mongo_documents']} dans MongoDB, "
+        f"{report['json_buckets']} groupes (station, jour) vérifiés en {report['elapsed_s']} s"
+    )
+    for bucket in report["mismatched"]:
+        logging.warning(f"Écart {bucket['id_station']} {bucket['day']} : {json.dumps(bucket, ensure_ascii=False)}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# %%
+import logging
+import os
+import queue
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+
+# Organisation du stockage de weather_data :
+# - "standard" : collection classique, datetime stocké en chaîne 'YYYY-MM-DD HH:MM:SS'
+# - "timeseries" : collection time-series, datetime stocké en date BSON et id_station en metaField
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "standard")
+STORAGE_LAYOUTS = ("standard", "timeseries")
+
+# Stockage des informations des stations :
+# - "embedded" : station_info copié dans chaque relevé de weather_data
+# - "normalized" : station_info stocké une seule fois dans la collection stations (_id = id_station)
+STATIONS_LAYOUT = os.getenv("STATIONS_LAYOUT", "embedded")
+STATIONS_LAYOUTS = ("embedded", "normalized")
+STATIONS_COLLECTION_NAME = "stations"
+
+# Collection des métadonnées de chargement (dernier datetime et dernière plage écrite par station)
+LOAD_METADATA_COLLECTION_NAME = "load_metadata"
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Répartition des documents entre les threads d'écriture du chargement parallèle :
+# - "station" : tous les relevés d'une station sont écrits par le même thread
+# - "hash" : répartition par empreinte de (id_station, datetime), plus homogène avec peu de stations
+LOAD_PARTITIONS = ("station", "hash")
+
+# Options de création de la collection time-series
+TIMESERIES_OPTIONS = {"timeField": "datetime", "metaField": "id_station", "granularity": "hours"}
+
+
+# %%
+# Connexion à MongoDB
+def connect(mongo_uri, **kwargs):
+    """
+    Se connecte à MongoDB (kwargs : options du MongoClient) et vérifie la connexion ;
+    arrête le programme en cas d'échec.
+    """
+    try:
+        client = MongoClient(mongo_uri, **kwargs)
+        client.admin.command('ping')
+        logging.info(f"\n Connexion réussie à MongoDB ({mongo_uri})")
+        return client
+    except ConnectionFailure as e:
+        logging.error(f"\n Impossible de se connecter à MongoDB : {e}")
+        exit(1)
+
+
+# %%
+# Définition des schémas : validation $jsonSchema des collections (bornes reprises par le profil qualité de la transformation)
+weather_data_schema = {
+    "validator": {
+        "$jsonSchema": {
+            "bsonType": "object",
+            "required": ["id_station", "datetime"],
+            "properties": {
+                "id_station": {"bsonType": "string"},
+                "station_info": {
+                    "bsonType": "object",
+                    "properties": {
+                        "name": {"bsonType": "string"},
+                        "latitude": {"bsonType": "double", "minimum": -90, "maximum": 90},
+                        "longitude": {"bsonType": "double", "minimum": -180, "maximum": 180},
+                        "elevation": {"bsonType": "int", "minimum": 0},
+                        "city": {"bsonType": "string"},
+                        "state": {"bsonType": "string"},
+                        "type": {"bsonType": ["string", "null"]},
+                        "hardware": {"bsonType": ["string", "null"]},
+                        "software": {"bsonType": ["string", "null"]},
+                        "license": {
+                            "bsonType": "object",
+                            "properties": {
+                                "license": {"bsonType": ["string", "null"]},
+                                "url": {"bsonType": ["string", "null"]},
+                                "source": {"bsonType": ["string", "null"]},
+                                "metadonnees": {"bsonType": ["string", "null"]},
+                            }
+                        }
+                    }
+                },
+                "datetime": {"bsonType": "string"},
+                # Empreinte du contenu, ajoutée uniquement par le chargement incrémental (LOAD_MODE=incremental)
+                "content_hash": {"bsonType": "string"},
+                "weather_data": {
+                    "bsonType": "object",
+                    "properties": {
+                        "temperature": {"bsonType": "double"},
+                        "pressure": {"bsonType": "double"},
+                        "humidity": {"bsonType": "int", "minimum": 0, "maximum": 100},
+                        "dew_point": {"bsonType": "double"},
+                        "visibility": {"bsonType": ["double", "null"], "minimum": 0},
+                        "wind_speed": {"bsonType": "double", "minimum": 0},
+                        "wind_gust": {"bsonType": ["double", "null"], "minimum": 0},
+                        "wind_direction": {"bsonType": ["double", "null"], "minimum": 0, "maximum": 337.5},
+                        "precip_1h": {"bsonType": ["double", "null"], "minimum": 0},
+                        "precip_3h": {"bsonType": ["double", "null"], "minimum": 0},
+                        "precip_accum": {"bsonType": ["double", "null"], "minimum": 0},
+                        "precip_rate": {"bsonType": ["double", "null"], "minimum": 0},
+                        "solar": {"bsonType": ["double", "null"], "minimum": 0},
+                        "uv": {"bsonType": ["int", "null"], "minimum": 0, "maximum": 11},
+                        "snow_depth": {"bsonType": ["double", "null"], "minimum": 0},
+                        "nebulosity": {"bsonType": ["double", "null"], "minimum": 0},
+                        "weather_wmo": {"bsonType": ["double", "null"], "minimum": 0}
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Collection stations du stockage normalisé : même validation de station_info que weather_data
+stations_schema = {
+    "validator": {
+        "$jsonSchema": {
+            "bsonType": "object",
+            "required": ["station_info"],
+            "properties": {
+                "station_info": weather_data_schema["validator"]["$jsonSchema"]["properties"]["station_info"]
+            }
+        }
+    }
+}
+
+
+# %%
+def check_storage_layout(storage_layout):
+    """Vérifie que l'organisation de stockage demandée est connue."""
+    if storage_layout not in STORAGE_LAYOUTS:
+        raise ValueError(f"Organisation de stockage inconnue : {storage_layout} (valeurs : {', '.join(STORAGE_LAYOUTS)})")
+
+
+def check_stations_layout(stations_layout):
+    """Vérifie que le stockage des stations demandé est connu."""
+    if stations_layout not in STATIONS_LAYOUTS:
+        raise ValueError(f"Stockage des stations inconnu : {stations_layout} (valeurs : {', '.join(STATIONS_LAYOUTS)})")
+
+
+def check_load_partition(partition):
+    """Vérifie que la répartition du chargement parallèle demandée est connue."""
+    if partition not in LOAD_PARTITIONS:
+        raise ValueError(f"Répartition du chargement inconnue : {partition} (valeurs : {', '.join(LOAD_PARTITIONS)})")
+
+
+def to_storage_datetime(value, storage_layout=STORAGE_LAYOUT):
+    """Convertit un datetime 'YYYY-MM-DD HH:MM:SS' (ou une date 'YYYY-MM-DD') au type stocké en base."""
+    check_storage_layout(storage_layout)
+    if storage_layout == "standard":
+        return value
+    return datetime.fromisoformat(value)
+
+
+def to_storage_document(doc, storage_layout=STORAGE_LAYOUT):
+    """Renvoie le document avec son champ datetime au type stocké en base."""
+    if storage_layout == "standard":
+        return doc
+    return {**doc, "datetime": to_storage_datetime(doc["datetime"], storage_layout)}
+
+
+def datetime_range_filter(start, end, storage_layout=STORAGE_LAYOUT):
+    """
+    Construit un filtre d'intervalle [start, end[ sur le champ datetime, exploitable
+    directement comme bornes d'index (contrairement à une expression régulière).
+
+    Paramètres :
+    - start (str) : Début inclus, 'YYYY-MM-DD' ou 'YYYY-MM-DD HH:MM:SS'.
+    - end (str) : Fin exclue, même format.
+    - storage_layout (str) : Organisation du stockage ("standard" ou "timeseries").
+
+    Retourne :
+    - dict : Le filtre {"$gte": ..., "$lt": ...}.
+    """
+    return {"$gte": to_storage_datetime(start, storage_layout), "$lt": to_storage_datetime(end, storage_layout)}
+
+
+def day_filter(day, storage_layout=STORAGE_LAYOUT):
+    """Construit le filtre datetime couvrant une journée 'YYYY-MM-DD'."""
+    next_day = (datetime.fromisoformat(day) + timedelta(days=1)).strftime("%Y-%m-%d")
+    return datetime_range_filter(day, next_day, storage_layout)
+
+
+def station_day_query(id_station, day, storage_layout=STORAGE_LAYOUT):
+    """Construit la requête des relevés d'une station pour une journée 'YYYY-MM-DD'."""
+    return {"id_station": id_station, "datetime": day_filter(day, storage_layout)}
+
+
+# %%
+# Index composé couvrant le principal motif d'accès (une station sur une période)
+COMPOUND_INDEX_KEYS = [("id_station", 1), ("datetime", 1)]
+# Index simple remplacé par le préfixe de l'index composé
+REDUNDANT_INDEX_KEYS = [("id_station", 1)]
+
+
+def ensure_indexes(collection, unique=False):
+    """
+    Crée les index de weather_data : l'index composé (id_station, datetime), qui sert aussi
+    les requêtes sur id_station seul, et un index datetime pour les requêtes multi-stations.
+    L'index simple id_station d'un chargement précédent est supprimé (redondant avec le préfixe
+    de l'index composé) ; si l'index composé existe déjà avec une autre option unique, il est recréé.
+
+    Paramètres :
+    - collection (Collection) : Collection weather_data.
+    - unique (bool) : Rend la clé (id_station, datetime) unique (nécessaire aux upserts).
+    """
+    for name, info in collection.index_information().items():
+        key = list(info["key"])
+        if key == REDUNDANT_INDEX_KEYS or (key == COMPOUND_INDEX_KEYS and info.get("unique", False) != unique):
+            collection.drop_index(name)
+
+    collection.create_index(COMPOUND_INDEX_KEYS, unique=unique)
+    collection.create_index([("datetime", 1)])
+
+
+def representative_queries(storage_layout=STORAGE_LAYOUT):
+    """
+    Renvoie les requêtes représentatives des accès aux données, sous forme de
+    tuples (libellé, filtre, tri).
+    """
+    return [
+        ("station + jour", station_day_query("ILAMAD25", "2024-10-02", storage_layout), None),
+        ("station + mois", {"id_station": "07015", "datetime": datetime_range_filter("2024-10-01", "2024-11-01", storage_layout)}, None),
+        ("station, derniers relevés", {"id_station": "IICHTE19"}, [("datetime", -1)]),
+        ("toutes stations + jour", {"datetime": day_filter("2024-10-02", storage_layout)}, None),
+        ("plusieurs stations + jour", {"id_station": {"$in": ["07015", "00052"]}, "datetime": day_filter("2024-10-02", storage_layout)}, None),
+    ]
+
+
+def find_index_names(plan):
+    """Renvoie les noms des index utilisés dans un plan d'exécution (parcours récursif)."""
+    if isinstance(plan, dict):
+        names = [plan["indexName"]] if "indexName" in plan else []
+        for value in plan.values():
+            names.extend(find_index_names(value))
+        return names
+    if isinstance(plan, list):
+        return [name for item in plan for name in find_index_names(item)]
+    return []
+
+
+def summarize_explain(explain):
+    """
+    Résume la sortie d'un explain("executionStats") : index choisi, documents et clés
+    examinés, documents renvoyés et temps d'exécution.
+    """
+    stats = explain["executionStats"]
+    index_names = find_index_names(explain["queryPlanner"]["winningPlan"])
+    return {
+        "index": ", ".join(dict.fromkeys(index_names)) or "COLLSCAN",
+        "docs_examined": stats["totalDocsExamined"],
+        "keys_examined": stats["totalKeysExamined"],
+        "returned": stats["nReturned"],
+        "time_ms": stats["executionTimeMillis"],
+    }
+
+
+def explain_query(collection, query, sort=None):
+    """Exécute explain("executionStats") sur une requête find et renvoie son résumé."""
+    command = {"find": collection.name, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    explain = collection.database.command("explain", command, verbosity="executionStats")
+    return summarize_explain(explain)
+
+
+# %%
+def station_lookup_pipeline(query, sort=None):
+    """
+    Construit le pipeline d'agrégation qui filtre weather_data puis rejoint station_info
+    depuis la collection stations ($lookup sur _id = id_station).
+    """
+    pipeline = [{"$match": query}]
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    pipeline += [
+        {"$lookup": {"from": STATIONS_COLLECTION_NAME, "localField": "id_station", "foreignField": "_id", "as": "station"}},
+        {"$set": {"station_info": {"$ifNull": [{"$arrayElemAt": ["$station.station_info", 0]}, {}]}}},
+        {"$unset": "station"},
+    ]
+    return pipeline
+
+
+class StationCache:
+    """
+    Cache en mémoire de la collection stations, chargé à la première utilisation,
+    qui rattache station_info aux relevés sans requête supplémentaire.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._stations = None
+
+    @property
+    def stations(self):
+        if self._stations is None:
+            self._stations = {
+                station["_id"]: station["station_info"]
+                for station in self.db[STATIONS_COLLECTION_NAME].find()
+            }
+        return self._stations
+
+    def invalidate(self):
+        """Oublie les stations en cache (à appeler après un rechargement des stations)."""
+        self._stations = None
+
+    def attach(self, doc):
+        """Ajoute station_info à un relevé de weather_data."""
+        doc["station_info"] = self.stations.get(doc["id_station"], {})
+        return doc
+
+
+def find_weather_data(collection, query, sort=None, stations_layout=STATIONS_LAYOUT, station_cache=None):
+    """
+    Renvoie les relevés correspondant à la requête avec leur station_info, quel que soit
+    le stockage des stations.
+
+    Paramètres :
+    - collection (Collection) : Collection weather_data.
+    - query (dict) : Filtre de la requête.
+    - sort (list) : Tri optionnel, liste de (champ, sens).
+    - stations_layout (str) : "embedded" ou "normalized".
+    - station_cache (StationCache) : Cache des stations ; si absent en mode "normalized",
+      station_info est rejoint côté serveur avec $lookup.
+
+    Retourne :
+    - list : Les documents.
+    """
+    check_stations_layout(stations_layout)
+    if stations_layout == "embedded" or station_cache is not None:
+        cursor = collection.find(query, sort=sort)
+        if stations_layout == "embedded":
+            return list(cursor)
+        return [station_cache.attach(doc) for doc in cursor]
+    return list(collection.aggregate(station_lookup_pipeline(query, sort)))
+
+
+# %%
+# Chargement parallèle : répartition des documents entre plusieurs threads d'écriture
+def partition_index(doc, workers, partition="station"):
+    """Renvoie le numéro du thread d'écriture d'un document (stable d'une exécution à l'autre)."""
+    key = doc["id_station"] if partition == "station" else f"{doc['id_station']}|{doc['datetime']}"
+    return zlib.crc32(str(key).encode("utf-8")) % workers
+
+
+def write_in_threads(data, write_batches, workers, partition="station", batch_size=1000, queue_size=2):
+    """
+    Répartit les documents entre plusieurs threads d'écriture. Chaque thread reçoit ses lots
+    dans une file bornée (la lecture ne prend pas d'avance sur l'écriture) et les passe à
+    write_batches. Avec un seul thread, les lots sont écrits directement, sans file.
+
+    Paramètres :
+    - data (iterable) : Documents à écrire.
+    - write_batches (callable) : Fonction (numéro du thread, itérable de lots) -> résultat du thread.
+    - workers (int) : Nombre de threads d'écriture.
+    - partition (str) : "station" ou "hash" (voir LOAD_PARTITIONS).
+    - batch_size (int) : Nombre de documents par lot.
+    - queue_size (int) : Nombre de lots en attente au plus par thread.
+
+    Retourne :
+    - list : Les résultats de write_batches, dans l'ordre des threads.
+    """
+    check_load_partition(partition)
+    workers = max(1, workers)
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+
+    def split_batches():
+        buffers = [[] for _ in range(workers)]
+        for doc in data:
+            index = partition_index(doc, workers, partition) if workers > 1 else 0
+            buffers[index].append(doc)
+            if len(buffers[index]) >= batch_size:
+                yield index, buffers[index]
+                buffers[index] = []
+        for index, buffer in enumerate(buffers):
+            if buffer:
+                yield index, buffer
+
+    if workers == 1:
+        return [write_batches(0, (batch for _, batch in split_batches()))]
+
+    def run_worker(index):
+        batches = iter(queues[index].get, None)
+        try:
+            return write_batches(index, batches)
+        finally:
+            # En cas d'erreur, vider la file pour ne pas bloquer la répartition des autres lots
+            for _ in batches:
+                pass
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker, index) for index in range(workers)]
+        try:
+            for index, batch in split_batches():
+                queues[index].put(batch)
+        finally:
+            for batch_queue in queues:
+                batch_queue.put(None)
+        return [future.result() for future in futures]
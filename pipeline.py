@@ -0,0 +1,113 @@
+# %%
+import argparse
+import os
+
+# Les modules du pipeline (pandas, boto3, pymongo) ne sont importés que par la sous-commande
+# qui en a besoin : leur configuration est lue à l'import, après application des options.
+
+
+# %%
+def apply_settings(settings):
+    """Applique les options de la ligne de commande aux variables d'environnement lues à l'import des modules."""
+    for name, value in settings.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+
+def run_extract(args):
+    """Télécharge et analyse les données Airbyte, enregistrées localement pour la transformation."""
+    import transform_data
+    transform_data.main(extract_only=True)
+
+
+def run_transform(args):
+    """Transforme les données (en reprenant l'extraction enregistrée avec --resume) et les sauvegarde sur S3."""
+    import transform_data
+    transform_data.main(resume=args.resume)
+
+
+def run_load(args):
+    """Charge dans MongoDB le fichier intermédiaire sauvegardé sur S3 par la transformation."""
+    import insert_data
+    insert_data.main()
+
+
+def run_probe(args):
+    """Mesure l'accès aux données, vérifie la couverture des index et l'intégrité des données, mesure le retard de réplication."""
+    if args.check in ("all", "accessibility"):
+        import data_accessibility
+        data_accessibility.main(benchmark=args.benchmark)
+    if args.check in ("all", "indexes"):
+        import index_advisor
+        index_advisor.main()
+    if args.check in ("all", "integrity"):
+        import integrity
+        integrity.main()
+    if args.check in ("all", "replication"):
+        import replication
+        replication.main()
+
+
+def run_export(args):
+    """Exporte les relevés de MongoDB en parquet, un fichier par station et par mois."""
+    import export
+    export.main(export.EXPORT_DIR, args.stations, args.start_month, args.end_month)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pipeline", description="Pipeline de données météo : Airbyte (S3) -> MongoDB")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help=run_extract.__doc__)
+    extract.set_defaults(function=run_extract)
+
+    transform = subparsers.add_parser("transform", help=run_transform.__doc__)
+    transform.add_argument("--resume", action="store_true", help="Reprendre à partir de l'extraction enregistrée (PIPELINE_CACHE_DIR)")
+    transform.add_argument("--max-workers", dest="TRANSFORM_MAX_WORKERS", type=int, help="Processus de transformation par station")
+    transform.set_defaults(function=run_transform)
+
+    load = subparsers.add_parser("load", help=run_load.__doc__)
+    load.add_argument("--mode", dest="LOAD_MODE", choices=["full", "incremental"], help="Mode de chargement")
+    load.add_argument("--workers", dest="LOAD_WORKERS", type=int, help="Threads d'écriture")
+    load.add_argument("--batch-size", dest="INSERT_BATCH_SIZE", type=int, help="Documents par lot")
+    load.set_defaults(function=run_load)
+
+    probe = subparsers.add_parser("probe", help=run_probe.__doc__)
+    probe.add_argument("--check", choices=["all", "accessibility", "indexes", "integrity", "replication"], default="all")
+    probe.add_argument("--benchmark", action="store_true", help="Latences p50/p95/p99 et débit du mélange de requêtes (accessibility)")
+    probe.add_argument("--iterations", dest="ACCESS_BENCHMARK_ITERATIONS", type=int, help="Requêtes mesurées par type")
+    probe.add_argument("--warmup", dest="ACCESS_BENCHMARK_WARMUP", type=int, help="Requêtes d'échauffement par type")
+    probe.add_argument("--threads", dest="ACCESS_BENCHMARK_THREADS", type=int, help="Requêtes concurrentes")
+    probe.add_argument("--queries", dest="ACCESS_BENCHMARK_QUERIES", help="Types de requêtes, séparés par des virgules")
+    probe.add_argument("--read-preferences", dest="ACCESS_BENCHMARK_READ_PREFERENCES",
+                       help="Préférences de lecture comparées, séparées par des virgules")
+    probe.add_argument("--writes", dest="REPLICATION_PROBE_WRITES", type=int, help="Écritures mesurées par la sonde de réplication")
+    probe.add_argument("--wait", dest="REPLICATION_WAIT", choices=["session", "poll"], help="Attente de la réplication")
+    probe.set_defaults(function=run_probe)
+
+    export = subparsers.add_parser("export", help=run_export.__doc__)
+    export.add_argument("--output-dir", dest="EXPORT_DIR", help="Répertoire de l'export parquet")
+    export.add_argument("--stations", nargs="+", help="Stations exportées (toutes par défaut)")
+    export.add_argument("--start-month", help="Premier mois exporté, YYYY-MM")
+    export.add_argument("--end-month", help="Dernier mois exporté, YYYY-MM")
+    export.add_argument("--engine", dest="EXPORT_ENGINE", choices=["auto", "pymongoarrow", "cursor"], help="Moteur de lecture en colonnes")
+    export.set_defaults(function=run_export)
+
+    # Options partagées : format du fichier intermédiaire (écrit par transform, lu par load)
+    # et répertoire de l'extraction enregistrée (écrite par extract, reprise par transform)
+    for subparser in (transform, load):
+        subparser.add_argument("--format", dest="WEATHER_DATA_FORMAT", choices=["json", "jsonl.gz", "parquet"],
+                               help="Format du fichier intermédiaire")
+    for subparser in (extract, transform):
+        subparser.add_argument("--cache-dir", dest="PIPELINE_CACHE_DIR", help="Répertoire des étapes intermédiaires")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    apply_settings({name: value for name, value in vars(args).items() if name.isupper()})
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# %%
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from mongo_utils import (
+    DATETIME_FORMAT, LOAD_METADATA_COLLECTION_NAME, STATIONS_LAYOUT, STORAGE_LAYOUT,
+    datetime_range_filter, find_weather_data
+)
+from rollups import DAILY_ACCUMULATORS, DAILY_ROLLUP_COLLECTION_NAME, MONTHLY_ROLLUP_COLLECTION_NAME, day_expression
+
+# Paramètres du cache des résultats de requêtes
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))  # Nombre maximum de résultats conservés
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))  # Durée de vie d'un résultat, en secondes
+QUERY_CACHE_SYNC_INTERVAL = float(os.getenv("QUERY_CACHE_SYNC_INTERVAL", "5"))  # Délai entre deux lectures de load_metadata
+
+# Routage des lectures sur le replica set : requêtes opérationnelles (relevés d'une station) et analytiques
+# (agrégations, parcours complets), lues par défaut sur les secondaires pour laisser le primaire aux écritures
+READ_PREFERENCE = os.getenv("READ_PREFERENCE", "primary")
+ANALYTIC_READ_PREFERENCE = os.getenv("ANALYTIC_READ_PREFERENCE", "secondaryPreferred")
+READ_MAX_STALENESS_SECONDS = int(os.getenv("READ_MAX_STALENESS_SECONDS", "-1"))  # -1 : pas de limite (sinon au moins 90 s)
+READ_TAG_SETS = json.loads(os.getenv("READ_TAG_SETS", "null"))  # Ex. '[{"usage": "analytics"}, {}]'
+READ_FALLBACK_LAG_SECONDS = float(os.getenv("READ_FALLBACK_LAG_SECONDS", "10"))  # Retard au-delà duquel on lit le primaire
+READ_LAG_CHECK_INTERVAL = float(os.getenv("READ_LAG_CHECK_INTERVAL", "5"))  # Délai entre deux mesures du retard
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+# %%
+def normalize_datetime(value):
+    """Normalise une date 'YYYY-MM-DD' ou un datetime en chaîne 'YYYY-MM-DD HH:MM:SS'."""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return value.strftime(DATETIME_FORMAT)
+
+
+class QueryCache:
+    """
+    Cache LRU des résultats de requêtes, avec durée de vie limitée.
+
+    Chaque résultat est rattaché à une station et à un intervalle [start, end[ pour pouvoir
+    être invalidé quand le chargeur écrit des relevés de cette station dans cet intervalle.
+    Les résultats renvoyés sont partagés entre les appels et ne doivent pas être modifiés.
+    Le cache est partagé entre threads (benchmark concurrent, requêtes depuis un pool) :
+    ses entrées et ses compteurs ne sont modifiés que sous verrou.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # clé -> (expiration, id_station, start, end, résultat)
+        self.hits = 0
+        self.misses = 0
+        self.synced_at = None  # Dernier updated_at de load_metadata pris en compte
+        self._next_sync = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Renvoie le résultat en cache pour la clé, ou None (absent ou expiré)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[4]
+
+    def set(self, key, value, id_station, start, end, ttl=None):
+        """
+        Conserve un résultat pendant ttl secondes (au plus la durée de vie du cache), en évinçant
+        le moins récemment utilisé si le cache est plein.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, id_station, start, end, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, id_station=None, start=None, end=None):
+        """
+        Supprime les résultats de la station (toutes si None) qui recoupent l'intervalle
+        écrit [start, end] (tout l'historique si les bornes sont None). Renvoie le nombre
+        de résultats supprimés.
+        """
+        with self._lock:
+            stale_keys = [
+                key for key, (_, entry_station, entry_start, entry_end, _) in self._entries.items()
+                if (id_station is None or entry_station == id_station)
+                and (end is None or entry_start <= end)
+                and (start is None or start < entry_end)
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+            return len(stale_keys)
+
+    def sync_invalidations(self, db, force=False):
+        """
+        Invalide les résultats touchés par les écritures du chargeur, en lisant dans load_metadata
+        les stations mises à jour depuis la dernière synchronisation (au plus une lecture
+        tous les QUERY_CACHE_SYNC_INTERVAL secondes, par un seul thread à la fois).
+        """
+        with self._lock:
+            if not force and self.clock() < self._next_sync:
+                return
+            self._next_sync = self.clock() + QUERY_CACHE_SYNC_INTERVAL
+            synced_at = self.synced_at
+
+        # Lecture de load_metadata hors verrou : les autres threads continuent d'utiliser le cache
+        query = {} if synced_at is None else {"updated_at": {"$gt": synced_at}}
+        written_ranges = []
+        latest = synced_at
+        for metadata in db[LOAD_METADATA_COLLECTION_NAME].find(query):
+            written_ranges.append((metadata["_id"], metadata.get("written_from"), metadata.get("written_to")))
+            if latest is None or metadata["updated_at"] > latest:
+                latest = metadata["updated_at"]
+
+        if synced_at is not None:
+            for id_station, written_from, written_to in written_ranges:
+                self.invalidate(id_station, written_from, written_to)
+        with self._lock:
+            if latest is not None and (self.synced_at is None or latest > self.synced_at):
+                self.synced_at = latest
+
+    def stats(self):
+        """Renvoie les compteurs du cache."""
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups * 100, 2) if lookups else 0,
+            "size": size,
+        }
+
+
+# Cache partagé par défaut
+query_cache = QueryCache()
+
+
+# %%
+def read_preference(mode, tag_sets=READ_TAG_SETS, max_staleness=READ_MAX_STALENESS_SECONDS):
+    """
+    Construit la préférence de lecture pymongo d'un mode ("primary", "secondaryPreferred", etc.),
+    avec ses tag sets et son maxStalenessSeconds (ignorés pour "primary").
+    """
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Préférence de lecture inconnue : {mode} (préférences : {', '.join(READ_PREFERENCES)})")
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCES[mode](tag_sets=tag_sets, max_staleness=max_staleness)
+
+
+class ReadRouter:
+    """
+    Choisit la préférence de lecture de chaque requête selon son type ("operational" ou
+    "analytic"), et revient au primaire quand un secondaire a plus de max_lag secondes de
+    retard : le retard est relu avec replSetGetStatus au plus toutes les check_interval secondes.
+    """
+
+    def __init__(self, preferences=None, max_lag=READ_FALLBACK_LAG_SECONDS, check_interval=READ_LAG_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.preferences = preferences or {"operational": READ_PREFERENCE, "analytic": ANALYTIC_READ_PREFERENCE}
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lag = None  # Retard du secondaire le plus en retard (secondes), None si inconnu
+        self.fallbacks = 0
+        self._next_check = 0
+
+    def replication_lag(self, client):
+        """Renvoie le retard (secondes) du secondaire le plus en retard sur le primaire, mis en cache."""
+        if self.clock() < self._next_check:
+            return self.lag
+        self._next_check = self.clock() + self.check_interval
+        try:
+            members = client.admin.command("replSetGetStatus")["members"]
+        except PyMongoError as e:
+            logging.warning(f"Retard de réplication inconnu, pas de repli sur le primaire : {e}")
+            self.lag = None
+            return self.lag
+        primary = [member["optimeDate"] for member in members if member["stateStr"] == "PRIMARY"]
+        secondaries = [member["optimeDate"] for member in members if member["stateStr"] == "SECONDARY"]
+        self.lag = (primary[0] - min(secondaries)).total_seconds() if primary and secondaries else None
+        return self.lag
+
+    def route(self, db, kind="operational"):
+        """Renvoie la préférence de lecture d'une requête du type donné."""
+        mode = self.preferences.get(kind, READ_PREFERENCE)
+        if mode != "primary" and self.max_lag is not None:
+            lag = self.replication_lag(db.client)
+            if lag is not None and lag > self.max_lag:
+                self.fallbacks += 1
+                mode = "primary"
+        return read_preference(mode)
+
+    def collection(self, db, name, kind="operational"):
+        """Renvoie la collection configurée avec la préférence de lecture du type de requête."""
+        return db.get_collection(name, read_preference=self.route(db, kind))
+
+
+# Routeur partagé par défaut
+read_router = ReadRouter()
+
+
+def resolve_read_preference(db, kind="operational", read_preference=None, router=None):
+    """Renvoie la préférence de lecture fournie (objet pymongo), sinon celle du routeur pour ce type de requête."""
+    if read_preference is not None:
+        return read_preference
+    return (router or read_router).route(db, kind)
+
+
+def read_collection(db, name, kind="operational", read_preference=None, router=None):
+    """Renvoie la collection à interroger avec la préférence de lecture de la requête (voir resolve_read_preference)."""
+    return db.get_collection(name, read_preference=resolve_read_preference(db, kind, read_preference, router))
+
+
+def cache_ttl(preference, router=None):
+    """
+    Renvoie la durée de vie en cache (secondes) d'un résultat lu avec cette préférence : None
+    (QUERY_CACHE_TTL) pour le primaire, sinon au plus le retard toléré par le routeur (max_lag)
+    ou le maxStalenessSeconds de la préférence, pour ne pas servir plus longtemps un secondaire en retard.
+    """
+    if preference.mongos_mode == "primary":
+        return None
+    bounds = [(router or read_router).max_lag, preference.max_staleness if preference.max_staleness >= 0 else None]
+    bounds = [bound for bound in bounds if bound is not None]
+    return min(bounds) if bounds else READ_FALLBACK_LAG_SECONDS
+
+
+def cached_query(db, cache, key, id_station, start, end, run_query, preference=None):
+    """
+    Renvoie le résultat en cache pour la clé et la préférence de lecture, ou exécute la requête
+    et le met en cache. Les lectures sur un secondaire sont conservées au plus cache_ttl(preference)
+    secondes, et invalidées comme les autres par sync_invalidations.
+    """
+    if cache is None:
+        return run_query()
+    preference = preference or Primary()
+    key = (*key, preference.mongos_mode)
+    cache.sync_invalidations(db)
+    result = cache.get(key)
+    if result is None:
+        result = run_query()
+        cache.set(key, result, id_station, start, end, ttl=cache_ttl(preference))
+    return result
+
+
+def get_hourly(db, id_station, start, end, cache=query_cache, storage_layout=STORAGE_LAYOUT, stations_layout=STATIONS_LAYOUT,
+               read_preference=None):
+    """
+    Renvoie les relevés horaires d'une station sur l'intervalle [start, end[, triés par datetime.
+
+    Paramètres :
+    - db (Database) : Base weather_db.
+    - id_station (str) : Identifiant de la station.
+    - start (str) : Début inclus, 'YYYY-MM-DD' ou 'YYYY-MM-DD HH:MM:SS'.
+    - end (str) : Fin exclue, même format.
+    - cache (QueryCache) : Cache des résultats (None pour le désactiver).
+    - read_preference (ReadPreference) : Préférence de lecture (par défaut, celle des requêtes opérationnelles).
+
+    Retourne :
+    - list : Les documents, avec station_info.
+    """
+    start, end = normalize_datetime(start), normalize_datetime(end)
+    key = ("hourly", id_station, start, end, storage_layout, stations_layout)
+
+    preference = resolve_read_preference(db, "operational", read_preference)
+
+    def run_query():
+        query = {"id_station": id_station, "datetime": datetime_range_filter(start, end, storage_layout)}
+        collection = db.get_collection("weather_data", read_preference=preference)
+        return find_weather_data(collection, query, sort=[("datetime", 1)], stations_layout=stations_layout)
+
+    return cached_query(db, cache, key, id_station, start, end, run_query, preference)
+
+
+def daily_summary_pipeline(id_station, start, end, storage_layout=STORAGE_LAYOUT):
+    """Construit le pipeline d'agrégation du résumé journalier d'une station, calculé sur les relevés horaires."""
+    return [
+        {"$match": {"id_station": id_station, "datetime": datetime_range_filter(start, end, storage_layout)}},
+        {"$group": {"_id": day_expression(storage_layout), **DAILY_ACCUMULATORS}},
+        {"$sort": {"_id": 1}},
+        {"$set": {"day": "$_id"}},
+        {"$unset": "_id"},
+    ]
+
+
+def get_daily_summary(db, id_station, start, end, cache=query_cache, storage_layout=STORAGE_LAYOUT, read_preference=None):
+    """
+    Renvoie, pour chaque jour de l'intervalle [start, end[, les températures minimale,
+    maximale et moyenne, le cumul de précipitations et la vitesse moyenne du vent d'une station.
+
+    Paramètres :
+    - db (Database) : Base weather_db.
+    - id_station (str) : Identifiant de la station.
+    - start (str) : Début inclus, 'YYYY-MM-DD' ou 'YYYY-MM-DD HH:MM:SS'.
+    - end (str) : Fin exclue, même format.
+    - cache (QueryCache) : Cache des résultats (None pour le désactiver).
+    - read_preference (ReadPreference) : Préférence de lecture (par défaut, celle des requêtes analytiques).
+
+    Retourne :
+    - list : Un dictionnaire par jour.
+    """
+    start, end = normalize_datetime(start), normalize_datetime(end)
+    key = ("daily_summary", id_station, start, end, storage_layout)
+
+    preference = resolve_read_preference(db, "analytic", read_preference)
+
+    def run_query():
+        collection = db.get_collection("weather_data", read_preference=preference)
+        return list(collection.aggregate(daily_summary_pipeline(id_station, start, end, storage_layout)))
+
+    return cached_query(db, cache, key, id_station, start, end, run_query, preference)
+
+
+def get_rollups(db, collection_name, period_field, id_station, start, end, cache=query_cache, read_preference=None):
+    """
+    Renvoie les agrégats matérialisés d'une station dont la période (jour 'YYYY-MM-DD' ou
+    mois 'YYYY-MM') est dans [start, end[.
+    """
+    key = (collection_name, id_station, start, end)
+
+    preference = resolve_read_preference(db, "analytic", read_preference)
+
+    def run_query():
+        query = {"id_station": id_station, period_field: {"$gte": start, "$lt": end}}
+        collection = db.get_collection(collection_name, read_preference=preference)
+        return list(collection.find(query, {"_id": 0}, sort=[(period_field, 1)]))
+
+    # Plage de datetime couverte, pour l'invalidation lors des écritures du chargeur
+    first, last = (normalize_datetime(f"{period}-01" if len(period) == 7 else period) for period in (start, end))
+    return cached_query(db, cache, key, id_station, first, last, run_query, preference)
+
+
+def get_daily_rollups(db, id_station, start_day, end_day, cache=query_cache, read_preference=None):
+    """Renvoie les agrégats journaliers matérialisés d'une station pour les jours de [start_day, end_day[."""
+    return get_rollups(db, DAILY_ROLLUP_COLLECTION_NAME, "day", id_station, start_day, end_day, cache, read_preference)
+
+
+def get_monthly_rollups(db, id_station, start_month, end_month, cache=query_cache, read_preference=None):
+    """Renvoie les agrégats mensuels matérialisés d'une station pour les mois 'YYYY-MM' de [start_month, end_month[."""
+    return get_rollups(db, MONTHLY_ROLLUP_COLLECTION_NAME, "month", id_station, start_month, end_month, cache, read_preference)
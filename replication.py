@@ -0,0 +1,172 @@
+# %%
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pymongo import ReadPreference, WriteConcern
+from pymongo.errors import ExecutionTimeout
+from instrumentation import percentile
+from mongo_utils import connect
+
+# Paramètres de connexion : primaire et secondaire interrogé directement
+PRIMARY_URI = os.getenv("MONGO_PRIMARY_URI", "mongodb://mongodb1:27017")
+SECONDARY_URI = os.getenv("MONGO_SECONDARY_URI", "mongodb://mongodb2:27017")
+DB_NAME = "weather_db"
+REPLICATION_PROBE_COLLECTION_NAME = "replication_probe"  # Collection des écritures de mesure (sans validation)
+
+# Attente de la réplication : "session" (lecture causale sur le secondaire, après l'operationTime de l'écriture)
+# ou "poll" (relectures avec attente exponentielle)
+REPLICATION_WAIT = os.getenv("REPLICATION_WAIT", "session")
+REPLICATION_TIMEOUT = float(os.getenv("REPLICATION_TIMEOUT", "30"))  # Attente maximale d'une écriture (secondes)
+REPLICATION_PROBE_WRITES = int(os.getenv("REPLICATION_PROBE_WRITES", "100"))  # Écritures mesurées par la sonde
+
+REPLICATION_WAIT_METHODS = ("session", "poll")
+
+
+# %%
+# Attente de la réplication d'une écriture
+def check_wait_method(method):
+    """Vérifie la méthode d'attente de la réplication."""
+    if method not in REPLICATION_WAIT_METHODS:
+        raise ValueError(f"Attente de la réplication inconnue : {method} (méthodes : {', '.join(REPLICATION_WAIT_METHODS)})")
+
+
+def wait_until(check, timeout=REPLICATION_TIMEOUT, initial_delay=0.002, max_delay=0.25):
+    """
+    Appelle check() jusqu'à ce qu'il renvoie True, en doublant l'attente entre deux appels
+    (de initial_delay à max_delay).
+
+    Retourne :
+    - float : Le temps écoulé (ms) jusqu'au succès.
+
+    Lève TimeoutError si check() n'a pas réussi avant timeout secondes.
+    """
+    start = time.perf_counter()
+    delay = initial_delay
+    while not check():
+        remaining = timeout - (time.perf_counter() - start)
+        if remaining <= 0:
+            raise TimeoutError(f"Condition non atteinte après {timeout} s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+    return (time.perf_counter() - start) * 1000
+
+
+def wait_for_replication(secondary_collection, query, present=True, primary_session=None,
+                         method=REPLICATION_WAIT, timeout=REPLICATION_TIMEOUT):
+    """
+    Attend que le secondaire voie (present=True) ou ne voie plus (present=False) le document
+    correspondant à query.
+
+    Avec method="session", la lecture sur le secondaire se fait dans une session causale avancée
+    à l'operationTime / clusterTime de l'écriture (primary_session) : le serveur ne répond
+    qu'une fois l'écriture répliquée. Avec method="poll", le secondaire est relu avec une
+    attente exponentielle.
+
+    Retourne :
+    - float : Le retard de réplication observé (ms), depuis l'acquittement de l'écriture.
+    """
+    check_wait_method(method)
+    start = time.perf_counter()
+
+    def replicated():
+        return (secondary_collection.find_one(query) is not None) == present
+
+    if method == "session":
+        if primary_session is None or primary_session.operation_time is None:
+            raise ValueError("L'attente causale nécessite la session de l'écriture sur le primaire")
+        with secondary_collection.database.client.start_session(causal_consistency=True) as session:
+            session.advance_cluster_time(primary_session.cluster_time)
+            session.advance_operation_time(primary_session.operation_time)
+            try:
+                document = secondary_collection.find_one(query, session=session, max_time_ms=int(timeout * 1000))
+            except ExecutionTimeout as e:
+                raise TimeoutError(f"Écriture non répliquée après {timeout} s") from e
+        if (document is not None) == present:
+            return (time.perf_counter() - start) * 1000
+
+    # Relectures avec attente exponentielle (ou secondaire pas encore à jour après la lecture causale)
+    wait_until(replicated, timeout - (time.perf_counter() - start))
+    return (time.perf_counter() - start) * 1000
+
+
+def replicate(primary_collection, secondary_collection, write, query, present=True,
+              method=REPLICATION_WAIT, timeout=REPLICATION_TIMEOUT):
+    """
+    Exécute write(session) sur le primaire puis attend sa réplication sur le secondaire.
+
+    Paramètres :
+    - write (callable) : Écriture à mesurer, appelée avec la session causale du primaire (None avec "poll").
+    - query (dict) : Filtre du document écrit (ou supprimé, avec present=False).
+
+    Retourne :
+    - float : Le retard de réplication observé (ms).
+    """
+    check_wait_method(method)
+    if method == "poll":
+        write(None)
+        return wait_for_replication(secondary_collection, query, present, method=method, timeout=timeout)
+
+    with primary_collection.database.client.start_session(causal_consistency=True) as session:
+        write(session)
+        return wait_for_replication(secondary_collection, query, present, session, method, timeout)
+
+
+# %%
+# Sonde : retard de réplication sur N écritures
+def measure_replication_lag(primary_collection, secondary_collection, writes=REPLICATION_PROBE_WRITES,
+                            method=REPLICATION_WAIT, timeout=REPLICATION_TIMEOUT):
+    """
+    Insère writes documents sur le primaire (write concern w=1, sans attendre les secondaires)
+    et mesure le retard de réplication de chacun, puis supprime les documents de mesure.
+
+    Retourne :
+    - dict : Méthode, nombre d'écritures et retards p50 / p99 / max / moyen (ms).
+    """
+    collection = primary_collection.with_options(write_concern=WriteConcern(w=1))
+    run = datetime.now(timezone.utc).isoformat()
+    lags = []
+    try:
+        for number in range(writes):
+            document = {"run": run, "number": number, "written_at": datetime.now(timezone.utc)}
+            lags.append(replicate(
+                collection, secondary_collection, lambda session, document=document: collection.insert_one(document, session=session),
+                {"run": run, "number": number}, method=method, timeout=timeout,
+            ))
+    finally:
+        collection.delete_many({"run": run})
+
+    return {
+        "method": method,
+        "writes": len(lags),
+        "p50_ms": round(percentile(lags, 50), 3) if lags else None,
+        "p99_ms": round(percentile(lags, 99), 3) if lags else None,
+        "max_ms": round(max(lags), 3) if lags else None,
+        "mean_ms": round(sum(lags) / len(lags), 3) if lags else None,
+    }
+
+
+# %%
+def main():
+    """Mesure le retard de réplication entre le primaire et le secondaire (p50 / p99 sur N écritures)."""
+    # Configuration du logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    primary_client = connect(PRIMARY_URI)
+    secondary_client = connect(SECONDARY_URI, read_preference=ReadPreference.SECONDARY)
+    try:
+        summary = measure_replication_lag(
+            primary_client[DB_NAME][REPLICATION_PROBE_COLLECTION_NAME],
+            secondary_client[DB_NAME][REPLICATION_PROBE_COLLECTION_NAME],
+        )
+    finally:
+        primary_client.close()
+        secondary_client.close()
+
+    logging.info(f"Retard de réplication : {json.dumps(summary)}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
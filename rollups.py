@@ -0,0 +1,137 @@
+# %%
+import os
+from datetime import datetime, timedelta
+from mongo_utils import LOAD_METADATA_COLLECTION_NAME, STORAGE_LAYOUT, datetime_range_filter
+
+# Collections des agrégats matérialisés par station
+DAILY_ROLLUP_COLLECTION_NAME = "weather_daily"
+MONTHLY_ROLLUP_COLLECTION_NAME = "weather_monthly"
+
+# Calcul des agrégats à la fin du chargement ("true" par défaut)
+BUILD_ROLLUPS = os.getenv("BUILD_ROLLUPS", "true").lower() == "true"
+
+
+# %%
+def day_expression(storage_layout=STORAGE_LAYOUT):
+    """Expression d'agrégation renvoyant le jour 'YYYY-MM-DD' d'un relevé."""
+    if storage_layout == "timeseries":
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": "$datetime"}}
+    return {"$substrCP": ["$datetime", 0, 10]}
+
+
+def count_numbers(field):
+    """Accumulateur comptant les valeurs numériques (non nulles) d'un champ."""
+    return {"$sum": {"$cond": [{"$isNumber": field}, 1, 0]}}
+
+
+# Accumulateurs journaliers ; les effectifs permettent de recalculer des moyennes mensuelles exactes
+DAILY_ACCUMULATORS = {
+    "temperature_min": {"$min": "$weather_data.temperature"},
+    "temperature_max": {"$max": "$weather_data.temperature"},
+    "temperature_mean": {"$avg": "$weather_data.temperature"},
+    "temperature_count": count_numbers("$weather_data.temperature"),
+    "precip_1h_total": {"$sum": "$weather_data.precip_1h"},
+    "precip_accum_max": {"$max": "$weather_data.precip_accum"},
+    "wind_speed_mean": {"$avg": "$weather_data.wind_speed"},
+    "wind_speed_count": count_numbers("$weather_data.wind_speed"),
+    "readings": {"$sum": 1},
+}
+
+
+def weighted_mean(mean_field, count_field):
+    """Accumulateurs de la moyenne pondérée d'une moyenne journalière."""
+    return {
+        f"{mean_field}_weighted": {"$sum": {"$multiply": [{"$ifNull": [f"${mean_field}", 0]}, f"${count_field}"]}},
+        count_field: {"$sum": f"${count_field}"},
+    }
+
+
+def daily_rollup_pipeline(match, storage_layout=STORAGE_LAYOUT):
+    """
+    Construit le pipeline qui agrège par station et par jour les relevés de weather_data
+    correspondant au filtre match, et fusionne le résultat dans weather_daily.
+    """
+    day = day_expression(storage_layout)
+    return [
+        {"$match": match},
+        {"$group": {"_id": {"id_station": "$id_station", "day": day}, **DAILY_ACCUMULATORS}},
+        {"$set": {
+            "id_station": "$_id.id_station",
+            "day": "$_id.day",
+            "month": {"$substrCP": ["$_id.day", 0, 7]},
+        }},
+        {"$merge": {"into": DAILY_ROLLUP_COLLECTION_NAME, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def monthly_rollup_pipeline(match):
+    """
+    Construit le pipeline qui agrège par station et par mois les agrégats journaliers
+    correspondant au filtre match, et fusionne le résultat dans weather_monthly.
+    """
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"id_station": "$id_station", "month": "$month"},
+            "temperature_min": {"$min": "$temperature_min"},
+            "temperature_max": {"$max": "$temperature_max"},
+            **weighted_mean("temperature_mean", "temperature_count"),
+            "precip_1h_total": {"$sum": "$precip_1h_total"},
+            "precip_accum_total": {"$sum": "$precip_accum_max"},
+            **weighted_mean("wind_speed_mean", "wind_speed_count"),
+            "readings": {"$sum": "$readings"},
+            "days": {"$sum": 1},
+        }},
+        {"$set": {
+            "id_station": "$_id.id_station",
+            "month": "$_id.month",
+            "temperature_mean": {"$cond": [
+                {"$gt": ["$temperature_count", 0]}, {"$divide": ["$temperature_mean_weighted", "$temperature_count"]}, None
+            ]},
+            "wind_speed_mean": {"$cond": [
+                {"$gt": ["$wind_speed_count", 0]}, {"$divide": ["$wind_speed_mean_weighted", "$wind_speed_count"]}, None
+            ]},
+        }},
+        {"$unset": ["temperature_mean_weighted", "wind_speed_mean_weighted"]},
+        {"$merge": {"into": MONTHLY_ROLLUP_COLLECTION_NAME, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def refresh_station_rollups(db, id_station, written_from=None, written_to=None, storage_layout=STORAGE_LAYOUT):
+    """
+    Recalcule les agrégats journaliers puis mensuels d'une station, uniquement pour les jours
+    et mois couverts par la plage écrite [written_from, written_to] (tout l'historique si None).
+    """
+    daily_match = {"id_station": id_station}
+    monthly_match = {"id_station": id_station}
+    if written_from is not None and written_to is not None:
+        first_day = written_from[:10]
+        day_after_last = (datetime.fromisoformat(written_to[:10]) + timedelta(days=1)).strftime("%Y-%m-%d")
+        daily_match["datetime"] = datetime_range_filter(first_day, day_after_last, storage_layout)
+        monthly_match["month"] = {"$gte": written_from[:7], "$lte": written_to[:7]}
+
+    db["weather_data"].aggregate(daily_rollup_pipeline(daily_match, storage_layout))
+    db[DAILY_ROLLUP_COLLECTION_NAME].aggregate(monthly_rollup_pipeline(monthly_match))
+
+
+def refresh_rollups(db, since, storage_layout=STORAGE_LAYOUT):
+    """
+    Met à jour les agrégats des stations écrites par le chargeur depuis since, d'après les
+    plages enregistrées dans load_metadata. Renvoie le nombre de stations recalculées.
+
+    Paramètres :
+    - db (Database) : Base weather_db.
+    - since (datetime) : Début du chargement (UTC).
+    - storage_layout (str) : Organisation du stockage de weather_data.
+    """
+    db[DAILY_ROLLUP_COLLECTION_NAME].create_index([("id_station", 1), ("day", 1)])
+    db[MONTHLY_ROLLUP_COLLECTION_NAME].create_index([("id_station", 1), ("month", 1)])
+
+    # MongoDB stocke les dates à la milliseconde près
+    since = since.replace(microsecond=since.microsecond // 1000 * 1000)
+
+    refreshed = 0
+    for metadata in db[LOAD_METADATA_COLLECTION_NAME].find({"updated_at": {"$gte": since}}):
+        refresh_station_rollups(db, metadata["_id"], metadata.get("written_from"), metadata.get("written_to"), storage_layout)
+        refreshed += 1
+    return refreshed
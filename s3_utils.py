@@ -0,0 +1,444 @@
+# %%
+import os
+import io
+import gzip
+import json
+import glob
+import hashlib
+import shutil
+import tempfile
+import weakref
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+# pandas n'est importé que par les fonctions qui construisent des DataFrame (extraction) :
+# le chargement, qui n'utilise que les fonctions S3 de ce module, ne le charge pas
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Nombre maximum de lignes converties en DataFrame à la fois
+AIRBYTE_CHUNK_SIZE = int(os.getenv("AIRBYTE_CHUNK_SIZE", "5000"))
+
+# Répertoire de copie locale des fichiers sources conservé d'une exécution à l'autre
+# (si vide : répertoire temporaire supprimé en fin d'exécution)
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR") or None
+
+# Nombre maximum de fichiers sources téléchargés et analysés en parallèle
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", "8"))
+
+# Synchronisation Airbyte à lire : "pinned" (celle fixée dans la configuration des flux) ou "latest"
+AIRBYTE_SYNC = os.getenv("AIRBYTE_SYNC", "pinned")
+
+# Format du fichier intermédiaire entre transformation et chargement : "json", "jsonl.gz" ou "parquet"
+WEATHER_DATA_FORMAT = os.getenv("WEATHER_DATA_FORMAT", "json")
+WEATHER_DATA_FILE_KEYS = {
+    "json": "data_transformed/weather_data.json",
+    "jsonl.gz": "data_transformed/weather_data.jsonl.gz",
+    "parquet": "data_transformed/weather_data.parquet",
+}
+STATIONS_FILE_KEY = "data_transformed/stations.json"  # Table des stations du format parquet
+QUALITY_REPORT_FILE_KEY = "data_transformed/quality_report.json"  # Rapport qualité de la transformation
+
+
+# %%
+def batched(iterable, batch_size):
+    """Découpe un itérable en lots (listes) de taille batch_size au maximum."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+class SourceCache:
+    """
+    Cache des fichiers sources S3 indexé par bucket/clé/ETag.
+
+    Chaque fichier n'est téléchargé qu'une fois par ETag : les étapes suivantes du pipeline
+    relisent sa copie sur disque, sans garder en mémoire le contenu brut des parties. L'ETag
+    d'un fichier n'est demandé (head_object) qu'une fois par exécution, sauf s'il est fourni
+    (ETag listé par list_airbyte_parts). Si spool_dir est renseigné, la copie est conservée
+    d'une exécution à l'autre tant que l'ETag de l'objet ne change pas (la copie de l'ETag
+    précédent est alors supprimée) ; sinon elle est écrite dans un répertoire temporaire
+    supprimé par close(). in_memory=True garde le contenu brut en mémoire (jeux de données réduits).
+    """
+
+    def __init__(self, s3_client, spool_dir: str | None = SOURCE_CACHE_DIR, in_memory: bool = False):
+        self.s3_client = s3_client
+        self.in_memory = in_memory
+        self.spool_dir = spool_dir
+        self._objects = {}  # (bucket, clé) -> (ETag, contenu brut) (in_memory)
+        self._etags = {}  # (bucket, clé) -> ETag lu ou fourni pendant l'exécution
+        self._cleanup = None
+        if not in_memory and spool_dir is None:
+            self.spool_dir = tempfile.mkdtemp(prefix="source_cache_")
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self.spool_dir, ignore_errors=True)
+
+    def close(self):
+        """Supprime le répertoire temporaire des copies (sans effet sur un spool_dir fourni)."""
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _spool_prefix(self, bucket_name: str, file_key: str) -> str:
+        digest = hashlib.sha1(f"{bucket_name}/{file_key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.spool_dir, digest)
+
+    def _spool_path(self, bucket_name: str, file_key: str, etag: str) -> str:
+        etag_digest = hashlib.sha1(etag.encode("utf-8")).hexdigest()
+        return f"{self._spool_prefix(bucket_name, file_key)}_{etag_digest}.jsonl"
+
+    def _download(self, bucket_name: str, file_key: str, etag: str, path: str | None):
+        response = self.s3_client.get_object(Bucket=bucket_name, Key=file_key, IfMatch=etag)
+        if path is None:
+            return response["Body"].read()
+
+        # Écriture dans un fichier temporaire puis renommage pour ne jamais laisser de copie partielle
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            for chunk in response["Body"].iter_chunks():
+                f.write(chunk)
+        os.replace(f"{path}.tmp", path)
+
+        # Suppression des copies des ETag précédents de l'objet
+        for stale_path in glob.glob(f"{glob.escape(self._spool_prefix(bucket_name, file_key))}_*.jsonl"):
+            if stale_path != path:
+                os.remove(stale_path)
+        return None
+
+    def fetch(self, bucket_name: str, file_key: str, etag: str | None = None):
+        """
+        Place un fichier source dans le cache, en ne le téléchargeant que si son ETag n'y est
+        pas déjà. Renvoie son contenu (cache mémoire) ou le chemin de sa copie (cache disque).
+
+        etag : ETag de l'objet s'il est déjà connu (listé par list_airbyte_parts) ; sinon, celui
+        lu lors d'un appel précédent de l'exécution, ou à défaut demandé avec head_object.
+        """
+        cache_key = (bucket_name, file_key)
+        etag = etag or self._etags.get(cache_key) or self.s3_client.head_object(Bucket=bucket_name, Key=file_key)["ETag"]
+        self._etags[cache_key] = etag
+
+        if self.in_memory:
+            cached_etag, content = self._objects.get(cache_key, (None, None))
+            if cached_etag != etag:
+                content = self._download(bucket_name, file_key, etag, None)
+                self._objects[cache_key] = (etag, content)
+            return content
+
+        path = self._spool_path(bucket_name, file_key, etag)
+        if not os.path.exists(path):
+            self._download(bucket_name, file_key, etag, path)
+        return path
+
+    def iter_lines(self, bucket_name: str, file_key: str):
+        """Renvoie les lignes (bytes) d'un fichier source, lu depuis le cache."""
+        cached = self.fetch(bucket_name, file_key)
+        if self.in_memory:
+            yield from io.BytesIO(cached)
+            return
+        with open(cached, "rb") as f:
+            yield from f
+
+
+def airbyte_sync_id(file_key: str) -> str:
+    """Renvoie l'identifiant de synchronisation d'un fichier Airbyte ('<date>_<epoch>' de '<date>_<epoch>_<part>.jsonl')."""
+    return os.path.basename(file_key).rsplit("_", 1)[0]
+
+
+def airbyte_part_number(file_key: str) -> int:
+    """Renvoie le numéro de partie d'un fichier Airbyte ('<date>_<epoch>_<part>.jsonl')."""
+    return int(os.path.basename(file_key).rsplit("_", 1)[1].split(".")[0])
+
+
+def list_airbyte_parts(s3_client, bucket_name: str, stream_prefix: str, sync_id: str | None = None, etags: dict | None = None) -> list:
+    """
+    Liste, avec une pagination list_objects_v2, les parties '_0.jsonl', '_1.jsonl'... d'une
+    synchronisation Airbyte d'un flux, dans l'ordre des parties.
+
+    Parameters:
+    - s3_client: Le client boto3 S3.
+    - bucket_name (str): Le nom du bucket S3.
+    - stream_prefix (str): Le préfixe du flux dans le bucket (ex. 'GreenAndCoop InfoClimat/infoclimat/').
+    - sync_id (str | None): La synchronisation à lire ; la plus récente si None.
+    - etags (dict | None): Si fourni, reçoit l'ETag listé de chaque partie ({clé: ETag}),
+      à passer à SourceCache.fetch / prefetch_sources pour éviter un head_object par fichier.
+
+    Returns:
+    - list: Les clés des fichiers de la synchronisation.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    listed_etags = {
+        obj["Key"]: obj["ETag"]
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=stream_prefix)
+        for obj in page.get("Contents", [])
+        if obj["Key"].endswith(".jsonl")
+    }
+    if not listed_etags:
+        raise FileNotFoundError(f"Aucun fichier Airbyte sous s3://{bucket_name}/{stream_prefix}")
+
+    if sync_id is None:
+        sync_id = max(airbyte_sync_id(file_key) for file_key in listed_etags)
+    file_keys = sorted(
+        (file_key for file_key in listed_etags if airbyte_sync_id(file_key) == sync_id),
+        key=airbyte_part_number
+    )
+    if etags is not None:
+        etags.update((file_key, listed_etags[file_key]) for file_key in file_keys)
+    return file_keys
+
+
+def map_in_threads(function, items, max_workers: int = EXTRACT_MAX_WORKERS) -> list:
+    """
+    Applique function à chaque élément dans un pool de threads borné et renvoie
+    les résultats dans l'ordre des éléments.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def prefetch_sources(source_cache: SourceCache, bucket_name: str, file_keys, etags: dict | None = None,
+                     max_workers: int = EXTRACT_MAX_WORKERS):
+    """
+    Télécharge en parallèle dans le cache les fichiers sources qui n'y sont pas encore, avec
+    leurs ETag listés s'ils sont fournis ({clé: ETag}, voir list_airbyte_parts).
+    """
+    etags = etags or {}
+    map_in_threads(lambda file_key: source_cache.fetch(bucket_name, file_key, etags.get(file_key)), file_keys, max_workers)
+
+
+def iter_airbyte_data(source_cache: SourceCache, bucket_name: str, file_key: str):
+    """
+    Lit un fichier JSONL Airbyte ligne par ligne via le cache des sources et renvoie les
+    données imbriquées sous "_airbyte_data" au fil de l'eau, sans décoder le fichier entier.
+
+    Parameters:
+    - source_cache (SourceCache): Le cache des fichiers sources S3.
+    - bucket_name (str): Le nom du bucket S3.
+    - file_key (str): La clé du fichier dans le bucket S3.
+
+    Yields:
+    - dict: Le contenu de "_airbyte_data" pour chaque ligne du fichier.
+    """
+    for line in source_cache.iter_lines(bucket_name, file_key):
+        if line.strip():
+            yield json.loads(line)["_airbyte_data"]
+
+
+def records_to_dataframe(records, chunk_size: int = AIRBYTE_CHUNK_SIZE) -> "pd.DataFrame":
+    """
+    Construit un DataFrame à partir d'un itérable de dictionnaires, par blocs de
+    chunk_size lignes pour borner le nombre de dictionnaires gardés en mémoire.
+
+    Parameters:
+    - records (iterable): Les enregistrements (dictionnaires) à convertir.
+    - chunk_size (int): Le nombre de lignes par bloc.
+
+    Returns:
+    - pd.DataFrame: Le DataFrame concaténé (vide si aucun enregistrement).
+    """
+    import pandas as pd
+
+    chunks = [pd.DataFrame(batch) for batch in batched(records, chunk_size)]
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True, join="outer")
+
+
+def extract_station_data(station_ids, airbyte_data, chunk_size: int = AIRBYTE_CHUNK_SIZE) -> list:
+    """
+    Extrait en une seule lecture les données horaires InfoClimat (sous "hourly") des stations
+    données et les convertit en un DataFrame par station, bloc par bloc, dans l'ordre de station_ids.
+    Si les données n'existent pas pour une station, elle n'apporte aucun DataFrame.
+
+    Parameters:
+    - station_ids (list): Les identifiants des stations à extraire.
+    - airbyte_data (iterable): Les données "_airbyte_data" des fichiers InfoClimat.
+    - chunk_size (int): Le nombre maximum de lignes converties en DataFrame à la fois.
+
+    Returns:
+    - list: Un DataFrame par station présente dans les données.
+    """
+    import pandas as pd
+
+    station_rows = {station_id: [] for station_id in station_ids}
+    station_chunks = {station_id: [] for station_id in station_ids}
+
+    for entry in airbyte_data:
+        for station_id in station_ids:
+            rows = station_rows[station_id]
+            rows.extend(entry["hourly"].get(station_id, []))
+            if len(rows) >= chunk_size:
+                station_chunks[station_id].append(pd.DataFrame(rows))
+                station_rows[station_id] = []
+
+    dfs = []
+    for station_id in station_ids:
+        chunks = station_chunks[station_id]
+        if station_rows[station_id]:
+            chunks.append(pd.DataFrame(station_rows[station_id]))
+        if chunks:
+            dfs.append(pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0])
+
+    return dfs
+
+
+# %%
+def import_pyarrow():
+    """Importe pyarrow, dépendance optionnelle nécessaire au format parquet et à l'export."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Le format 'parquet' nécessite pyarrow, qui n'est pas installé : poetry install --extras parquet "
+            "ou pip install pyarrow "
+            "(ou WEATHER_DATA_FORMAT=json / jsonl.gz pour le fichier intermédiaire)"
+        ) from e
+    return pyarrow, pyarrow.parquet
+
+
+def check_weather_data_format(data_format: str = WEATHER_DATA_FORMAT):
+    """
+    Vérifie le format intermédiaire et, pour "parquet", que pyarrow est installé : à appeler
+    avant la transformation ou le chargement, pour échouer avant tout traitement.
+    """
+    if data_format not in WEATHER_DATA_FILE_KEYS:
+        raise ValueError(f"Format intermédiaire inconnu : {data_format} (formats : {', '.join(WEATHER_DATA_FILE_KEYS)})")
+    if data_format == "parquet":
+        import_pyarrow()
+
+
+def weather_data_arrow_schema():
+    """
+    Schéma Arrow du format parquet : id_station et datetime (chaînes), puis une colonne par
+    mesure de weather_data, typée d'après le $jsonSchema (voir export.weather_fields).
+    """
+    from export import weather_fields
+
+    pa, _ = import_pyarrow()
+    return pa.schema(
+        [("id_station", pa.string()), ("datetime", pa.string())]
+        + [(field, getattr(pa, arrow_type)()) for field, arrow_type in weather_fields().items()]
+    )
+
+
+def save_weather_data(s3_client, bucket_name: str, documents: list, data_format: str = WEATHER_DATA_FORMAT) -> str:
+    """
+    Sauvegarde les documents transformés sur S3 dans le format intermédiaire choisi.
+
+    - "json" : un seul tableau JSON indenté (format historique).
+    - "jsonl.gz" : un document par ligne, compressé en gzip.
+    - "parquet" : les relevés à plat en parquet (une colonne par mesure du schéma MongoDB)
+      et les station_info dans une table à part.
+
+    Parameters:
+    - s3_client: Le client boto3 S3.
+    - bucket_name (str): Le nom du bucket S3.
+    - documents (list): Les documents (id_station, station_info, datetime, weather_data).
+    - data_format (str): Le format intermédiaire.
+
+    Returns:
+    - str: La clé du fichier écrit sur S3.
+    """
+    check_weather_data_format(data_format)
+    file_key = WEATHER_DATA_FILE_KEYS[data_format]
+
+    if data_format == "json":
+        body = json.dumps(documents, indent=4)
+    elif data_format == "jsonl.gz":
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb") as f:
+            for doc in documents:
+                f.write(json.dumps(doc).encode("utf-8") + b"\n")
+        body = buffer.getvalue()
+    else:
+        pa, pq = import_pyarrow()
+        stations = {doc["id_station"]: doc["station_info"] for doc in documents}
+        s3_client.put_object(Body=json.dumps(stations), Bucket=bucket_name, Key=STATIONS_FILE_KEY)
+
+        # Colonnes et types des mesures d'après le schéma MongoDB, pas d'après le premier document :
+        # une mesure absente d'un document est écrite à null, sans être retirée des suivants
+        schema = weather_data_arrow_schema()
+        columns = {
+            "id_station": [doc["id_station"] for doc in documents],
+            "datetime": [doc["datetime"] for doc in documents],
+        }
+        for field in schema.names[2:]:
+            columns[field] = [doc["weather_data"].get(field) for doc in documents]
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.table(columns, schema=schema), buffer, row_group_size=AIRBYTE_CHUNK_SIZE, compression="zstd")
+        body = buffer.getvalue()
+
+    s3_client.put_object(Body=body, Bucket=bucket_name, Key=file_key)
+    return file_key
+
+
+def iter_weather_data(s3_client, bucket_name: str, data_format: str = WEATHER_DATA_FORMAT, chunk_size: int = AIRBYTE_CHUNK_SIZE):
+    """
+    Relit depuis S3 les documents transformés, par blocs d'au plus chunk_size documents.
+    Les formats "jsonl.gz" et "parquet" sont décodés au fil de l'eau ; le format "json"
+    doit être chargé en entier avant d'être découpé. Le parquet, qui a besoin d'un accès
+    aléatoire, est copié sur disque par un SourceCache (SOURCE_CACHE_DIR) puis lu groupe de
+    lignes par groupe de lignes.
+
+    Parameters:
+    - s3_client: Le client boto3 S3.
+    - bucket_name (str): Le nom du bucket S3.
+    - data_format (str): Le format intermédiaire.
+    - chunk_size (int): Le nombre de documents par bloc.
+
+    Yields:
+    - list: Un bloc de documents (id_station, station_info, datetime, weather_data).
+    """
+    check_weather_data_format(data_format)
+    file_key = WEATHER_DATA_FILE_KEYS[data_format]
+
+    if data_format == "json":
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+        yield from batched(json.load(response["Body"]), chunk_size)
+    elif data_format == "jsonl.gz":
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+        with gzip.GzipFile(fileobj=response["Body"], mode="rb") as f:
+            yield from batched((json.loads(line) for line in f if line.strip()), chunk_size)
+    else:
+        yield from iter_parquet_weather_data(s3_client, bucket_name, file_key, chunk_size)
+
+
+def iter_parquet_weather_data(s3_client, bucket_name: str, file_key: str, chunk_size: int = AIRBYTE_CHUNK_SIZE):
+    """
+    Relit le parquet des relevés par blocs de chunk_size documents, en y rattachant les
+    station_info de la table des stations. Le fichier est téléchargé en flux dans une copie
+    sur disque (SourceCache) : seuls les groupes de lignes lus sont en mémoire.
+    """
+    _, pq = import_pyarrow()
+    stations_response = s3_client.get_object(Bucket=bucket_name, Key=STATIONS_FILE_KEY)
+    stations = json.load(stations_response["Body"])
+
+    with SourceCache(s3_client) as source_cache:
+        with pq.ParquetFile(source_cache.fetch(bucket_name, file_key)) as parquet_file:
+            for record_batch in parquet_file.iter_batches(batch_size=chunk_size):
+                chunk = []
+                for row in record_batch.to_pylist():
+                    id_station = row.pop("id_station")
+                    date_time = row.pop("datetime")
+                    chunk.append({
+                        "id_station": id_station,
+                        "station_info": stations.get(id_station, {}),
+                        "datetime": date_time,
+                        "weather_data": row,
+                    })
+                yield chunk
+
+
+def iter_airbyte_parts(source_cache: SourceCache, bucket_name: str, file_keys):
+    """Enchaîne les données "_airbyte_data" de toutes les parties d'un flux, dans l'ordre des parties."""
+    for file_key in file_keys:
+        yield from iter_airbyte_data(source_cache, bucket_name, file_key)
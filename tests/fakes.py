@@ -0,0 +1,168 @@
+import hashlib
+import io
+import threading
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+
+def make_document(id_station="07015", datetime="2024-10-01 00:00:00", **weather_data):
+    """Document transformé (id_station, station_info, datetime, weather_data) ; mesures par défaut : température et humidité."""
+    return {
+        "id_station": id_station,
+        "station_info": {"name": id_station},
+        "datetime": datetime,
+        "weather_data": weather_data or {"temperature": 12.5, "humidity": 80},
+    }
+
+
+class FakeS3Client:
+    """
+    Client S3 minimal en mémoire : écriture, lecture (avec IfMatch), ETag et listage
+    list_objects_v2 paginé. Compte les téléchargements et les head_object.
+    """
+    def __init__(self, page_size=1000):
+        self.objects = {}  # (bucket, clé) -> contenu
+        self.page_size = page_size
+        self.get_calls = 0
+        self.head_calls = 0
+
+    def etag(self, Bucket, Key):
+        return f'"{hashlib.md5(self.objects[(Bucket, Key)]).hexdigest()}"'
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else Body
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        return {"ETag": self.etag(Bucket, Key)}
+
+    def get_object(self, Bucket, Key, IfMatch=None):
+        self.get_calls += 1
+        etag = self.etag(Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "GetObject")
+        content = self.objects[(Bucket, Key)]
+        return {"ETag": etag, "Body": StreamingBody(io.BytesIO(content), len(content))}
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        for start in range(0, max(len(keys), 1), self.page_size):
+            yield {"Contents": [{"Key": key, "ETag": self.etag(Bucket, key)} for key in keys[start:start + self.page_size]]}
+
+
+def matches(doc, query):
+    """Applique un filtre MongoDB simple : égalité, $gt, $gte, $lt, $lte, $in et $or."""
+    for field, condition in (query or {}).items():
+        if field == "$or":
+            if not any(matches(doc, subquery) for subquery in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if value is None and operator != "$in":
+                return False
+            if operator == "$gt" and not value > operand:
+                return False
+            if operator == "$gte" and not value >= operand:
+                return False
+            if operator == "$lt" and not value < operand:
+                return False
+            if operator == "$lte" and not value <= operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+    return True
+
+
+def project(doc, projection):
+    """Applique une projection d'inclusion ou d'exclusion."""
+    if not projection:
+        return dict(doc)
+    included = [field for field, value in projection.items() if value and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+class FakeCollection:
+    """
+    Collection minimale en mémoire : filtre simple (voir matches), tri, projection, écritures
+    et index. Enregistre dans calls chaque lecture (méthode, filtre ou pipeline), y compris
+    depuis plusieurs threads ; aggregate renvoie aggregate_results.
+    """
+    def __init__(self, documents=None, aggregate_results=None, indexes=None, name="weather_data"):
+        self.documents = list(documents or [])
+        self.aggregate_results = list(aggregate_results or [])
+        self.indexes = dict(indexes or {})
+        self.name = name
+        self.calls = []
+        self.dropped_indexes = []
+        self.created_indexes = []
+        self._lock = threading.Lock()
+
+    def record(self, method, argument):
+        with self._lock:
+            self.calls.append((method, argument))
+
+    @property
+    def queries(self):
+        return [argument for method, argument in self.calls if method == "find"]
+
+    @property
+    def pipelines(self):
+        return [argument for method, argument in self.calls if method == "aggregate"]
+
+    @property
+    def find_calls(self):
+        return len(self.queries)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def select(self, query=None, projection=None, sort=None):
+        docs = [doc for doc in self.documents if matches(doc, query)]
+        for field, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return [project(doc, projection) for doc in docs]
+
+    def find(self, query=None, projection=None, sort=None, batch_size=None, **kwargs):
+        self.record("find", query)
+        return iter(self.select(query, projection, sort))
+
+    def find_one(self, query=None, projection=None, sort=None, **kwargs):
+        self.record("find_one", query)
+        return next(iter(self.select(query, projection, sort)), None)
+
+    def distinct(self, field):
+        return list({doc[field] for doc in self.documents})
+
+    def aggregate(self, pipeline, **kwargs):
+        self.record("aggregate", pipeline)
+        return iter(self.aggregate_results)
+
+    def insert_one(self, document, session=None):
+        self.documents.append(document)
+
+    def update_one(self, query, update, upsert=False):
+        doc = next((doc for doc in self.documents if matches(doc, query)), None)
+        if doc is None and upsert:
+            doc = dict(query)
+            self.documents.append(doc)
+        if doc is not None:
+            doc.update(update["$set"])
+
+    def index_information(self):
+        return self.indexes
+
+    def drop_index(self, name):
+        self.dropped_indexes.append(name)
+
+    def create_index(self, keys, unique=False):
+        self.created_indexes.append((keys, unique))
@@ -0,0 +1,47 @@
+import json
+import pytest
+from fakes import FakeS3Client
+import transform_data
+from benchmark import BENCHMARK_BUCKET, compare_results, generate_dataset, run_pipeline
+from s3_utils import iter_weather_data
+
+
+def test_pipeline_benchmark_on_synthetic_data():
+    """Teste que le jeu synthétique de N stations x M jours traverse tout le pipeline (transform_data) sans perte."""
+    s3_client = FakeS3Client()
+    dataset = generate_dataset(s3_client, BENCHMARK_BUCKET, stations=3, days=9, readings_per_day=48)
+
+    stages = run_pipeline(s3_client, BENCHMARK_BUCKET, dataset, data_format="jsonl.gz")
+    stages = {stage["stage"]: stage for stage in stages}
+
+    assert dataset["expected_documents"] == 3 * 9 * 24 + 2 * 9 * 48
+    assert list(stages) == [
+        "download", "parse_stations", "parse_weather_underground", "parse_infoclimat",
+        "transform_weather_underground", "transform_infoclimat", "quality", "build_documents", "save",
+    ]
+    assert stages["parse_weather_underground"]["rows_out"] == 2 * 9 * 48 + 2 * 9  # Lignes vides Weather Underground
+    assert stages["parse_infoclimat"]["rows_out"] == 3 * 9 * 24
+    assert stages["build_documents"]["rows_out"] == stages["save"]["rows_out"] == dataset["expected_documents"]
+    assert all(stage["peak_rss_mb"] > 0 for stage in stages.values())
+    assert s3_client.head_calls == 0  # ETag des parties repris du listage
+
+    documents = [doc for chunk in iter_weather_data(s3_client, BENCHMARK_BUCKET, "jsonl.gz") for doc in chunk]
+    assert {doc["id_station"] for doc in documents} == set(dataset["station_ids"] + dataset["wu_station_ids"])
+    assert {key for bucket, key in s3_client.objects} >= {"data_transformed/weather_data.jsonl.gz"}
+    assert {bucket for bucket, key in s3_client.objects} == {BENCHMARK_BUCKET}
+    assert any(doc["station_info"]["name"] == "Station SYN00000" for doc in documents)
+    json.dumps(list(stages.values()))  # Les résultats sont sérialisables en JSON
+
+
+def test_benchmark_refuses_production_bucket():
+    """Teste que le benchmark refuse d'écrire dans le bucket de production."""
+    with pytest.raises(ValueError):
+        generate_dataset(FakeS3Client(), transform_data.bucket_name, stations=1, days=1)
+
+
+def test_compare_results():
+    """Teste la variation relative du temps de chaque étape par rapport à la référence."""
+    baseline = {"stages": [{"stage": "extract", "wall_s": 2.0}, {"stage": "load", "wall_s": 0.0}]}
+    results = {"stages": [{"stage": "extract", "wall_s": 1.5}, {"stage": "load", "wall_s": 1.0}, {"stage": "build", "wall_s": 1.0}]}
+
+    assert compare_results(results, baseline) == {"extract": -25.0}
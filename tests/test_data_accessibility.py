@@ -0,0 +1,38 @@
+from fakes import FakeCollection
+from data_accessibility import benchmark_query, latency_stats, query_mix
+
+
+def test_latency_stats_percentiles_and_qps():
+    """Teste les percentiles (ms) et le débit calculés à partir des durées en nanosecondes."""
+    stats = latency_stats([i * 1_000_000 for i in range(1, 101)], wall_ns=2_000_000_000)
+
+    assert (stats["iterations"], stats["p50_ms"], stats["max_ms"]) == (100, 50.5, 100.0)
+    assert stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+    assert stats["qps"] == 50.0
+
+
+def test_benchmark_query_excludes_warmup_and_spreads_over_threads():
+    """Teste que l'échauffement n'est pas mesuré et que toutes les requêtes sont exécutées avec plusieurs threads."""
+    collection = FakeCollection()
+    run = query_mix([{"id_station": "07015", "datetime": "2024-10-02 10:00:00"}], "standard")["point"]
+
+    stats = benchmark_query(run, collection, iterations=40, warmup=5, threads=4)
+
+    assert stats["iterations"] == 40
+    assert len(collection.calls) == 45
+    assert collection.calls[0] == ("find_one", {"id_station": "07015", "datetime": "2024-10-02 10:00:00"})
+
+
+def test_query_mix_uses_sampled_keys():
+    """Teste que chaque type de requête est construit à partir d'un relevé tiré (station et jour)."""
+    collection = FakeCollection()
+    queries = query_mix([{"id_station": "ILAMAD25", "datetime": "2024-10-02 10:00:00"}], "standard")
+
+    for run in queries.values():
+        run(collection)
+
+    (_, point), (_, station_day), (_, multi_station), (_, aggregation) = collection.calls
+    assert point == {"id_station": "ILAMAD25", "datetime": "2024-10-02 10:00:00"}
+    assert station_day == {"id_station": "ILAMAD25", "datetime": {"$gte": "2024-10-02", "$lt": "2024-10-03"}}
+    assert multi_station == {"datetime": {"$gte": "2024-10-02", "$lt": "2024-10-03"}}
+    assert aggregation[0]["$match"]["datetime"] == {"$gte": "2024-10-02", "$lt": "2024-10-09"}
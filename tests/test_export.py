@@ -0,0 +1,63 @@
+from datetime import datetime
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pd = pytest.importorskip("pandas")
+from fakes import FakeCollection, make_document
+from export import export_parquet, find_dataframe, flat_pipeline, next_month, weather_fields
+
+
+def export_document(id_station, value, temperature, humidity):
+    """Relevé avec toutes les mesures du schéma (nulles sauf température et humidité)."""
+    return make_document(id_station, value, **{**dict.fromkeys(weather_fields()), "temperature": temperature, "humidity": humidity})
+
+
+class FlatteningCollection(FakeCollection):
+    """Collection dont aggregate applique le $match puis la mise à plat et la conversion de datetime du pipeline d'export."""
+    def aggregate(self, pipeline, **kwargs):
+        self.record("aggregate", pipeline)
+        match, projection = pipeline[0]["$match"], pipeline[-1]["$project"]
+        for doc in self.select(match, sort=[("id_station", 1), ("datetime", 1)]):
+            flat = {field: doc["weather_data"][value.split(".", 1)[1]]
+                    for field, value in projection.items() if isinstance(value, str)}
+            yield {"id_station": doc["id_station"], "datetime": datetime.fromisoformat(doc["datetime"]), **flat}
+
+
+def test_flat_pipeline_projects_weather_fields_to_columns():
+    """Teste que la mise à plat de weather_data.* et la conversion de datetime sont faites côté serveur."""
+    pipeline = flat_pipeline({"id_station": "07015"}, {"temperature": "float64", "humidity": "int64"}, "standard")
+
+    assert pipeline[0] == {"$match": {"id_station": "07015"}}
+    assert pipeline[-1]["$project"]["temperature"] == "$weather_data.temperature"
+    assert pipeline[-1]["$project"]["datetime"]["$dateFromString"]["dateString"] == "$datetime"
+    assert flat_pipeline({}, {}, "timeseries")[-1]["$project"]["datetime"] == "$datetime"
+
+
+def test_find_dataframe_has_typed_columns():
+    """Teste que les relevés sont lus par lots en colonnes typées (horodatage, float, entier)."""
+    collection = FlatteningCollection([export_document("07015", f"2024-10-01 0{hour}:00:00", 10.5 + hour, 80) for hour in range(5)])
+
+    df = find_dataframe(collection, {"id_station": "07015"}, batch_size=2, engine="cursor")
+
+    assert len(df) == 5
+    assert str(df["datetime"].dtype) == "datetime64[ms]"
+    assert df["temperature"].dtype == "float64" and df["humidity"].dtype == "int64"
+    assert df["temperature"].tolist() == [10.5, 11.5, 12.5, 13.5, 14.5]
+
+
+def test_export_parquet_per_station_and_month(tmp_path):
+    """Teste l'écriture d'un fichier parquet par station et par mois, relu directement avec pandas."""
+    documents = [export_document("07015", day, 12.0, 70) for day in ("2024-10-31 23:00:00", "2024-11-01 00:00:00", "2024-12-15 12:00:00")]
+    documents.append(export_document("00052", "2024-11-02 10:00:00", 8.0, 90))
+    collection = FlatteningCollection(documents)
+
+    written = export_parquet(collection, str(tmp_path), batch_size=2, engine="cursor", storage_layout="standard")
+
+    assert [(item["id_station"], item["month"], item["rows"]) for item in written] == [
+        ("00052", "2024-11", 1), ("07015", "2024-10", 1), ("07015", "2024-11", 1), ("07015", "2024-12", 1)
+    ]
+    df = pd.read_parquet(tmp_path)
+    assert len(df) == 4
+    assert sorted(df["id_station"].unique()) == ["00052", "07015"]
+    assert pd.read_parquet(tmp_path / "07015" / "2024-11.parquet")["datetime"].tolist() == [pd.Timestamp("2024-11-01 00:00:00")]
+    assert next_month("2024-12") == "2025-01"
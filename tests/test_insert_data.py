@@ -0,0 +1,65 @@
+from pymongo.errors import BulkWriteError
+import insert_data
+from fakes import FakeCollection, make_document
+from insert_data import storage_schema, track_high_water_marks, upsert_documents
+from mongo_utils import TIMESERIES_OPTIONS, weather_data_schema
+
+
+class RejectingCollection(FakeCollection):
+    """Collection dont bulk_write rejette les relevés sans température."""
+    def bulk_write(self, operations, ordered=True):
+        errors = [
+            {"index": index, "errmsg": "Document failed validation"}
+            for index, operation in enumerate(operations)
+            if operation._doc["weather_data"]["temperature"] is None
+        ]
+        if errors:
+            raise BulkWriteError({"nUpserted": len(operations) - len(errors), "nModified": 0, "writeErrors": errors})
+
+
+def test_storage_schema_standard_keeps_validator():
+    """Teste que la collection classique est créée avec la validation $jsonSchema."""
+    schema = storage_schema("standard")
+
+    assert schema == weather_data_schema
+    assert schema is not weather_data_schema  # Copie : le schéma partagé n'est pas modifiable par l'appelant
+
+
+def test_storage_schema_timeseries_has_no_validator():
+    """Teste que la collection time-series est créée avec ses seules options time-series, sans validateur."""
+    assert storage_schema("timeseries") == {
+        "timeseries": {"timeField": "datetime", "metaField": "id_station", "granularity": "hours"}
+    }
+    assert storage_schema("timeseries")["timeseries"] == TIMESERIES_OPTIONS
+
+
+def test_full_load_leaves_documents_unchanged():
+    """Teste que le suivi des derniers datetime du chargement complet n'ajoute pas de champ aux relevés."""
+    docs = [
+        {"id_station": "S1", "datetime": "2024-10-01 01:00:00", "weather_data": {"temperature": 12.5}},
+        {"id_station": "S1", "datetime": "2024-10-01 00:00:00", "weather_data": {"temperature": 11.0}},
+        {"id_station": "S2", "datetime": "2024-10-02 00:00:00", "weather_data": {"temperature": 9.5}},
+    ]
+    high_water_marks = {}
+
+    loaded = list(track_high_water_marks([dict(doc) for doc in docs], high_water_marks))
+
+    assert loaded == docs
+    assert high_water_marks == {"S1": "2024-10-01 01:00:00", "S2": "2024-10-02 00:00:00"}
+
+
+def test_rejected_upsert_does_not_advance_high_water_mark(monkeypatch):
+    """Teste qu'un relevé rejeté n'avance pas le dernier datetime chargé de sa station, pour être retenté."""
+    monkeypatch.setattr(insert_data, "save_rejected_docs", lambda docs, name: None)
+    docs = [
+        make_document("S1", "2024-10-01 00:00:00", temperature=11.0),
+        make_document("S1", "2024-10-01 01:00:00", temperature=None),
+        make_document("S2", "2024-10-01 02:00:00", temperature=9.5),
+    ]
+    metadata = FakeCollection([{"_id": "S1", "last_datetime": "2024-09-30 23:00:00"}], name="load_metadata")
+
+    written, rejected = upsert_documents(RejectingCollection(), metadata, docs, "weather_data", workers=1)
+
+    assert (written, rejected) == (2, 1)
+    marks = {mark["_id"]: mark["last_datetime"] for mark in metadata.documents}
+    assert marks == {"S1": "2024-09-30 23:00:00", "S2": "2024-10-01 02:00:00"}
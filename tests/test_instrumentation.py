@@ -0,0 +1,72 @@
+import json
+import pytest
+from instrumentation import PipelineProfile, percentile, timed_iter
+
+
+def test_stage_records_metrics_and_errors():
+    """Teste les mesures d'une étape réussie et le statut d'une étape en erreur."""
+    profile = PipelineProfile("test")
+
+    with profile.stage("transform", rows_in=3) as metrics:
+        data = [value * 2 for value in range(3)]
+        metrics.rows_out = len(data)
+    with pytest.raises(ValueError):
+        with profile.stage("load"):
+            raise ValueError("écriture impossible")
+
+    transform, load = profile.summary()["stages"]
+    assert transform["stage"] == "transform" and transform["status"] == "ok"
+    assert (transform["rows_in"], transform["rows_out"]) == (3, 3)
+    assert transform["wall_s"] >= 0 and transform["cpu_s"] >= 0 and transform["peak_rss_mb"] > 0
+    assert load["status"] == "error" and load["rows_out"] is None
+
+
+def test_instrument_decorator_counts_rows():
+    """Teste que le décorateur mesure chaque appel et compte les lignes produites."""
+    profile = PipelineProfile("test")
+
+    @profile.instrument("build")
+    def build(n):
+        return list(range(n))
+
+    assert build(5) == [0, 1, 2, 3, 4]
+    assert profile.summary()["stages"][0]["rows_out"] == 5
+
+
+def test_timed_iter_measures_production_time():
+    """Teste que timed_iter restitue les éléments et cumule le temps passé à les produire."""
+    profile = PipelineProfile("test")
+
+    with profile.stage("load") as metrics:
+        assert list(timed_iter(iter(range(100)), metrics, "read_s")) == list(range(100))
+
+    assert profile.summary()["stages"][0]["read_s"] >= 0
+
+
+def test_write_logs_json_and_prometheus_textfile(tmp_path):
+    """Teste le résumé JSON, le profil JSON et le fichier texte Prometheus."""
+    profile = PipelineProfile("insert_data")
+    with profile.stage("load") as metrics:
+        metrics.rows_out = 10
+
+    profile.write(textfile=str(tmp_path / "pipeline.prom"), profile_dir=str(tmp_path / "profiles"))
+    PipelineProfile("transform_data").write(textfile=str(tmp_path / "pipeline.prom"))
+
+    # Un fichier par script : l'exécution de transform_data n'écrase pas les mesures d'insert_data
+    assert sorted(path.name for path in tmp_path.glob("*.prom")) == ["pipeline_insert_data.prom", "pipeline_transform_data.prom"]
+    content = (tmp_path / "pipeline_insert_data.prom").read_text(encoding="utf-8")
+    assert "# TYPE pipeline_stage_wall_seconds gauge" in content
+    assert 'pipeline_stage_rows_out{script="insert_data",stage="load"} 10' in content
+    assert "pipeline_stage_rows_in{" not in content  # rows_in inconnu : pas d'échantillon
+
+    (profile_file,) = (tmp_path / "profiles").iterdir()
+    summary = json.loads(profile_file.read_text(encoding="utf-8"))
+    assert summary["script"] == "insert_data"
+    assert [stage["stage"] for stage in summary["stages"]] == ["load"]
+
+
+def test_percentile_interpolates():
+    """Teste le calcul des percentiles utilisés pour les retards et latences."""
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+    assert percentile([], 50) is None
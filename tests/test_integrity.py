@@ -1,36 +1,32 @@
 import pytest
 import random
-import json
 import boto3
 from pymongo import MongoClient
+from s3_utils import WEATHER_DATA_FORMAT, iter_weather_data
+from mongo_utils import STATIONS_LAYOUT, STORAGE_LAYOUT, StationCache, find_weather_data, to_storage_document
+from integrity import verify_integrity
 
 # Configuration MongoDB
 MONGO_URI = "mongodb://mongodb1:27017,mongodb2:27017,mongodb3:27017/?replicaSet=rs0"
 client = MongoClient(MONGO_URI)
 db = client["weather_db"]
 collection = db["weather_data"]
+station_cache = StationCache(db)  # Rattache station_info aux relevés en stockage normalisé
 
 # Configuration du client S3
 s3 = boto3.client('s3')
 
-# Détails du bucket et des fichiers JSON
+# Détails du bucket S3
 BUCKET_NAME = "p8-airbyte-greenandcoop"
-WEATHER_DATA_FILE_KEY = "data_transformed/weather_data.json"
-
-def load_json_from_s3(bucket_name, file_key):
-    """Charge un fichier JSON depuis S3 et retourne les données sous forme d'objet Python."""
-    obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-    data = obj['Body'].read().decode('utf-8')
-    return json.loads(data)
 
 @pytest.fixture(scope="module")
-def json_data():
-    """Fixture qui charge les données JSON depuis S3 une seule fois par session de test."""
-    return load_json_from_s3(BUCKET_NAME, WEATHER_DATA_FILE_KEY)
+def json_chunks():
+    """Fixture qui renvoie une fonction relisant les documents transformés depuis S3, bloc par bloc."""
+    return lambda: iter_weather_data(s3, BUCKET_NAME, WEATHER_DATA_FORMAT)
 
-def test_count_records(json_data):
+def test_count_records(json_chunks):
     """Teste si le nombre d'enregistrements JSON correspond à celui de MongoDB."""
-    count_json = len(json_data)
+    count_json = sum(len(chunk) for chunk in json_chunks())
     count_mongo = collection.count_documents({})
 
     print(f"\nNombre de lignes dans le JSON : {count_json}")
@@ -39,13 +35,16 @@ def test_count_records(json_data):
     assert count_json == count_mongo, "🚨 Incohérence dans le nombre d'enregistrements !"
     print("✅ Vérification du nombre d'enregistrements OK")
 
-def test_data_types(json_data):
+def test_data_types(json_chunks):
     """Teste si les types de données dans MongoDB correspondent à ceux du JSON."""
     sample_doc = collection.find_one()
     assert sample_doc, "🚨 Aucun document trouvé dans MongoDB !"
+    if STATIONS_LAYOUT == "normalized":
+        sample_doc = station_cache.attach(sample_doc)
 
-    for key in json_data[0].keys():
-        json_dtype = type(json_data[0][key]).__name__
+    first_doc = to_storage_document(next(iter(json_chunks()))[0], STORAGE_LAYOUT)
+    for key in first_doc.keys():
+        json_dtype = type(first_doc[key]).__name__
         mongo_dtype = type(sample_doc.get(key, None)).__name__
         
         print(f"Clé '{key}': JSON = {json_dtype}, MongoDB = {mongo_dtype}")
@@ -53,12 +52,20 @@ def test_data_types(json_data):
 
     print("✅ Vérification des types de données OK")
 
-def test_random_record_comparison(json_data):
+def test_random_record_comparison(json_chunks):
     """Teste si un document aléatoire dans le JSON est bien répliqué et identique dans MongoDB."""
-    random_index = random.randint(0, len(json_data) - 1)
-    json_doc = json_data[random_index]
-
-    mongo_doc = collection.find_one({"id_station": json_doc["id_station"], "datetime": json_doc["datetime"]})
+    # Tirage uniforme d'un document en une seule lecture (échantillonnage par réservoir)
+    json_doc = None
+    for index, doc in enumerate(doc for chunk in json_chunks() for doc in chunk):
+        if random.randint(0, index) == 0:
+            json_doc = doc
+    json_doc = to_storage_document(json_doc, STORAGE_LAYOUT)
+
+    mongo_docs = find_weather_data(
+        collection, {"id_station": json_doc["id_station"], "datetime": json_doc["datetime"]},
+        stations_layout=STATIONS_LAYOUT, station_cache=station_cache
+    )
+    mongo_doc = mongo_docs[0] if mongo_docs else None
 
     assert mongo_doc, f"🚨 Document introuvable dans MongoDB : {json_doc}"
 
@@ -69,3 +76,12 @@ def test_random_record_comparison(json_data):
         assert json_value == mongo_value, f"🚨 Différence trouvée dans '{key}' : JSON={json_value}, MongoDB={mongo_value}"
 
     print("✅ Vérification des valeurs OK")
+
+def test_full_dataset_digests(json_chunks):
+    """Teste que tous les documents du JSON sont identiques dans MongoDB (empreintes par station et par jour)."""
+    # Lu sur le primaire : juste après un chargement, un secondaire en retard signalerait de faux écarts
+    report = verify_integrity(json_chunks, collection, STORAGE_LAYOUT, STATIONS_LAYOUT, station_cache)
+
+    print(f"\n{report['json_buckets']} groupes (station, jour) vérifiés en {report['elapsed_s']} s")
+    assert not report["mismatched"], f"🚨 Groupes en écart : {report['mismatched']}"
+    print("✅ Vérification complète des empreintes OK")
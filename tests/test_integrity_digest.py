@@ -0,0 +1,32 @@
+from integrity import digest_buckets, verify_integrity
+from fakes import FakeCollection, make_document
+
+
+def test_digests_ignore_order_and_load_fields():
+    """Teste que l'empreinte d'un groupe ne dépend ni de l'ordre des documents ni des champs ajoutés au chargement."""
+    docs = [make_document("07015", f"2024-10-01 0{hour}:00:00", temperature=10.0 + hour, humidity=80) for hour in range(3)]
+    loaded = [{**doc, "_id": index, "content_hash": "x"} for index, doc in enumerate(reversed(docs))]
+
+    assert digest_buckets(docs) == digest_buckets(loaded)
+    assert list(digest_buckets(docs)) == [("07015", "2024-10-01")]
+
+
+def test_verify_integrity_drills_down_into_mismatched_buckets_only():
+    """Teste que seuls les groupes en écart sont relus, et que le détail identifie les documents fautifs."""
+    json_docs = [make_document(station, f"2024-10-0{day} 0{hour}:00:00", temperature=10.0 + hour, humidity=80)
+                 for station in ("07015", "00052") for day in (1, 2) for hour in range(3)]
+    mongo_docs = [dict(doc) for doc in json_docs if doc["datetime"] != "2024-10-02 01:00:00" or doc["id_station"] != "00052"]
+    mongo_docs[0] = {**mongo_docs[0], "weather_data": {"temperature": 99.0, "humidity": 80}}
+    collection = FakeCollection(mongo_docs + [make_document("07015", "2024-10-03 00:00:00", temperature=5.0, humidity=80)])
+
+    report = verify_integrity(lambda: [json_docs[:5], json_docs[5:]], collection, "standard", "embedded")
+
+    assert (report["json_documents"], report["mongo_documents"]) == (12, 12)
+    assert [(bucket["id_station"], bucket["day"]) for bucket in report["mismatched"]] == [
+        ("00052", "2024-10-02"), ("07015", "2024-10-01"), ("07015", "2024-10-03")
+    ]
+    missing, different, unexpected = report["mismatched"]
+    assert missing["missing"] == ["2024-10-02 01:00:00"] and (missing["json_count"], missing["mongo_count"]) == (3, 2)
+    assert different["different"] == ["2024-10-01 00:00:00"] and not different["missing"]
+    assert unexpected["unexpected"] == ["2024-10-03 00:00:00"]
+    assert len(collection.queries) == 1 + 3  # Un parcours complet, puis une requête par groupe en écart
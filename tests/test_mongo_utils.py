@@ -0,0 +1,136 @@
+from datetime import datetime
+import pytest
+from fakes import FakeCollection
+from mongo_utils import (
+    StationCache, day_filter, ensure_indexes, partition_index, station_day_query, summarize_explain, to_storage_document, write_in_threads
+)
+
+
+def test_day_filter_standard_layout_bounds_strings():
+    """Teste que le filtre d'une journée encadre les chaînes datetime de ce jour uniquement."""
+    day = day_filter("2024-10-31", "standard")
+
+    assert day == {"$gte": "2024-10-31", "$lt": "2024-11-01"}
+    assert day["$gte"] <= "2024-10-31 00:00:00" < day["$lt"]
+    assert day["$gte"] <= "2024-10-31 23:59:00" < day["$lt"]
+    assert not "2024-11-01 00:00:00" < day["$lt"]
+
+
+def test_station_day_query_timeseries_layout_uses_dates():
+    """Teste que l'organisation time-series interroge des dates BSON sur un changement d'année."""
+    query = station_day_query("ILAMAD25", "2024-12-31", "timeseries")
+
+    assert query == {
+        "id_station": "ILAMAD25",
+        "datetime": {"$gte": datetime(2024, 12, 31), "$lt": datetime(2025, 1, 1)},
+    }
+
+
+def test_to_storage_document():
+    """Teste la conversion du champ datetime selon l'organisation du stockage."""
+    doc = {"id_station": "07015", "datetime": "2024-10-02 13:00:00", "weather_data": {}}
+
+    assert to_storage_document(doc, "standard") is doc
+    assert to_storage_document(doc, "timeseries")["datetime"] == datetime(2024, 10, 2, 13)
+    assert doc["datetime"] == "2024-10-02 13:00:00"
+    with pytest.raises(ValueError):
+        to_storage_document(doc, "columnar")
+
+
+def test_summarize_explain_reports_winning_index():
+    """Teste le résumé d'un explain("executionStats") avec un plan imbriqué."""
+    explain = {
+        "queryPlanner": {"winningPlan": {"queryPlan": {
+            "stage": "FETCH",
+            "inputStage": {"stage": "IXSCAN", "indexName": "id_station_1_datetime_1"},
+        }}},
+        "executionStats": {"totalDocsExamined": 24, "totalKeysExamined": 24, "nReturned": 24, "executionTimeMillis": 1},
+    }
+
+    assert summarize_explain(explain) == {
+        "index": "id_station_1_datetime_1", "docs_examined": 24, "keys_examined": 24, "returned": 24, "time_ms": 1,
+    }
+
+    explain["queryPlanner"]["winningPlan"] = {"stage": "COLLSCAN"}
+    assert summarize_explain(explain)["index"] == "COLLSCAN"
+
+
+def test_ensure_indexes_drops_redundant_station_index():
+    """Teste que l'index simple id_station est supprimé et l'index composé recréé avec l'option unique attendue."""
+    collection = FakeCollection(indexes={
+        "_id_": {"key": [("_id", 1)]},
+        "id_station_1": {"key": [("id_station", 1.0)]},
+        "id_station_1_datetime_1": {"key": [("id_station", 1), ("datetime", 1)]},
+        "datetime_1": {"key": [("datetime", 1)]},
+    })
+
+    ensure_indexes(collection, unique=True)
+
+    assert collection.dropped_indexes == ["id_station_1", "id_station_1_datetime_1"]
+    assert collection.created_indexes == [([("id_station", 1), ("datetime", 1)], True), ([("datetime", 1)], False)]
+
+
+def test_station_cache_attaches_station_info_with_one_read():
+    """Teste que le cache des stations rejoint station_info en ne lisant la collection qu'une fois."""
+    stations = FakeCollection([{"_id": "07015", "station_info": {"name": "Lille-Lesquin"}}])
+    station_cache = StationCache({"stations": stations})
+
+    docs = [station_cache.attach({"id_station": id_station}) for id_station in ["07015", "07015", "UNKNOWN"]]
+
+    assert [doc["station_info"] for doc in docs] == [{"name": "Lille-Lesquin"}, {"name": "Lille-Lesquin"}, {}]
+    assert stations.find_calls == 1
+
+    station_cache.invalidate()
+    station_cache.attach({"id_station": "07015"})
+    assert stations.find_calls == 2
+
+
+def make_load_documents(stations=5, hours=40):
+    return [
+        {"id_station": f"S{station}", "datetime": f"2024-10-01 {hour % 24:02d}:{hour // 24:02d}:00"}
+        for hour in range(hours) for station in range(stations)
+    ]
+
+
+@pytest.mark.parametrize("partition", ["station", "hash"])
+def test_write_in_threads_routes_every_document_once(partition):
+    """Teste que chaque document est écrit une seule fois, par le thread de sa partition, en lots bornés."""
+    docs = make_load_documents()
+
+    def write_batches(worker, batches):
+        batches = list(batches)
+        assert all(0 < len(batch) <= 7 for batch in batches)
+        return worker, [doc for batch in batches for doc in batch]
+
+    results = write_in_threads(iter(docs), write_batches, workers=3, partition=partition, batch_size=7)
+
+    assert [worker for worker, _ in results] == [0, 1, 2]
+    written = [doc for _, worker_docs in results for doc in worker_docs]
+    assert sorted(map(str, written)) == sorted(map(str, docs))
+    for worker, worker_docs in results:
+        assert all(partition_index(doc, 3, partition) == worker for doc in worker_docs)
+    if partition == "station":
+        stations_by_worker = [{doc["id_station"] for doc in worker_docs} for _, worker_docs in results]
+        assert sum(map(len, stations_by_worker)) == 5  # Une station n'est écrite que par un thread
+
+
+def test_write_in_threads_single_worker_keeps_order():
+    """Teste qu'avec un seul thread les lots sont écrits dans l'ordre de lecture."""
+    docs = make_load_documents(stations=2, hours=5)
+
+    results = write_in_threads(docs, lambda worker, batches: [len(batch) for batch in batches], workers=1, batch_size=4)
+
+    assert results == [[4, 4, 2]]
+
+
+def test_write_in_threads_propagates_worker_errors():
+    """Teste qu'une erreur dans un thread d'écriture est remontée sans bloquer la répartition."""
+    def write_batches(worker, batches):
+        for batch in batches:
+            if worker == 1:
+                raise RuntimeError("écriture impossible")
+        return worker
+
+    with pytest.raises(RuntimeError, match="écriture impossible"):
+        write_in_threads(make_load_documents(stations=8, hours=200), write_batches, workers=2, partition="hash",
+                         batch_size=3, queue_size=1)
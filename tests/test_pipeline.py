@@ -0,0 +1,118 @@
+import os
+import subprocess
+import sys
+import types
+import pandas as pd
+import pytest
+import pipeline
+
+
+def test_cli_does_not_import_heavy_modules():
+    """Teste que la ligne de commande n'importe ni pandas, ni boto3, ni pymongo avant la sous-commande."""
+    code = "import sys, pipeline; pipeline.build_parser(); print(sorted({'pandas', 'boto3', 'pymongo'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_load_does_not_import_pandas():
+    """Teste que le module de chargement (insert_data et s3_utils) n'importe pas pandas."""
+    pytest.importorskip("pymongo")
+    code = "import sys, insert_data; print('pandas' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert result.stdout.strip() == "False"
+
+
+def test_transform_data_imports_pandas_and_boto3_lazily():
+    """Teste que l'import de transform_data (benchmark par exemple) ne charge ni pandas, ni boto3, ni pymongo."""
+    code = "import sys, transform_data; print(sorted({'pandas', 'boto3', 'pymongo'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_options_are_only_offered_where_used():
+    """Teste que --format n'est proposé qu'à transform et load, et --cache-dir qu'à extract et transform."""
+    parser = pipeline.build_parser()
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(["extract", "--format", "parquet"])
+    with pytest.raises(SystemExit):
+        parser.parse_args(["load", "--cache-dir", "/tmp/cache"])
+    assert parser.parse_args(["load", "--format", "parquet"]).WEATHER_DATA_FORMAT == "parquet"
+    assert parser.parse_args(["extract", "--cache-dir", "/tmp/cache"]).PIPELINE_CACHE_DIR == "/tmp/cache"
+
+
+def test_load_options_are_applied_before_import(monkeypatch):
+    """Teste que les options de load sont appliquées aux variables d'environnement avant l'import d'insert_data."""
+    calls = []
+    monkeypatch.setitem(sys.modules, "insert_data", types.SimpleNamespace(main=lambda: calls.append(os.environ["LOAD_MODE"])))
+    monkeypatch.delenv("LOAD_WORKERS", raising=False)
+    monkeypatch.setenv("LOAD_MODE", "full")
+
+    pipeline.main(["load", "--mode", "incremental", "--workers", "4"])
+
+    assert calls == ["incremental"]
+    assert os.environ["LOAD_WORKERS"] == "4"
+    monkeypatch.delenv("LOAD_WORKERS")
+
+
+def test_transform_resume_flag(monkeypatch):
+    """Teste que transform --resume reprend à partir de l'extraction enregistrée."""
+    calls = []
+    monkeypatch.setitem(sys.modules, "transform_data", types.SimpleNamespace(main=lambda **kwargs: calls.append(kwargs)))
+
+    pipeline.main(["transform", "--resume"])
+    pipeline.main(["extract"])
+
+    assert calls == [{"resume": True}, {"extract_only": True}]
+
+
+def test_extract_cache_round_trip(tmp_path):
+    """Teste que l'extraction enregistrée localement est relue à l'identique."""
+    transform_data = pytest.importorskip("transform_data")
+    extracted = {
+        "stations": [{"id": "07015", "name": "Lille-Lesquin"}],
+        "weather_be": pd.DataFrame({"Time": [None, "00:04:00"]}),
+        "weather_fr": pd.DataFrame({"Time": [None, "00:09:00"]}),
+        "infoclimat_stations": [pd.DataFrame({"id_station": ["07015"], "temperature": ["12.3"]})],
+    }
+
+    sources = {"infoclimat": ["GreenAndCoop InfoClimat/infoclimat/2025_02_13_1739448920127_0.jsonl"]}
+
+    assert transform_data.load_extract_cache(sources, str(tmp_path)) is None
+    transform_data.save_extract_cache(extracted, sources, str(tmp_path))
+    reloaded = transform_data.load_extract_cache(sources, str(tmp_path))
+
+    assert reloaded["stations"] == extracted["stations"]
+    pd.testing.assert_frame_equal(reloaded["weather_be"], extracted["weather_be"])
+    pd.testing.assert_frame_equal(reloaded["infoclimat_stations"][0], extracted["infoclimat_stations"][0])
+
+
+def test_extract_cache_ignored_for_other_sources(tmp_path, monkeypatch):
+    """Teste qu'une extraction enregistrée n'est pas reprise pour une autre synchronisation Airbyte."""
+    transform_data = pytest.importorskip("transform_data")
+    sources = {"infoclimat": ["GreenAndCoop InfoClimat/infoclimat/2025_02_13_1739448920127_0.jsonl"]}
+    transform_data.save_extract_cache({"stations": []}, sources, str(tmp_path))
+
+    newer = {"infoclimat": ["GreenAndCoop InfoClimat/infoclimat/2025_03_01_1740800000000_0.jsonl"]}
+    assert transform_data.load_extract_cache(newer, str(tmp_path)) is None
+    monkeypatch.setattr(transform_data, "AIRBYTE_SYNC", "latest" if transform_data.AIRBYTE_SYNC != "latest" else "pinned")
+    assert transform_data.load_extract_cache(sources, str(tmp_path)) is None
+
+
+def test_probe_benchmark_options(monkeypatch):
+    """Teste que probe --benchmark lance le mode benchmark avec les options appliquées avant l'import."""
+    calls = []
+    monkeypatch.setitem(sys.modules, "data_accessibility", types.SimpleNamespace(
+        main=lambda benchmark: calls.append((benchmark, os.environ["ACCESS_BENCHMARK_THREADS"]))
+    ))
+    monkeypatch.setenv("ACCESS_BENCHMARK_THREADS", "1")
+
+    pipeline.main(["probe", "--check", "accessibility", "--benchmark", "--threads", "8"])
+
+    assert calls == [(True, "8")]
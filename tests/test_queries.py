@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytest
+from pymongo.errors import OperationFailure
+from pymongo.read_preferences import Primary
+from fakes import FakeCollection
+from queries import (
+    QueryCache, ReadRouter, cache_ttl, get_daily_summary, get_hourly, normalize_datetime, read_preference, read_router
+)
+
+
+class FakeClock:
+    """Horloge manuelle pour tester la durée de vie des résultats."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDb(dict):
+    """Base minimale : collections par nom, préférences de lecture demandées et statut du replica set."""
+    def __init__(self, collections, members=None):
+        super().__init__(collections)
+        self.read_preferences = []
+        self.members = members
+        self.client = self
+        self.admin = self
+
+    def get_collection(self, name, read_preference=None):
+        self.read_preferences.append((name, read_preference.mongos_mode))
+        return self[name]
+
+    def command(self, name):
+        if self.members is None:
+            raise OperationFailure("not running with --replSet")
+        return {"members": self.members}
+
+
+def replica_set(lag_seconds):
+    """Statut d'un replica set à trois membres dont le secondaire le plus en retard a lag_seconds de retard."""
+    now = datetime(2025, 3, 1, 12, 0, 0)
+    return [
+        {"stateStr": "PRIMARY", "optimeDate": now},
+        {"stateStr": "SECONDARY", "optimeDate": now},
+        {"stateStr": "SECONDARY", "optimeDate": now - timedelta(seconds=lag_seconds)},
+    ]
+
+
+def test_query_cache_lru_and_ttl():
+    """Teste l'éviction du résultat le moins récemment utilisé et l'expiration après la durée de vie."""
+    clock = FakeClock()
+    cache = QueryCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", [1], "S1", "2024-10-01 00:00:00", "2024-10-02 00:00:00")
+    cache.set("b", [2], "S1", "2024-10-02 00:00:00", "2024-10-03 00:00:00")
+    assert cache.get("a") == [1]  # "b" devient le moins récemment utilisé
+
+    cache.set("c", [3], "S2", "2024-10-01 00:00:00", "2024-10-02 00:00:00")
+    assert cache.get("b") is None
+
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 33.33, "size": 1}
+
+
+def test_query_cache_is_thread_safe():
+    """Teste que des lectures et écritures concurrentes gardent des compteurs exacts et une taille bornée."""
+    cache = QueryCache(maxsize=8)
+
+    def lookups(worker):
+        for i in range(2000):
+            key = (worker + i) % 32
+            if cache.get(key) is None:
+                cache.set(key, [key], "S1", "2024-10-01 00:00:00", "2024-10-02 00:00:00")
+            if i % 100 == 0:
+                cache.invalidate("S1")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lookups, range(8)))
+
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 8 * 2000
+    assert stats["size"] <= 8
+
+
+def test_query_cache_invalidates_overlapping_station_ranges():
+    """Teste que seuls les résultats de la station recoupant la plage écrite sont invalidés."""
+    cache = QueryCache()
+    cache.set("oct-01", [1], "S1", "2024-10-01 00:00:00", "2024-10-02 00:00:00")
+    cache.set("oct-02", [2], "S1", "2024-10-02 00:00:00", "2024-10-03 00:00:00")
+    cache.set("other", [3], "S2", "2024-10-02 00:00:00", "2024-10-03 00:00:00")
+
+    assert cache.invalidate("S1", "2024-10-02 05:00:00", "2024-10-02 06:00:00") == 1
+    assert cache.get("oct-01") == [1]
+    assert cache.get("oct-02") is None
+    assert cache.get("other") == [3]
+
+    assert cache.invalidate("S2") == 1
+
+
+def test_sync_invalidations_reads_loader_writes():
+    """Teste l'invalidation à partir des plages écrites par le chargeur dans load_metadata."""
+    metadata = FakeCollection([
+        {"_id": "S1", "updated_at": datetime(2025, 3, 1), "written_from": "2024-10-01 00:00:00", "written_to": "2024-10-01 23:00:00"},
+    ])
+    cache = QueryCache()
+    cache.sync_invalidations({"load_metadata": metadata}, force=True)  # Première lecture : référence
+    cache.set("oct-01", [1], "S1", "2024-10-01 00:00:00", "2024-10-02 00:00:00")
+
+    cache.sync_invalidations({"load_metadata": metadata}, force=True)
+    assert cache.get("oct-01") == [1]
+
+    metadata.documents[0] = {**metadata.documents[0], "updated_at": datetime(2025, 3, 2)}
+    cache.sync_invalidations({"load_metadata": metadata}, force=True)
+    assert cache.get("oct-01") is None
+
+
+def test_get_hourly_uses_cache():
+    """Teste qu'une requête identique (à la normalisation des dates près) est servie par le cache."""
+    weather_data = FakeCollection([{"id_station": "S1", "datetime": "2024-10-01 00:04:00"}])
+    db = FakeDb({"weather_data": weather_data, "load_metadata": FakeCollection([])})
+    cache = QueryCache()
+
+    first = get_hourly(db, "S1", "2024-10-01", "2024-10-02", cache=cache, stations_layout="embedded")
+    second = get_hourly(db, "S1", "2024-10-01 00:00:00", "2024-10-02", cache=cache, stations_layout="embedded")
+
+    assert first == second == weather_data.documents
+    assert weather_data.find_calls == 1
+    assert normalize_datetime("2024-10-01") == "2024-10-01 00:00:00"
+
+
+def test_read_router_sends_analytic_reads_to_secondaries_and_falls_back():
+    """Teste le routage des requêtes analytiques vers les secondaires et le repli sur le primaire en cas de retard."""
+    clock = FakeClock()
+    router = ReadRouter({"operational": "primary", "analytic": "secondaryPreferred"}, max_lag=10, check_interval=5, clock=clock)
+    db = FakeDb({"weather_data": FakeCollection()}, members=replica_set(lag_seconds=2))
+
+    assert router.route(db, "operational").mongos_mode == "primary"
+    assert router.route(db, "analytic").mongos_mode == "secondaryPreferred"
+
+    db.members = replica_set(lag_seconds=30)
+    assert router.route(db, "analytic").mongos_mode == "secondaryPreferred"  # Retard encore en cache
+    clock.now = 6
+    assert router.route(db, "analytic").mongos_mode == "primary"
+    assert (router.lag, router.fallbacks) == (30, 1)
+
+    db.members = None  # Statut illisible : pas de repli
+    clock.now = 12
+    assert router.route(db, "analytic").mongos_mode == "secondaryPreferred"
+
+
+def test_per_query_read_preference_with_tags_and_staleness():
+    """Teste la préférence de lecture fournie à une requête, avec tag sets et maxStalenessSeconds."""
+    db = FakeDb({"weather_data": FakeCollection(), "load_metadata": FakeCollection([])}, members=replica_set(0))
+    preference = read_preference("nearest", tag_sets=[{"usage": "analytics"}, {}], max_staleness=90)
+
+    get_daily_summary(db, "S1", "2024-10-01", "2024-10-02", cache=None, read_preference=preference)
+
+    assert db.read_preferences == [("weather_data", "nearest")]
+    assert preference.document == {"mode": "nearest", "tags": [{"usage": "analytics"}, {}], "maxStalenessSeconds": 90}
+    with pytest.raises(ValueError):
+        read_preference("secondaryOnly")
+
+
+def test_secondary_reads_are_cached_for_at_most_the_tolerated_lag():
+    """Teste que les lectures sur un secondaire sont en cache au plus max_lag secondes et séparées des lectures sur le primaire."""
+    clock = FakeClock()
+    weather_data = FakeCollection([{"id_station": "S1", "datetime": "2024-10-01 00:04:00"}])
+    db = FakeDb({"weather_data": weather_data, "load_metadata": FakeCollection([])}, members=replica_set(0))
+    cache = QueryCache(ttl=300, clock=clock)
+    secondary = read_preference("secondaryPreferred")
+
+    for _ in range(2):
+        get_hourly(db, "S1", "2024-10-01", "2024-10-02", cache=cache, stations_layout="embedded", read_preference=secondary)
+    assert weather_data.find_calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    get_hourly(db, "S1", "2024-10-01", "2024-10-02", cache=cache, stations_layout="embedded", read_preference=Primary())
+    assert weather_data.find_calls == 2
+
+    clock.now = read_router.max_lag + 1
+    get_hourly(db, "S1", "2024-10-01", "2024-10-02", cache=cache, stations_layout="embedded", read_preference=secondary)
+    get_hourly(db, "S1", "2024-10-01", "2024-10-02", cache=cache, stations_layout="embedded", read_preference=Primary())
+    assert weather_data.find_calls == 3  # Lecture secondaire expirée, lecture primaire encore en cache
+
+    assert cache_ttl(read_preference("secondary", max_staleness=90), ReadRouter(max_lag=None)) == 90
+    assert cache_ttl(Primary()) is None
@@ -1,8 +1,9 @@
 import pymongo
 import pytest
 import os
-import time
 from pymongo import ReadPreference
+from fakes import FakeCollection
+from replication import REPLICATION_PROBE_COLLECTION_NAME, REPLICATION_TIMEOUT, measure_replication_lag, replicate, wait_until
 
 PRIMARY_URI = os.getenv("MONGO_PRIMARY_URI", "mongodb://mongodb1:27017")
 SECONDARY_URI = os.getenv("MONGO_SECONDARY_URI", "mongodb://mongodb2:27017")
@@ -30,12 +31,10 @@ def secondary_client():
 
 def test_replication(primary_client, secondary_client):
     """Teste la réplication des données entre le primaire et le secondaire."""
-    # Insérer un document test
-    primary_client.insert_one(TEST_DOC)
-    print("✅ Document inséré sur le primaire.")
-
-    # Attente de la réplication
-    time.sleep(5)
+    # Insérer un document test et attendre sa réplication (lecture causale, au plus REPLICATION_TIMEOUT secondes)
+    lag_ms = replicate(primary_client, secondary_client, lambda session: primary_client.insert_one(TEST_DOC, session=session),
+                       {"id_station": "TestStation"})
+    print(f"✅ Document inséré sur le primaire, répliqué en {lag_ms:.1f} ms.")
 
     # Vérifier la réplication
     replicated_doc = secondary_client.find_one({"id_station": "TestStation"})
@@ -45,9 +44,54 @@ def test_replication(primary_client, secondary_client):
     print("✅ Réplication réussie.")
 
     # Suppression et vérification de la réplication de la suppression
-    primary_client.delete_one({"id_station": "TestStation"})
-    time.sleep(5)
+    lag_ms = replicate(primary_client, secondary_client, lambda session: primary_client.delete_one({"id_station": "TestStation"}, session=session),
+                       {"id_station": "TestStation"}, present=False)
     replicated_doc_after_deletion = secondary_client.find_one({"id_station": "TestStation"})
     assert replicated_doc_after_deletion is None, "❌ Suppression non répliquée."
 
-    print("✅ Suppression répliquée avec succès.")
+    print(f"✅ Suppression répliquée avec succès en {lag_ms:.1f} ms.")
+
+
+def test_replication_lag_probe(primary_client, secondary_client):
+    """Teste la sonde de retard de réplication sur quelques écritures, avec chacune des deux attentes."""
+    # Collection de mesure sans validation, comme replication.main() (weather_data refuse ces documents)
+    primary_probe = primary_client.database[REPLICATION_PROBE_COLLECTION_NAME]
+    secondary_probe = secondary_client.database[REPLICATION_PROBE_COLLECTION_NAME]
+    for method in ("session", "poll"):
+        summary = measure_replication_lag(primary_probe, secondary_probe, writes=5, method=method)
+        assert summary["writes"] == 5
+        assert 0 <= summary["p50_ms"] <= summary["p99_ms"] <= REPLICATION_TIMEOUT * 1000
+    assert primary_probe.count_documents({"run": {"$exists": True}}) == 0  # Documents de mesure supprimés
+
+
+class DelayedCollection(FakeCollection):
+    """Collection dont les écritures ne deviennent visibles qu'après quelques lectures."""
+    def __init__(self, reads_before_visible):
+        super().__init__()
+        self.reads_before_visible = reads_before_visible
+
+    @property
+    def reads(self):
+        return len(self.calls)
+
+    def find_one(self, query=None, **kwargs):
+        found = super().find_one(query, **kwargs)
+        return found if self.reads > self.reads_before_visible else None
+
+
+def test_poll_waits_with_backoff_until_visible():
+    """Teste l'attente par relectures : le retard mesuré couvre les relectures jusqu'à la visibilité."""
+    collection = DelayedCollection(reads_before_visible=3)
+
+    lag_ms = replicate(collection, collection, lambda session: collection.insert_one({"id": 1}, session=session),
+                       {"id": 1}, method="poll", timeout=5)
+
+    assert collection.reads == 4
+    assert lag_ms >= (0.002 + 0.004 + 0.008) * 1000  # Attente doublée entre deux relectures
+
+
+def test_wait_until_times_out():
+    """Teste qu'une écriture jamais visible lève TimeoutError au lieu d'attendre indéfiniment."""
+    with pytest.raises(TimeoutError):
+        wait_until(lambda: False, timeout=0.05)
+
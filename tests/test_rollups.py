@@ -0,0 +1,30 @@
+from fakes import FakeCollection
+from rollups import refresh_station_rollups
+
+
+def make_db():
+    return {"weather_data": FakeCollection(), "weather_daily": FakeCollection(name="weather_daily")}
+
+
+def test_refresh_station_rollups_limits_to_written_days_and_months():
+    """Teste que seuls les jours et mois couverts par la plage écrite sont recalculés."""
+    db = make_db()
+
+    refresh_station_rollups(db, "07015", "2024-10-31 22:00:00", "2024-11-01 03:00:00", "standard")
+
+    daily_pipeline = db["weather_data"].pipelines[0]
+    monthly_pipeline = db["weather_daily"].pipelines[0]
+    assert daily_pipeline[0] == {"$match": {"id_station": "07015", "datetime": {"$gte": "2024-10-31", "$lt": "2024-11-02"}}}
+    assert monthly_pipeline[0] == {"$match": {"id_station": "07015", "month": {"$gte": "2024-10", "$lte": "2024-11"}}}
+    assert daily_pipeline[-1]["$merge"]["into"] == "weather_daily"
+    assert monthly_pipeline[-1]["$merge"]["into"] == "weather_monthly"
+
+
+def test_refresh_station_rollups_without_range_rebuilds_station():
+    """Teste qu'une station rechargée entièrement est recalculée sur tout son historique."""
+    db = make_db()
+
+    refresh_station_rollups(db, "07015")
+
+    assert db["weather_data"].pipelines[0][0] == {"$match": {"id_station": "07015"}}
+    assert db["weather_daily"].pipelines[0][0] == {"$match": {"id_station": "07015"}}
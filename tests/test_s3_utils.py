@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import pandas as pd
+import pytest
+from fakes import FakeS3Client, make_document
+from s3_utils import (
+    SourceCache, check_weather_data_format, iter_airbyte_data, iter_weather_data, list_airbyte_parts, map_in_threads, prefetch_sources,
+    records_to_dataframe, save_weather_data
+)
+from transform_utils import WEATHER_DATA_FIELDS
+
+
+def make_jsonl(rows):
+    return "\n".join(json.dumps({"_airbyte_data": row}) for row in rows).encode("utf-8") + b"\n"
+
+
+def make_source(rows, file_key="key.jsonl"):
+    """Client S3 contenant un fichier JSONL Airbyte."""
+    s3_client = FakeS3Client()
+    s3_client.put_object(Body=make_jsonl(rows), Bucket="bucket", Key=file_key)
+    return s3_client
+
+
+def make_documents(n):
+    """Génère des documents transformés pour deux stations, avec toutes les mesures de weather_data."""
+    return [
+        make_document(id_station, f"2024-10-01 {i % 24:02d}:00:00", **{
+            **dict.fromkeys(WEATHER_DATA_FIELDS), "temperature": 10.5 + i, "humidity": 80 + i % 20,
+            "visibility": None if i % 2 else 2000.0,
+        })
+        for i, id_station in enumerate(["07015", "ILAMAD25"] * (n // 2))
+    ]
+
+
+def test_iter_airbyte_data_yields_payloads():
+    """Teste que chaque ligne JSONL est restituée sous forme de données "_airbyte_data"."""
+    rows = [{"Time": f"{hour}:00", "Temperature": f"{hour} °F"} for hour in range(10)]
+    source_cache = SourceCache(make_source(rows))
+
+    assert list(iter_airbyte_data(source_cache, "bucket", "key.jsonl")) == rows
+
+
+def test_source_cache_downloads_once_per_etag():
+    """Teste qu'un fichier relu pendant la même exécution n'est téléchargé et son ETag demandé qu'une fois."""
+    rows = [{"stations": [], "hourly": {}}]
+    s3_client = make_source(rows)
+    source_cache = SourceCache(s3_client, in_memory=True)
+
+    assert list(iter_airbyte_data(source_cache, "bucket", "key.jsonl")) == rows
+    assert list(iter_airbyte_data(source_cache, "bucket", "key.jsonl")) == rows
+    assert (s3_client.get_calls, s3_client.head_calls) == (1, 1)
+
+    # Un nouvel ETag (listé, ou lu par une nouvelle exécution) invalide la copie en cache
+    s3_client.put_object(Body=make_jsonl(rows * 2), Bucket="bucket", Key="key.jsonl")
+    source_cache.fetch("bucket", "key.jsonl", s3_client.etag("bucket", "key.jsonl"))
+    list(iter_airbyte_data(SourceCache(s3_client, in_memory=True), "bucket", "key.jsonl"))
+    assert (s3_client.get_calls, s3_client.head_calls) == (3, 2)
+
+
+def test_source_cache_uses_listed_etags_and_drops_stale_copies(tmp_path):
+    """Teste qu'un ETag listé évite head_object et qu'un nouvel ETag remplace la copie sur disque du précédent."""
+    s3_client = make_source([{"Time": "0:00"}], "a.jsonl")
+    s3_client.put_object(Body=make_jsonl([{"Time": "0:00"}]), Bucket="bucket", Key="b.jsonl")
+    etags = {file_key: s3_client.etag("bucket", file_key) for file_key in ("a.jsonl", "b.jsonl")}
+
+    first_run = SourceCache(s3_client, spool_dir=str(tmp_path))
+    prefetch_sources(first_run, "bucket", ["a.jsonl", "b.jsonl"], etags)
+    assert list(iter_airbyte_data(first_run, "bucket", "a.jsonl")) == [{"Time": "0:00"}]
+    assert (s3_client.get_calls, s3_client.head_calls) == (2, 0)
+    assert len(os.listdir(tmp_path)) == 2
+
+    s3_client.put_object(Body=make_jsonl([{"Time": "1:00"}]), Bucket="bucket", Key="a.jsonl")
+    second_run = SourceCache(s3_client, spool_dir=str(tmp_path))
+    assert list(iter_airbyte_data(second_run, "bucket", "a.jsonl")) == [{"Time": "1:00"}]
+    assert (s3_client.get_calls, s3_client.head_calls) == (3, 1)
+    assert len(os.listdir(tmp_path)) == 2  # La copie de a.jsonl pour etag-1 est supprimée
+
+
+def test_source_cache_spool_survives_between_runs(tmp_path):
+    """Teste que la copie sur disque évite le téléchargement lors d'une nouvelle exécution."""
+    rows = [{"Time": "0:00"}, {"Time": "1:00"}]
+    s3_client = make_source(rows)
+
+    first_run = SourceCache(s3_client, spool_dir=str(tmp_path))
+    assert list(iter_airbyte_data(first_run, "bucket", "key.jsonl")) == rows
+
+    second_run = SourceCache(s3_client, spool_dir=str(tmp_path))
+    assert list(iter_airbyte_data(second_run, "bucket", "key.jsonl")) == rows
+    assert s3_client.get_calls == 1
+
+
+def test_source_cache_default_spools_to_temporary_dir():
+    """Teste que, par défaut, les fichiers sont relus depuis un répertoire temporaire supprimé à la fermeture."""
+    rows = [{"Time": "0:00"}, {"Time": "1:00"}]
+    s3_client = make_source(rows)
+
+    with SourceCache(s3_client, spool_dir=None) as source_cache:
+        assert list(iter_airbyte_data(source_cache, "bucket", "key.jsonl")) == rows
+        assert list(iter_airbyte_data(source_cache, "bucket", "key.jsonl")) == rows
+        assert source_cache._objects == {}
+        spool_dir = source_cache.spool_dir
+        assert len(os.listdir(spool_dir)) == 1
+
+    assert s3_client.get_calls == 1
+    assert not os.path.exists(spool_dir)
+
+
+def test_records_to_dataframe_matches_single_dataframe():
+    """Teste que la construction par blocs donne le même DataFrame qu'en une fois."""
+    rows = [{"a": i, "b": None if i % 3 else f"v{i}"} for i in range(25)]
+
+    chunked = records_to_dataframe(iter(rows), chunk_size=4)
+
+    pd.testing.assert_frame_equal(chunked, pd.DataFrame(rows))
+    assert records_to_dataframe(iter([])).empty
+
+
+@pytest.mark.parametrize("data_format", ["json", "jsonl.gz", "parquet"])
+def test_weather_data_round_trip(data_format):
+    """Teste que chaque format intermédiaire restitue les mêmes documents, par blocs bornés."""
+    if data_format == "parquet":
+        pytest.importorskip("pyarrow")
+    s3_client = FakeS3Client()
+    documents = make_documents(10)
+
+    save_weather_data(s3_client, "bucket", documents, data_format)
+    chunks = list(iter_weather_data(s3_client, "bucket", data_format, chunk_size=4))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert [doc for chunk in chunks for doc in chunk] == documents
+
+
+def test_parquet_columns_follow_the_schema_not_the_first_document():
+    """Teste qu'une mesure absente du premier document est conservée pour les suivants, et lue sans tout charger en mémoire."""
+    pytest.importorskip("pyarrow")
+    s3_client = FakeS3Client()
+    documents = make_documents(4)
+    del documents[0]["weather_data"]["uv"]
+    documents[1]["weather_data"]["uv"] = 3
+
+    save_weather_data(s3_client, "bucket", documents, "parquet")
+    reloaded = [doc for chunk in iter_weather_data(s3_client, "bucket", "parquet", chunk_size=3) for doc in chunk]
+
+    assert list(reloaded[0]["weather_data"]) == WEATHER_DATA_FIELDS
+    assert reloaded[0]["weather_data"]["uv"] is None
+    assert reloaded[1]["weather_data"]["uv"] == 3
+    assert reloaded[1:] == documents[1:]
+    assert s3_client.head_calls == 1  # Copie sur disque via SourceCache, ETag vérifié
+
+
+def test_parquet_without_pyarrow_fails_before_any_work(monkeypatch):
+    """Teste que le format parquet sans pyarrow lève une erreur explicite dès la vérification du format."""
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    s3_client = FakeS3Client()
+
+    with pytest.raises(ImportError, match="pip install pyarrow"):
+        check_weather_data_format("parquet")
+    with pytest.raises(ImportError, match="pip install pyarrow"):
+        save_weather_data(s3_client, "bucket", make_documents(2), "parquet")
+    assert s3_client.objects == {}
+    with pytest.raises(ValueError):
+        check_weather_data_format("csv")
+    check_weather_data_format("jsonl.gz")
+
+
+def test_list_airbyte_parts_across_pages():
+    """Teste la liste des parties d'une synchronisation, réparties sur plusieurs pages, dans l'ordre des parties."""
+    prefix = "GreenAndCoop InfoClimat/infoclimat/"
+    s3_client = FakeS3Client(page_size=2)
+    for key in ["2025_02_13_1739448920127_10.jsonl", "2025_02_13_1739448920127_2.jsonl", "2025_02_13_1739448920127_0.jsonl",
+                "2025_03_01_1740787200000_0.jsonl", "_airbyte_state.json"]:
+        s3_client.put_object(Body=key, Bucket="bucket", Key=f"{prefix}{key}")
+
+    etags = {}
+    pinned = list_airbyte_parts(s3_client, "bucket", prefix, "2025_02_13_1739448920127", etags)
+    latest = list_airbyte_parts(s3_client, "bucket", prefix)
+
+    assert [key.rsplit("_", 1)[1] for key in pinned] == ["0.jsonl", "2.jsonl", "10.jsonl"]
+    assert etags == {key: s3_client.etag("bucket", key) for key in pinned}
+    assert latest == [f"{prefix}2025_03_01_1740787200000_0.jsonl"]
+    with pytest.raises(FileNotFoundError):
+        list_airbyte_parts(s3_client, "bucket", "unknown/")
+
+
+def test_map_in_threads_keeps_order():
+    """Teste que les résultats du pool de threads restent dans l'ordre des éléments."""
+    assert map_in_threads(lambda x: x * x, range(20), max_workers=4) == [x * x for x in range(20)]
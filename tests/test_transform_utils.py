@@ -0,0 +1,279 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from transform_utils import (
+    INFOCLIMAT_COLUMNS, INFOCLIMAT_FLOAT_COLUMNS, INFOCLIMAT_RENAME, WEATHER_DATA_FIELDS, WEATHER_UNDERGROUND_CONVERSIONS,
+    WIND_DIRECTION_DEGREES, add_dates_df, build_documents, build_quality_report, convert_units, map_in_processes, quality_bounds,
+    quality_summary, transform_infoclimat, transform_weather_underground
+)
+
+
+def add_dates_df_reference(df, start_date_str="2024-10-01"):
+    """Implémentation d'origine (boucle ligne à ligne), conservée comme référence."""
+    df = df.drop(index=0).reset_index(drop=True)
+    current_date = pd.to_datetime(start_date_str)
+    date_column = []
+    empty_rows = df.isnull().all(axis=1)
+    for is_empty in empty_rows:
+        if is_empty:
+            current_date += pd.Timedelta(days=1)
+        date_column.append(current_date.strftime("%Y-%m-%d"))
+    df["date"] = pd.to_datetime(date_column)
+    df['Time'] = pd.to_timedelta(df['Time'])
+    df['datetime'] = (df['date'] + df['Time']).astype(str)
+    df = df.drop(columns=['Time', 'date'])
+    return df[~empty_rows].reset_index(drop=True)
+
+
+def make_weather_underground_rows(days, readings_per_day=24):
+    """Génère des lignes Weather Underground brutes : une ligne vide sépare chaque jour."""
+    rows = [{"Time": None, "Temperature": None, "Humidity": None}]  # Première ligne supprimée
+    for day in range(days):
+        if day:
+            rows.append({"Time": None, "Temperature": None, "Humidity": None})
+        for reading in range(readings_per_day):
+            minutes = reading * 60 + 4
+            rows.append({
+                "Time": f"{minutes // 60:02d}:{minutes % 60:02d}:00",
+                "Temperature": f"{40 + (day + reading) % 30}\xa0°F",
+                "Humidity": f"{50 + reading}\xa0%",
+            })
+    return pd.DataFrame(rows)
+
+
+def test_add_dates_df_matches_reference():
+    """Teste que la version vectorisée produit exactement la même sortie que la boucle d'origine."""
+    df = make_weather_underground_rows(days=95)  # Plus de trois mois, avec changements de mois
+
+    expected = add_dates_df_reference(df.copy(), start_date_str="2024-10-01")
+    result = add_dates_df(df.copy(), start_date_str="2024-10-01")
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["datetime"].iloc[-1] == "2025-01-03 23:04:00"
+
+
+def convert_units_reference(df):
+    """Conversions d'origine (une fonction et plusieurs passes par unité), conservées comme référence."""
+    def strip(col, unit):
+        df[col] = df[col].str.replace("\xa0", "", regex=False).str.replace(unit, "", regex=False).astype(float)
+
+    for col in ["Temperature", "Dew Point"]:
+        strip(col, "°F")
+        df[col] = ((df[col] - 32) * 5/9).round(2)
+    for col, unit, factor in [("Pressure", "in", 33.8639), ("Gust", "mph", 1.60934), ("Speed", "mph", 1.60934),
+                              ("Precip. Rate.", "in", 25.4), ("Precip. Accum.", "in", 25.4)]:
+        strip(col, unit)
+        df[col] = (df[col] * factor).round(2)
+    df["Wind"] = df["Wind"].map(WIND_DIRECTION_DEGREES).astype(float)
+    for col, unit in [("Solar", "w/m²"), ("Humidity", "%")]:
+        df[col] = df[col].str.replace("\xa0", "", regex=False).str.replace(unit, "", regex=False)
+    df["Humidity"] = df["Humidity"].astype(int)
+    df["UV"] = df["UV"].astype(int)
+    df["Solar"] = df["Solar"].astype(float)
+    return df
+
+
+def make_raw_measures(n=500):
+    """Génère des mesures Weather Underground brutes avec leurs unités."""
+    directions = list(WIND_DIRECTION_DEGREES)
+    return pd.DataFrame({
+        "Temperature": [f"{20 + (i % 700) / 10:.1f}\xa0°F" for i in range(n)],
+        "Dew Point": [f"{10 + (i % 500) / 10:.1f}\xa0°F" for i in range(n)],
+        "Pressure": [f"{29 + (i % 200) / 100:.2f}\xa0in" for i in range(n)],
+        "Gust": [f"{(i % 80) / 2:.1f}\xa0mph" for i in range(n)],
+        "Speed": [f"{(i % 60) / 3:.1f}\xa0mph" for i in range(n)],
+        "Precip. Rate.": [f"{(i % 30) / 100:.2f}\xa0in" for i in range(n)],
+        "Precip. Accum.": [f"{(i % 90) / 100:.2f}\xa0in" for i in range(n)],
+        "Wind": [directions[i % len(directions)] for i in range(n)],
+        "Solar": [f"{(i * 7) % 900:.1f}\xa0w/m²" for i in range(n)],
+        "Humidity": [f"{i % 101}\xa0%" for i in range(n)],
+        "UV": [str(i % 12) for i in range(n)],
+    })
+
+
+def test_convert_units_matches_reference():
+    """Teste que la conversion pilotée par la spécification reproduit les conversions d'origine."""
+    df = make_raw_measures()
+
+    expected = convert_units_reference(df.copy())
+    result = convert_units(df.copy())
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_fahrenheit_conversion_keeps_the_original_order_of_operations():
+    """Teste que (°F - 32) * 5 / 9 est calculé au bit près comme à l'origine, avant l'arrondi."""
+    fahrenheit = np.round(np.arange(-400, 1500) / 10, 1)
+    df = pd.DataFrame({"Temperature": [f"{value:.1f}\xa0°F" for value in fahrenheit]})
+    spec = {"Temperature": {**WEATHER_UNDERGROUND_CONVERSIONS["Temperature"], "decimals": None}}
+
+    result = convert_units(df, spec)["Temperature"].to_numpy()
+
+    assert np.array_equal(result, (fahrenheit - 32) * 5 / 9)
+    assert not np.array_equal(result, (fahrenheit - 32) * (5 / 9))  # L'ordre des opérations change le dernier bit
+
+
+def test_convert_units_rejects_unexpected_unit():
+    """Teste qu'une valeur dans une unité inattendue est signalée au lieu d'être mal convertie."""
+    df = make_raw_measures(n=3)
+    df.loc[1, "Pressure"] = "1013\xa0hPa"
+
+    with pytest.raises(ValueError, match="Pressure"):
+        convert_units(df)
+
+
+def build_documents_reference(df, stations_dict):
+    """Construction d'origine (to_dict puis remodelage enregistrement par enregistrement), conservée comme référence."""
+    documents = []
+    for doc in df.to_dict(orient='records'):
+        weather_data = {field: doc.get(field, None) for field in WEATHER_DATA_FIELDS}
+        for field in ["temperature", "dew_point", "wind_speed"]:
+            weather_data[field] = round(weather_data[field], 2)
+        for key, value in weather_data.items():
+            if isinstance(value, float) and np.isnan(value):
+                weather_data[key] = None
+        documents.append({
+            "id_station": doc["id_station"],
+            "station_info": stations_dict.get(doc["id_station"], {}).get("station_info", {}),
+            "datetime": doc["datetime"],
+            "weather_data": weather_data,
+        })
+    return documents
+
+
+def test_build_documents_matches_reference():
+    """Teste que le constructeur colonne par colonne produit le même JSON que la version d'origine."""
+    stations_dict = {"07015": {"id_station": "07015", "station_info": {"name": "Lille-Lesquin", "elevation": 47}}}
+    df = pd.DataFrame({
+        "id_station": ["07015", "07015", "UNKNOWN"],
+        "datetime": ["2024-10-01 00:00:00", "2024-10-01 01:00:00", "2024-10-01 02:00:00"],
+        "temperature": pd.Series([12.345, np.nan, -3.1], dtype="float32"),
+        "pressure": [1013.25, 1012.8, np.nan],
+        "humidity": [87, 90, 91],
+        "dew_point": pd.Series([10.1, 9.87, 8.0], dtype="float32"),
+        "wind_speed": [3.456, 0.0, 12.0],
+        "wind_gust": pd.Series([np.nan, 7.2, 9.9], dtype="float32"),
+        "precip_1h": [0.0, 0.2, np.nan],
+    })
+
+    expected = build_documents_reference(df, stations_dict)
+    result = build_documents(df, stations_dict)
+
+    assert json.dumps(result, indent=4) == json.dumps(expected, indent=4)
+    assert result[1]["weather_data"]["temperature"] is None
+    assert result[2]["station_info"] == {}
+
+
+def test_build_documents_rounds_half_values_like_python():
+    """Teste que les valeurs à mi-chemin sont arrondies comme round() de Python, et non comme pandas."""
+    df = pd.DataFrame({
+        "id_station": ["07015"] * 4,
+        "datetime": [f"2024-10-01 0{hour}:00:00" for hour in range(4)],
+        "temperature": [12.345, 2.675, 0.015, -0.025],
+        "dew_point": [0.005, 0.065, 1.005, np.nan],
+        "wind_speed": [0.025, 3.456, 0.0, 7.0],
+    })
+
+    result = build_documents(df, {})
+
+    assert json.dumps(result) == json.dumps(build_documents_reference(df, {}))
+    assert [doc["weather_data"]["temperature"] for doc in result] == [12.35, 2.67, 0.01, -0.03]
+    assert df["temperature"].round(2).tolist() != [12.35, 2.67, 0.01, -0.03]  # L'arrondi de pandas diffère
+
+
+def make_infoclimat_rows(id_station, n=300):
+    """Génère des relevés InfoClimat bruts (chaînes, comme dans l'API) pour une station."""
+    return pd.DataFrame({
+        "id_station": [id_station] * n,
+        "dh_utc": [f"2024-10-{1 + i // 24:02d} {i % 24:02d}:00:00" for i in range(n)],
+        "temperature": [f"{(i % 250) / 10 - 5:.1f}" for i in range(n)],
+        "pression": [f"{990 + (i % 400) / 10:.1f}" for i in range(n)],
+        "humidite": [str(40 + i % 60) for i in range(n)],
+        "point_de_rosee": [f"{(i % 150) / 10:.1f}" for i in range(n)],
+        "visibilite": [str(1000 * (i % 30)) for i in range(n)],
+        "vent_moyen": [f"{(i % 90) / 3:.1f}" for i in range(n)],
+        "vent_rafales": [None if i % 7 else f"{(i % 60):.1f}" for i in range(n)],
+        "vent_direction": [str(10 * (i % 36)) for i in range(n)],
+        "pluie_3h": [None] * n,
+        "pluie_1h": [f"{(i % 5) / 10:.1f}" for i in range(n)],
+        "neige_au_sol": [None] * n,
+        "nebulosite": [None if i % 3 else str(i % 9) for i in range(n)],
+        "temps_omm": [None] * n,
+    })
+
+
+def transform_infoclimat_reference(df):
+    """Typage d'origine, appliqué une seule fois à toutes les stations concaténées."""
+    df = df.rename(columns=INFOCLIMAT_RENAME)[INFOCLIMAT_COLUMNS]
+    for col in INFOCLIMAT_FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], downcast="float")
+    df["humidity"] = df["humidity"].astype(int)
+    df["pressure"] = df["pressure"].apply(lambda x: round(x, 2))
+    return df
+
+
+def test_transform_infoclimat_per_station_matches_concatenated():
+    """Teste que le typage station par station donne le même résultat que le typage global d'origine."""
+    stations = [make_infoclimat_rows(id_station, n) for id_station, n in [("07015", 300), ("00052", 10), ("000R5", 49)]]
+
+    expected = transform_infoclimat_reference(pd.concat(stations, ignore_index=True))
+    result = pd.concat([transform_infoclimat(df) for df in stations], ignore_index=True)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_map_in_processes_matches_serial():
+    """Teste que le pool de processus renvoie exactement la sortie de l'exécution en série, dans l'ordre."""
+    stations = [make_infoclimat_rows(id_station, n) for id_station, n in [("07015", 120), ("00052", 30), ("000R5", 75)]]
+    # Relevés Weather Underground bruts : mesures avec unités, lignes vides entre les jours
+    weather = []
+    for days in [3, 5]:
+        times = make_weather_underground_rows(days)[["Time"]]
+        measures = make_raw_measures(len(times))
+        measures.loc[times["Time"].isna()] = None
+        weather.append(pd.concat([times, measures], axis=1))
+
+    serial = map_in_processes(transform_infoclimat, stations, max_workers=1)
+    parallel = map_in_processes(transform_infoclimat, stations, max_workers=3)
+    assert [df.to_json() for df in parallel] == [df.to_json() for df in serial]
+
+    serial = map_in_processes(transform_weather_underground, weather, ["IICHTE19", "ILAMAD25"], max_workers=1)
+    parallel = map_in_processes(transform_weather_underground, weather, ["IICHTE19", "ILAMAD25"], max_workers=2)
+    for parallel_df, serial_df in zip(parallel, serial):
+        pd.testing.assert_frame_equal(parallel_df, serial_df)
+    assert serial[1]["id_station"].unique().tolist() == ["ILAMAD25"]
+
+
+def test_quality_bounds_follow_mongo_schema():
+    """Teste que les bornes du rapport qualité sont celles du $jsonSchema de weather_data."""
+    bounds = quality_bounds()
+
+    assert bounds["humidity"] == {"minimum": 0, "maximum": 100, "nullable": False}
+    assert bounds["wind_gust"]["nullable"] is True
+
+
+def test_quality_report_counts_per_source_station_and_column():
+    """Teste les compteurs nulls, vides et hors bornes par station, et leurs totaux, sans concaténer les sources."""
+    bounds = {
+        "humidity": {"minimum": 0, "maximum": 100, "nullable": False},
+        "temperature": {"minimum": -50, "maximum": 60, "nullable": True},
+    }
+    station_a = pd.DataFrame({"humidity": [50, 120, np.nan], "temperature": [10.0, -60.0, None], "remark": ["", " ", "ok"]})
+    station_b = pd.DataFrame({"humidity": ["-5", "NaN", "80"], "temperature": [20.0, 25.0, 70.0], "remark": ["nan", None, "x"]})
+
+    report = build_quality_report([("infoclimat", "A", station_a), ("weather_underground", "B", station_b)], bounds)
+
+    assert report["rows"] == 6
+    assert report["sources"]["infoclimat"]["A"] == {"rows": 3, "columns": {
+        "humidity": {"null": 1, "above_max": 1, "null_rejected": 1},
+        "temperature": {"null": 1, "below_min": 1},
+        "remark": {"blank": 2},
+    }}
+    assert report["sources"]["weather_underground"]["B"]["columns"]["humidity"] == {"blank": 1, "below_min": 1}
+    assert report["totals"]["remark"] == {"blank": 3, "null": 1}
+    assert report["totals"]["temperature"] == {"null": 1, "below_min": 1, "above_max": 1}
+    json.dumps(report)  # Sérialisable tel quel pour l'artefact S3
+
+    summary = quality_summary(report)
+    assert summary.loc["remark", "% NaN"] == round(4 / 6 * 100, 2)
@@ -1,51 +1,50 @@
 # %%
-import boto3
-import pandas as pd
-import numpy as np
-from io import StringIO
+import copy
 import json
-
-
-# %% [markdown]
-# # STATIONS
-
-# %%
-# Connexion au bucket S3 
+import os
+import pickle
+from typing import TYPE_CHECKING
+from s3_utils import (
+    AIRBYTE_SYNC, QUALITY_REPORT_FILE_KEY, WEATHER_DATA_FORMAT, SourceCache, check_weather_data_format, extract_station_data,
+    iter_airbyte_data, iter_airbyte_parts, list_airbyte_parts, map_in_threads, prefetch_sources, records_to_dataframe,
+    save_weather_data
+)
+from instrumentation import PipelineProfile
+
+# pandas, boto3 et transform_utils (pandas, numpy, pymongo) ne sont importés que par les fonctions
+# qui les utilisent : importer ce module (benchmark, ligne de commande) ne les charge pas
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Bucket S3 des données Airbyte et des données transformées
 bucket_name = "p8-airbyte-greenandcoop"
-s3_client = boto3.client("s3")
 
-# Chargement des données
-response = s3_client.get_object(Bucket=bucket_name, Key="GreenAndCoop InfoClimat/infoclimat/2025_02_13_1739448920127_0.jsonl")
-json_content = response["Body"].read().decode("utf-8")
-data = [json.loads(line) for line in json_content.splitlines()]
+# Flux Airbyte : préfixe S3 et synchronisation lue par défaut (AIRBYTE_SYNC=latest pour lire la plus récente)
+airbyte_streams = {
+    "infoclimat": {
+        "prefix": "GreenAndCoop InfoClimat/infoclimat/",
+        "sync_id": "2025_02_13_1739448920127",
+    },
+    "weather_underground_be": {
+        "prefix": "GreenAndCoop Weather Underground/weather_underground_be/",
+        "sync_id": "2025_02_25_1740480795604",
+    },
+    "weather_underground_fr": {
+        "prefix": "GreenAndCoop Weather Underground/weather_underground_fr/",
+        "sync_id": "2025_02_25_1740480767021",
+    },
+}
 
-# Extraire les données imbriquées sous "_airbyte_data" et "stations"
-stations = [station for entry in data for station in entry["_airbyte_data"]["stations"]]
+# Liste des ID des stations InfoClimat
+station_ids = ["07015", "00052", "000R5", "STATIC0010"]
 
+# Répertoire local des étapes intermédiaires, pour reprendre la transformation sans relire S3
+PIPELINE_CACHE_DIR = os.getenv("PIPELINE_CACHE_DIR", ".pipeline_cache")
+EXTRACT_CACHE_FILE = "extract.pkl"
 
-# %%
-# Transformation des données stations
-for doc in stations:
-    doc["id_station"] = doc.pop("id")  # Renommer "id" en "id_station"
-    doc["city"] = doc["name"]  # Ajouter un champ "city"
-    doc["state"] = "France"  # Ajouter un champ "state"
-    doc["station_info"] = {
-        "name": doc.pop("name"),
-        "latitude": doc.pop("latitude"),
-        "longitude": doc.pop("longitude"),
-        "elevation": doc.pop("elevation"),
-        "city": doc.pop("city"),
-        "state": doc.pop("state"),
-        "type": doc.pop("type"),
-        "hardware": doc.get("hardware", None),
-        "software": doc.get("software", None),
-        "license": {
-            "license": doc.get("license", {}).pop("license", None),
-            "url": doc.get("license", {}).pop("url", None),
-            "source": doc.get("license", {}).pop("source", None),
-            "metadonnees": doc.pop("license", {}).pop("metadonnees", None)
-        }
-    }
+
+# %% [markdown]
+# # STATIONS
 
 # %%
 # Ajout des stations Weather Underground
@@ -93,469 +92,268 @@ weather_stations = [
     }
 ]
 
-stations.extend(weather_stations)
 
 # %% [markdown]
-# # HOURLY DATA
+# # EXTRACTION
 
-# %% [markdown]
-# ## Weather Underground
+# %%
+# Lister toutes les parties (_0.jsonl, _1.jsonl...) d'un flux
+def list_stream_parts(s3_client, stream, bucket_name: str = bucket_name, etags: dict | None = None):
+    sync_id = stream["sync_id"] if AIRBYTE_SYNC == "pinned" else None
+    return list_airbyte_parts(s3_client, bucket_name, stream["prefix"], sync_id, etags)
 
 
-# %%
 # Conversion json - df
-def load_airbyte_data_from_s3(bucket_name: str, file_key: str) -> pd.DataFrame:
+def load_airbyte_data_from_s3(bucket_name: str, file_key: str, source_cache: SourceCache) -> "pd.DataFrame":
     """
-    Télécharge un fichier JSON depuis S3 et extrait les données imbriquées sous "_airbyte_data"
-    pour les charger dans un DataFrame.
+    Lit un fichier JSON depuis S3 en streaming et extrait les données imbriquées sous "_airbyte_data"
+    pour les charger dans un DataFrame, construit par blocs de taille bornée.
 
     Parameters:
     - bucket_name (str): Le nom du bucket S3.
     - file_key (str): La clé du fichier dans le bucket S3.
+    - source_cache (SourceCache): Le cache des fichiers sources S3.
 
     Returns:
     - pd.DataFrame: Le DataFrame contenant les données extraites sous "_airbyte_data".
     """
-    s3_client = boto3.client("s3")
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-    json_content = response["Body"].read().decode("utf-8")
-    data = [json.loads(line) for line in json_content.splitlines()]
-    return pd.DataFrame([entry["_airbyte_data"] for entry in data])
-
-
-# %%
-weather_be_file_key = "GreenAndCoop Weather Underground/weather_underground_be/2025_02_25_1740480795604_0.jsonl"
-weather_fr_file_key = "GreenAndCoop Weather Underground/weather_underground_fr/2025_02_25_1740480767021_0.jsonl"
+    return records_to_dataframe(iter_airbyte_data(source_cache, bucket_name, file_key))
 
-weather_be = load_airbyte_data_from_s3(bucket_name, weather_be_file_key)
-weather_fr = load_airbyte_data_from_s3(bucket_name, weather_fr_file_key)
 
-
-# %%
-# Ajout date fichiers weather
-def add_dates_df(df, start_date_str="2024-10-01"):
+def load_stream_dataframe(source_cache: SourceCache, file_keys, bucket_name: str = bucket_name) -> "pd.DataFrame":
     """
-    Ajoute une colonne 'datetime' en combinant les colonnes 'date' et 'Time', 
-    tout en supprimant les lignes vides. La date s'incrémente à chaque ligne vide 
-    et la colonne 'Time' est convertie en timedelta. La colonne 'datetime' 
-    contient la date et l'heure sous forme de timestamp.
-
-    Paramètres :
-    - df (DataFrame) : DataFrame à traiter.
-    - start_date_str (str) : Date de départ sous forme de chaîne de caractères (format 'YYYY-MM-DD').
-
-    Retourne :
-    - df_dated (DataFrame) : DataFrame avec la colonne 'datetime' et sans les lignes vides.
+    Charge toutes les parties d'un flux Airbyte, analysées en parallèle, dans un seul
+    DataFrame (dans l'ordre des parties).
     """
-    # Supprimer la première ligne du DataFrame
-    df = df.drop(index=0).reset_index(drop=True)
-    
-    # Convertir la chaîne de caractères en un objet datetime
-    start_date = pd.to_datetime(start_date_str)
-    current_date = start_date
-    date_column = []
-
-    # Identifier les lignes complètement vides
-    empty_rows = df.isnull().all(axis=1)
-
-    # Parcourir chaque ligne pour attribuer la date
-    for is_empty in empty_rows:
-        if is_empty:
-            current_date += pd.Timedelta(days=1)  # Changer de date après chaque ligne vide
-        date_column.append(current_date.strftime("%Y-%m-%d"))
-
-    # Ajouter la colonne 'date' au DataFrame
-    df["date"] = date_column
-
-    # Convertir la colonne 'date' en type datetime
-    df["date"] = pd.to_datetime(df["date"])
-
-    # Convertir 'Time' en timedelta
-    df['Time'] = pd.to_timedelta(df['Time'])
-
-    # Combiner 'date' et 'time' en une seule colonne 'datetime'
-    df['datetime'] = df['date'] + df['Time']
-
-    # Convertir datetime en str
-    df['datetime'] = df['datetime'].astype(str)
-
-    # Supprimer les colonnes 'Time' et 'date'
-    df = df.drop(columns=['Time', 'date'])
-
-    # Supprimer les lignes vides et réindexer
-    df_dated = df[~empty_rows].reset_index(drop=True)
-
-    return df_dated
-
-# %%
-weather_be = add_dates_df(weather_be, start_date_str="2024-10-01")
-weather_fr = add_dates_df(weather_fr, start_date_str="2024-10-01")
-
-# %%
-# Ajout id station
-weather_be["id_station"] = "IICHTE19"
-weather_fr["id_station"] = "ILAMAD25"
-
-# %%
-# Conversion °F en °C
-def convert_fahrenheit_to_celsius(df, columns):
-    for col in columns:
-        # Vérifier que la colonne contient des chaînes de caractères
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("\xa0", "", regex=False) 
-            df[col] = df[col].str.replace("°F", "", regex=False)
-        
-        # Convertir en float et appliquer la conversion
-        df[col] = df[col].astype(float)     
-        df[col] = ((df[col] - 32) * 5/9).round(2)  # Conversion °F en °C
-
-    return df
-
-dfs = [weather_fr, weather_be]
-columns_to_convert = ["Temperature", "Dew Point"]
-
-for df in dfs:
-    df = convert_fahrenheit_to_celsius(df, columns_to_convert)
-
-# %%
-# Conversion inHg en hPa
-def convert_inHg_to_hPa(df, columns):
-    for col in columns:
-        # Vérifier que la colonne contient des chaînes de caractères
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("\xa0", "", regex=False)
-            df[col] = df[col].str.replace("in", "", regex=False)
-        
-        # Convertir en float et appliquer la conversion
-        df[col] = df[col].astype(float)
-        df[col] = (df[col]* 33.8639).round(2)  # Conversion inHg en hPa
-
-    return df
-
-columns_to_convert = ["Pressure"]
-
-for df in dfs:
-    df = convert_inHg_to_hPa(df, columns_to_convert)
-
-# %%
-# Conversion mp/h en km/h
-def convert_mph_to_kmh(df, columns):
-    for col in columns:
-        # Vérifier que la colonne contient des chaînes de caractères
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("\xa0", "", regex=False)
-            df[col] = df[col].str.replace("mph", "", regex=False)
-        
-        # Convertir en float et appliquer la conversion
-        df[col] = df[col].astype(float)
-        df[col] = (df[col]* 1.60934).round(2)  # Conversion mph en kmh
-
-    return df
-
-columns_to_convert = ["Gust", "Speed"]
-
-for df in dfs:
-    df = convert_mph_to_kmh(df, columns_to_convert)
-
-# %%
-# Conversion in en mm
-def convert_in_to_mm(df, columns):
-    for col in columns:
-        # Vérifier que la colonne contient des chaînes de caractères
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("\xa0", "", regex=False)
-            df[col] = df[col].str.replace("in", "", regex=False)
-        
-        # Convertir en float et appliquer la conversion
-        df[col] = df[col].astype(float)
-        df[col] = (df[col]* 25.4).round(2)  # Conversion in en mm
-
-    return df
-
-columns_to_convert = ["Precip. Rate.", "Precip. Accum."]
-
-for df in dfs:
-    df = convert_in_to_mm(df, columns_to_convert)
-
-# %%
-# Conversion Wind direction
-def convert_wind_direction_to_degrees(df, column_name):
-    # Dictionnaire de correspondance
-    direction_dict = {
-        "North": 0,
-        "NNE": 22.5,
-        "NE": 45,
-        "ENE": 67.5,
-        "East": 90,
-        "ESE": 112.5,
-        "SE": 135,
-        "SSE": 157.5,
-        "South": 180,
-        "SSW": 202.5,
-        "SW": 225,
-        "WSW": 247.5,
-        "West": 270,
-        "WNW": 292.5,
-        "NW": 315,
-        "NNW": 337.5
-    }
-    
-    # Appliquer la conversion
-    df[column_name] = df[column_name].map(direction_dict)
-
-    # Convertir la colonne en float
-    df[column_name] = df[column_name].astype(float)
-    
-    return df
-
-for df in dfs:
-    df = convert_wind_direction_to_degrees(df, "Wind")
-
-
-# %%
-# Suppression des caractères
-def delete_unities(df, columns):
-    for col in columns:
-        # Vérifier que la colonne contient des chaînes de caractères
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("\xa0", "", regex=False)  # Supprime les espaces
-            df[col] = df[col].str.replace("w/m²", "", regex=False)  # Supprime "w/m²"
-            df[col] = df[col].str.replace("%", "", regex=False)  # Supprime "%"
-    
-    return df
-
-columns_to_convert = ["Solar", "Humidity"]
-
-for df in dfs:
-    df = delete_unities(df, columns_to_convert)
-
-# %%
-# Conversion des types
-for df in dfs:
-    df["Humidity"] = df["Humidity"].astype(int)
-    df["UV"] = df["UV"].astype(int)
-    df["Solar"] = df["Solar"].astype(float)
+    import pandas as pd
 
-# %%
-# Nommage des colonnes et tri
-rename_dict = {
-    "Temperature": "temperature",
-    "Pressure": "pressure",
-    "Gust": "wind_gust",
-    "Dew Point": "dew_point",
-    "Precip. Rate.": "precip_rate",
-    "Solar": "solar",
-    "Precip. Accum.": "precip_accum",
-    "Humidity": "humidity",
-    "UV": "uv",
-    "Speed": "wind_speed",
-    "Wind": "wind_direction"
-}
-
-# Ordre des colonnes souhaité
-desired_column_order = [
-    "id_station", "datetime","temperature","pressure","humidity","dew_point","wind_speed","wind_gust","wind_direction","precip_accum","precip_rate","solar",
-    "uv"
-]
+    parts = map_in_threads(lambda file_key: load_airbyte_data_from_s3(bucket_name, file_key, source_cache), file_keys)
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
 
-weather_fr = weather_fr.rename(columns=rename_dict)
-weather_fr = weather_fr[desired_column_order]
 
-weather_be = weather_be.rename(columns=rename_dict)
-weather_be = weather_be[desired_column_order]  
-
-# %% [markdown]
-# ## InfoClimat
-
-# %%
+def list_sources(s3_client, bucket_name: str = bucket_name, streams: dict = airbyte_streams, etags: dict | None = None) -> dict:
+    """
+    Liste les parties Airbyte de chaque flux (selon AIRBYTE_SYNC) : identifie les données sources
+    d'une extraction, pour ne reprendre qu'une extraction enregistrée à partir des mêmes parties.
+    Si etags est fourni, il reçoit l'ETag listé de chaque partie (voir list_airbyte_parts).
+    """
+    return dict(zip(streams, map_in_threads(lambda stream: list_stream_parts(s3_client, stream, bucket_name, etags), streams.values())))
 
-# Télécharger le fichier depuis S3
-response = s3_client.get_object(Bucket="p8-airbyte-greenandcoop", Key="GreenAndCoop InfoClimat/infoclimat/2025_02_13_1739448920127_0.jsonl")
-json_content = response["Body"].read().decode("utf-8")
 
+def extract(s3_client, profile: PipelineProfile, stream_file_keys: dict | None = None, bucket_name: str = bucket_name,
+            infoclimat_station_ids: list = station_ids, etags: dict | None = None) -> dict:
+    """
+    Télécharge les parties Airbyte de chaque flux (en parallèle, une seule fois grâce au cache
+    des fichiers sources) et les analyse en DataFrames.
 
-data = [json.loads(line) for line in json_content.splitlines()]
+    Parameters:
+    - s3_client: Le client boto3 S3.
+    - profile (PipelineProfile): Le profil de performance de l'exécution.
+    - stream_file_keys (dict): Les parties de chaque flux, déjà listées (voir list_sources).
+    - bucket_name (str): Le bucket des données Airbyte (celui du benchmark, par exemple).
+    - infoclimat_station_ids (list): Les stations InfoClimat à extraire.
+    - etags (dict): Les ETag des parties déjà listées, pour ne pas les redemander à S3.
 
-# Extraire les données imbriquées sous "_airbyte_data" pour chaque station
-def extract_station_data(station_id, data):
+    Returns:
+    - dict: Les stations InfoClimat brutes, les DataFrames Weather Underground et un DataFrame par station InfoClimat.
     """
-    Extrait les données horaires pour une station donnée.
-    Si les données n'existent pas pour cette station, renvoie une liste vide.
+    # Cache partagé des fichiers sources : chaque fichier Airbyte n'est téléchargé qu'une fois, sur disque
+    # (répertoire temporaire supprimé à la fin de l'extraction, sauf SOURCE_CACHE_DIR)
+    with SourceCache(s3_client) as source_cache:
+        with profile.stage("download") as metrics:
+            etags = {} if etags is None else etags
+            stream_file_keys = stream_file_keys or list_sources(s3_client, bucket_name, etags=etags)
+            source_files = [file_key for file_keys in stream_file_keys.values() for file_key in file_keys]
+            prefetch_sources(source_cache, bucket_name, source_files, etags)
+            metrics.rows_out = len(source_files)
+
+        # Chargement des données et extraction des stations imbriquées sous "_airbyte_data" et "stations"
+        with profile.stage("parse_stations") as metrics:
+            stations = [
+                station
+                for airbyte_data in iter_airbyte_parts(source_cache, bucket_name, stream_file_keys["infoclimat"])
+                for station in airbyte_data["stations"]
+            ]
+            metrics.rows_out = len(stations)
+
+        with profile.stage("parse_weather_underground") as metrics:
+            weather_be, weather_fr = map_in_threads(
+                lambda file_keys: load_stream_dataframe(source_cache, file_keys, bucket_name),
+                [stream_file_keys["weather_underground_be"], stream_file_keys["weather_underground_fr"]]
+            )
+            metrics.rows_out = len(weather_be) + len(weather_fr)
+
+        # Relire les fichiers depuis le cache (déjà téléchargés pour les stations) et extraire les données de chaque station
+        with profile.stage("parse_infoclimat") as metrics:
+            infoclimat_stations = extract_station_data(infoclimat_station_ids, iter_airbyte_parts(source_cache, bucket_name, stream_file_keys["infoclimat"]))
+            metrics.rows_out = sum(len(df) for df in infoclimat_stations)
+
+    return {"stations": stations, "weather_be": weather_be, "weather_fr": weather_fr, "infoclimat_stations": infoclimat_stations}
+
+
+def extract_cache_key(stream_file_keys: dict) -> dict:
+    """Identifie une extraction : synchronisation Airbyte lue, parties de chaque flux et stations InfoClimat."""
+    return {"airbyte_sync": AIRBYTE_SYNC, "stream_file_keys": stream_file_keys, "station_ids": list(station_ids)}
+
+
+def save_extract_cache(extracted: dict, stream_file_keys: dict, cache_dir: str = PIPELINE_CACHE_DIR) -> str:
+    """Enregistre localement le résultat de l'extraction, avec ses données sources, pour reprendre à l'étape de transformation."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, EXTRACT_CACHE_FILE)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({"key": extract_cache_key(stream_file_keys), "extracted": extracted}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_extract_cache(stream_file_keys: dict, cache_dir: str = PIPELINE_CACHE_DIR) -> dict | None:
     """
-    return [
-        entry["_airbyte_data"]["hourly"].get(station_id, [])
-        for entry in data
-    ]
-
-# Liste des ID des stations
-station_ids = ["07015", "00052", "000R5", "STATIC0010"]
-
-# Extraire les données pour chaque station et les convertir en df
-dfs = []
-for station_id in station_ids:
-    data_station = extract_station_data(station_id, data)
-    station_df = pd.DataFrame([item for sublist in data_station for item in sublist])
-    dfs.append(station_df)
+    Relit le résultat de l'extraction enregistré localement, ou None s'il n'existe pas
+    ou s'il a été extrait d'autres données sources (autre synchronisation, parties ou stations).
+    """
+    path = os.path.join(cache_dir, EXTRACT_CACHE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        cached = pickle.load(f)
+    if not isinstance(cached, dict) or cached.get("key") != extract_cache_key(stream_file_keys):
+        print(f"Extraction enregistrée dans {cache_dir} ignorée : données sources différentes")
+        return None
+    return cached["extracted"]
 
-# Concaténer les DataFrames
-infoclimat = pd.concat(dfs, ignore_index=True, join='outer')
 
+# %% [markdown]
+# # TRANSFORMATION
 
 # %%
-# Nommage et tri des colonnes
-rename_dict = {
-    "dh_utc": "datetime",
-    "pression": "pressure",
-    "vent_rafales": "wind_gust",
-    "point_de_rosee": "dew_point",
-    "humidite": "humidity",
-    "vent_moyen": "wind_speed",
-    "vent_direction": "wind_direction",
-    "visibilite": "visibility",
-    "pluie_3h": "precip_3h",
-    "pluie_1h": "precip_1h",
-    "neige_au_sol": "snow_depth",
-    "nebulosite": "nebulosity",
-    "temps_omm": "weather_wmo"
-}
-
-# Ordre des colonnes souhaité
-desired_column_order = [
-    "id_station", "datetime","temperature","pressure","humidity","dew_point","visibility","wind_speed","wind_gust","wind_direction","precip_1h","precip_3h",
-    "snow_depth","nebulosity","weather_wmo"
-]
-
-infoclimat = infoclimat.rename(columns=rename_dict)
-infoclimat = infoclimat[desired_column_order]
+def transform(extracted: dict, profile: PipelineProfile) -> tuple:
+    """
+    Transforme les stations et les relevés extraits, établit le rapport qualité puis
+    construit les documents MongoDB (station_info et weather_data).
 
-# %%
-# Typage des champs
-float_columns=["temperature","pressure","dew_point","wind_speed","wind_gust","wind_direction","visibility","precip_1h","precip_3h","snow_depth","nebulosity","weather_wmo"]
+    Parameters:
+    - extracted (dict): Le résultat de extract().
+    - profile (PipelineProfile): Le profil de performance de l'exécution.
 
-for col in float_columns:
-    infoclimat[col] = pd.to_numeric(infoclimat[col], downcast="float")
+    Returns:
+    - tuple: Les documents prêts à être sauvegardés et le rapport qualité.
+    """
+    import pandas as pd
+    from transform_utils import (
+        build_documents, build_quality_report, map_in_processes, quality_summary, transform_infoclimat, transform_station,
+        transform_weather_underground
+    )
+
+    # Transformation des données stations, puis ajout des stations Weather Underground
+    stations = [transform_station(copy.deepcopy(doc)) for doc in extracted["stations"]]
+    stations.extend(weather_stations)
+
+    # Weather Underground : transformation par station (dates, id station, unités, colonnes), une station par processus
+    weather_be, weather_fr = extracted["weather_be"], extracted["weather_fr"]
+    with profile.stage("transform_weather_underground", rows_in=len(weather_be) + len(weather_fr)) as metrics:
+        weather_be, weather_fr = map_in_processes(
+            transform_weather_underground, [weather_be, weather_fr], ["IICHTE19", "ILAMAD25"]
+        )
+        metrics.rows_out = len(weather_be) + len(weather_fr)
+
+    # InfoClimat : nommage, tri et typage des colonnes, une station par processus, puis regroupement dans l'ordre des stations
+    infoclimat_stations = extracted["infoclimat_stations"]
+    with profile.stage("transform_infoclimat", rows_in=sum(len(df) for df in infoclimat_stations)) as metrics:
+        infoclimat_stations = map_in_processes(transform_infoclimat, infoclimat_stations)
+        infoclimat = pd.concat(infoclimat_stations, ignore_index=True) if infoclimat_stations else pd.DataFrame()
+        metrics.rows_out = len(infoclimat)
+
+    # Contrôle qualité par source, station et colonne (bornes du schéma MongoDB), sans concaténer les sources
+    frames = [("weather_underground", "IICHTE19", weather_be), ("weather_underground", "ILAMAD25", weather_fr)]
+    frames += [("infoclimat", df["id_station"].iloc[0], df) for df in infoclimat_stations if not df.empty]
+    with profile.stage("quality", rows_in=sum(len(df) for _, _, df in frames)) as metrics:
+        quality_report = build_quality_report(frames)
+        metrics.rows_out = quality_report["rows"]
+
+    print("\nQualité des données (valeurs nulles, vides et hors bornes) :")
+    print(quality_summary(quality_report))
+
+    # Transformer stations en un dictionnaire {id_station: station}
+    stations_dict = {station["id_station"]: station for station in stations}
+
+    # Construire les documents (station_info et weather_data) directement depuis les colonnes
+    with profile.stage("build_documents", rows_in=len(weather_fr) + len(weather_be) + len(infoclimat)) as metrics:
+        final_weather_data = (
+            build_documents(weather_fr, stations_dict)
+            + build_documents(weather_be, stations_dict)
+            + build_documents(infoclimat, stations_dict)
+        )
+        metrics.rows_out = len(final_weather_data)
+
+    return final_weather_data, quality_report
 
-infoclimat["humidity"] = infoclimat["humidity"].astype(int)
 
-infoclimat["pressure"] = infoclimat["pressure"].apply(lambda x: round(x, 2))
+# %% [markdown]
+# # SAUVEGARDE
 
 # %%
-# Qualité des données : taux de NaN dans les documents
-
-# Concaténer les DataFrames
-dfs = [weather_fr, weather_be, infoclimat]
-df_hourly_data = pd.concat(dfs, ignore_index=True, join='outer')
-
-def calculate_nan(df):
-    '''
-    Calcule le nombre et % de NaN dans un df par colonne
-    '''
-    # Compte les valeurs None
-    nan_counts = df.isnull().sum()
-
-    # Compte les valeurs string "NaN", "nan", "none"
-    str_nan_counts = df.isin(["NaN", "nan", "none"]).sum()
-
-    # Compte les valeurs vides
-    empty_counts = (df == "").sum()
-
-    # Compte les valeurs contenant uniquement des espaces
-    space_counts = {}
-    for col in (df.select_dtypes(include='object')).columns : 
-        space_counts[col] = df[col].str.isspace().sum()
-    space_counts = pd.Series(space_counts)
-
-    # Création du DataFrame de toutes les données NaN
-    merged_nan_counts = pd.DataFrame({
-        'NaN counts': nan_counts.reindex(df.columns, fill_value=0),
-        'Str nan counts': str_nan_counts.reindex(df.columns, fill_value=0),
-        'Empty counts': empty_counts.reindex(df.columns, fill_value=0),
-        'Space counts': space_counts.reindex(df.columns, fill_value=0),
-    })
-
-
-
-    # Ajout d'une colonne total de NaN
-    merged_nan_counts['Total NaN'] = merged_nan_counts.sum(axis=1)
-
-    # Ajout % de NaN
-    merged_nan_counts['% NaN'] = round(merged_nan_counts['Total NaN'] / len(df) * 100, 2)
+def save(s3_client, final_weather_data: list, profile: PipelineProfile, data_format: str = WEATHER_DATA_FORMAT,
+         bucket_name: str = bucket_name) -> str:
+    """Télécharge les documents sur S3 dans le format intermédiaire choisi (WEATHER_DATA_FORMAT)."""
+    with profile.stage("save", rows_in=len(final_weather_data)) as metrics:
+        s3_file_key = save_weather_data(s3_client, bucket_name, final_weather_data, data_format)
+        metrics.rows_out = len(final_weather_data)
 
-    #Suppression détails NaN counts
-    merged_nan_counts = merged_nan_counts.drop(columns=['NaN counts','Str nan counts', 'Empty counts', 'Space counts'])
+    print(f"\nLe fichier weather_data ({data_format}) a été téléchargé sur le bucket S3 : {bucket_name}/{s3_file_key}")
+    print(f"Il contient: {len(final_weather_data)} documents")
+    return s3_file_key
 
-    # Retourner le DataFrame
-    return merged_nan_counts
 
-df_hourly_data_nan = calculate_nan(df_hourly_data)
+def save_quality_report(s3_client, quality_report: dict) -> str:
+    """Télécharge le rapport qualité (JSON compact) sur S3, à côté des données transformées."""
+    body = json.dumps(quality_report, separators=(",", ":"), ensure_ascii=False)
+    s3_client.put_object(Body=body.encode("utf-8"), Bucket=bucket_name, Key=QUALITY_REPORT_FILE_KEY)
 
-print("\nNombre de NaN :")
-print(df_hourly_data_nan)
+    print(f"Le rapport qualité a été téléchargé sur le bucket S3 : {bucket_name}/{QUALITY_REPORT_FILE_KEY}")
+    return QUALITY_REPORT_FILE_KEY
 
-# %% [markdown]
-# ## Extraction json
-
-# %%
-weather_fr_data = weather_fr.to_dict(orient='records')
-weather_be_data = weather_be.to_dict(orient='records')
-infoclimat_data = infoclimat.to_dict(orient='records')
-
-hourly_data =  weather_fr_data + weather_be_data + infoclimat_data
 
 # %%
-# Structurer les données sous "weather_data"
-for doc in hourly_data:
-    doc["weather_data"] = {
-        "temperature": round(doc.pop("temperature", None),2),
-        "pressure": doc.pop("pressure", None),
-        "humidity": doc.pop("humidity", None),
-        "dew_point": round(doc.pop("dew_point", None),2),
-        "visibility": doc.pop("visibility", None),
-        "wind_speed": round(doc.pop("wind_speed", None),2),
-        "wind_gust": doc.pop("wind_gust", None),
-        "wind_direction": doc.pop("wind_direction", None),
-        "precip_1h": doc.pop("precip_1h", None),
-        "precip_3h": doc.pop("precip_3h", None),
-        "precip_accum": doc.pop("precip_accum", None),
-        "precip_rate": doc.pop("precip_rate", None),
-        "solar": doc.pop("solar", None),
-        "uv": doc.pop("uv", None),
-        "snow_depth": doc.pop("snow_depth", None),
-        "nebulosity": doc.pop("nebulosity", None),
-        "weather_wmo": doc.pop("weather_wmo", None)
-    }
-
-# %%
-# Transformer stations en un dictionnaire {id_station: station_info}
-stations_dict = {station["id_station"]: station for station in stations}
-
-# Fusionner les données des stations avec les relevés horaires
-final_weather_data = []
-for record in hourly_data:
-    station_info = stations_dict.get(record["id_station"], {}).get("station_info", {})
-
-    final_weather_record = {
-        "id_station": record["id_station"],
-        "station_info": station_info,
-        "datetime": record["datetime"],
-        "weather_data": record["weather_data"]
-    }
-    final_weather_data.append(final_weather_record)
-
-# %%
-# Remplacer les NaN par None dans weather_data
-for record in final_weather_data:
-    for key, value in record["weather_data"].items():
-        if isinstance(value, float) and np.isnan(value):  # Vérifier si c'est NaN
-            record["weather_data"][key] = None  # Remplacer par None
+def main(resume: bool = False, extract_only: bool = False):
+    """
+    Exécute l'extraction puis la transformation et la sauvegarde sur S3.
 
-# %%
-weather_data_json = json.dumps(final_weather_data, indent=4)
+    Parameters:
+    - resume (bool): Reprendre à la transformation à partir de l'extraction enregistrée localement,
+      si elle provient des mêmes données sources.
+    - extract_only (bool): S'arrêter après l'extraction (enregistrée localement).
 
-s3_file_key = "data_transformed/weather_data.json"
+    L'extraction n'est enregistrée localement qu'avec extract_only ou resume : une exécution
+    complète ne laisse pas de copie des données sources sur le disque.
+    """
+    # Format du fichier intermédiaire vérifié avant l'extraction (pyarrow installé pour "parquet")
+    if not extract_only:
+        check_weather_data_format(WEATHER_DATA_FORMAT)
 
-# Télécharger le fichier sur S3
-s3_client.put_object(Body=weather_data_json, Bucket=bucket_name, Key=s3_file_key)
+    import boto3
 
-print(f"\nLe fichier weather_data JSON a été téléchargé sur le bucket S3 : {bucket_name}/{s3_file_key}")
-print(f"Il contient: {len(final_weather_data)} documents")
\ No newline at end of file
+    s3_client = boto3.client("s3")
+    profile = PipelineProfile("transform_data")
+
+    use_cache = resume or extract_only
+    etags = {}
+    stream_file_keys = list_sources(s3_client, etags=etags) if use_cache else None
+    extracted = load_extract_cache(stream_file_keys) if resume else None
+    if extracted is None:
+        extracted = extract(s3_client, profile, stream_file_keys, etags=etags)
+        if use_cache:
+            save_extract_cache(extracted, stream_file_keys)
+    else:
+        print(f"Reprise à partir de l'extraction enregistrée dans {PIPELINE_CACHE_DIR}")
+
+    if not extract_only:
+        final_weather_data, quality_report = transform(extracted, profile)
+        save(s3_client, final_weather_data, profile)
+        save_quality_report(s3_client, quality_report)
+
+    # Profil de performance de l'exécution (résumé JSON, et profil / fichier Prometheus si configurés)
+    profile.write()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+# %%
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from mongo_utils import weather_data_schema
+
+
+# Nombre de processus pour la transformation par station (1 = exécution en série)
+TRANSFORM_MAX_WORKERS = int(os.getenv("TRANSFORM_MAX_WORKERS", "1"))
+
+
+# %%
+# Ajout date fichiers weather
+def add_dates_df(df, start_date_str="2024-10-01"):
+    """
+    Ajoute une colonne 'datetime' en combinant la date du jour et la colonne 'Time', 
+    tout en supprimant les lignes vides. La date s'incrémente à chaque ligne vide : 
+    le décalage en jours est la somme cumulée des lignes vides, calculée en une seule 
+    opération vectorisée. La colonne 'datetime' contient la date et l'heure sous forme 
+    de chaîne 'YYYY-MM-DD HH:MM:SS'.
+
+    Paramètres :
+    - df (DataFrame) : DataFrame à traiter.
+    - start_date_str (str) : Date de départ sous forme de chaîne de caractères (format 'YYYY-MM-DD').
+
+    Retourne :
+    - df_dated (DataFrame) : DataFrame avec la colonne 'datetime' et sans les lignes vides.
+    """
+    # Supprimer la première ligne du DataFrame
+    df = df.drop(index=0).reset_index(drop=True)
+
+    # Identifier les lignes complètement vides
+    empty_rows = df.isnull().all(axis=1)
+
+    # Nombre de jours écoulés depuis la date de départ pour chaque ligne
+    day_offsets = pd.to_timedelta(empty_rows.cumsum(), unit="D")
+    start_date = pd.to_datetime(start_date_str).normalize()
+
+    # Combiner la date du jour et 'Time' en une seule colonne 'datetime' (str)
+    df["datetime"] = (start_date + day_offsets + pd.to_timedelta(df["Time"])).astype(str)
+
+    # Supprimer la colonne 'Time'
+    df = df.drop(columns=["Time"])
+
+    # Supprimer les lignes vides et réindexer
+    df_dated = df[~empty_rows].reset_index(drop=True)
+
+    return df_dated
+
+
+# %%
+# Transformation des données stations InfoClimat
+def transform_station(doc):
+    """
+    Transforme une station InfoClimat brute (modifiée en place) : "id" devient "id_station"
+    et les informations de la station sont regroupées sous "station_info".
+
+    Paramètres :
+    - doc (dict) : Station telle que fournie sous "stations" par InfoClimat.
+
+    Retourne :
+    - doc (dict) : La station transformée.
+    """
+    doc["id_station"] = doc.pop("id")  # Renommer "id" en "id_station"
+    doc["city"] = doc["name"]  # Ajouter un champ "city"
+    doc["state"] = "France"  # Ajouter un champ "state"
+    doc["station_info"] = {
+        "name": doc.pop("name"),
+        "latitude": doc.pop("latitude"),
+        "longitude": doc.pop("longitude"),
+        "elevation": doc.pop("elevation"),
+        "city": doc.pop("city"),
+        "state": doc.pop("state"),
+        "type": doc.pop("type"),
+        "hardware": doc.get("hardware", None),
+        "software": doc.get("software", None),
+        "license": {
+            "license": doc.get("license", {}).pop("license", None),
+            "url": doc.get("license", {}).pop("url", None),
+            "source": doc.get("license", {}).pop("source", None),
+            "metadonnees": doc.pop("license", {}).pop("metadonnees", None)
+        }
+    }
+    return doc
+
+
+# %%
+# Correspondance des directions du vent en degrés
+WIND_DIRECTION_DEGREES = {
+    "North": 0,
+    "NNE": 22.5,
+    "NE": 45,
+    "ENE": 67.5,
+    "East": 90,
+    "ESE": 112.5,
+    "SE": 135,
+    "SSE": 157.5,
+    "South": 180,
+    "SSW": 202.5,
+    "SW": 225,
+    "WSW": 247.5,
+    "West": 270,
+    "WNW": 292.5,
+    "NW": 315,
+    "NNW": 337.5
+}
+
+# Spécification des conversions Weather Underground, une entrée par colonne :
+# - unit : unité accolée à la valeur dans la source
+# - offset, scale, divisor : conversion linéaire (valeur + offset) * scale / divisor, dans cet ordre
+#   (celui des conversions d'origine, pour obtenir les mêmes flottants au bit près)
+# - decimals : arrondi après conversion (None pour ne pas arrondir)
+# - dtype : type final de la colonne
+# - mapping : correspondance texte -> valeur (remplace l'analyse numérique)
+WEATHER_UNDERGROUND_CONVERSIONS = {
+    "Temperature": {"unit": "°F", "offset": -32, "scale": 5, "divisor": 9, "decimals": 2},  # °F -> °C
+    "Dew Point": {"unit": "°F", "offset": -32, "scale": 5, "divisor": 9, "decimals": 2},  # °F -> °C
+    "Pressure": {"unit": "in", "scale": 33.8639, "decimals": 2},  # inHg -> hPa
+    "Gust": {"unit": "mph", "scale": 1.60934, "decimals": 2},  # mph -> km/h
+    "Speed": {"unit": "mph", "scale": 1.60934, "decimals": 2},  # mph -> km/h
+    "Precip. Rate.": {"unit": "in", "scale": 25.4, "decimals": 2},  # in -> mm
+    "Precip. Accum.": {"unit": "in", "scale": 25.4, "decimals": 2},  # in -> mm
+    "Wind": {"mapping": WIND_DIRECTION_DEGREES},  # direction -> degrés
+    "Solar": {"unit": "w/m²"},
+    "Humidity": {"unit": "%", "dtype": int},
+    "UV": {"dtype": int},
+}
+
+
+def parse_measure(values, unit, column):
+    """
+    Extrait la valeur numérique d'une colonne texte de la forme '<nombre> <unité>'
+    avec une seule expression régulière vectorisée.
+    Lève une ValueError si une valeur non vide ne respecte pas ce format.
+    """
+    pattern = rf"^\s*([-+]?\d*\.?\d+)\s*{re.escape(unit)}\s*$"
+    numbers = values.str.extract(pattern, expand=False)
+
+    invalid = numbers.isna() & values.notna()
+    if invalid.any():
+        raise ValueError(f"Valeur inattendue dans la colonne '{column}' : {values[invalid].iloc[0]!r}")
+
+    return numbers.astype(float)
+
+
+def convert_units(df, conversions=WEATHER_UNDERGROUND_CONVERSIONS):
+    """
+    Convertit les colonnes d'un DataFrame selon une spécification déclarative : chaque colonne
+    est analysée une seule fois puis convertie par un calcul numpy vectorisé.
+
+    Paramètres :
+    - df (DataFrame) : DataFrame à convertir (modifié en place).
+    - conversions (dict) : Spécification {colonne: {unit, offset, scale, divisor, decimals, dtype, mapping}}.
+
+    Retourne :
+    - df (DataFrame) : DataFrame avec les colonnes converties.
+    """
+    for col, spec in conversions.items():
+        values = df[col]
+
+        if "mapping" in spec:
+            values = values.map(spec["mapping"])
+        elif values.dtype == "object":
+            values = parse_measure(values, spec.get("unit", ""), col)
+
+        values = values.to_numpy(dtype=float)
+        if "offset" in spec:
+            values = values + spec["offset"]
+        if "scale" in spec:
+            values = values * spec["scale"]
+        if "divisor" in spec:
+            values = values / spec["divisor"]
+        if spec.get("decimals") is not None:
+            values = np.round(values, spec["decimals"])
+
+        df[col] = values.astype(spec.get("dtype", float))
+
+    return df
+
+
+# %%
+# Champs regroupés sous "weather_data", dans l'ordre du schéma
+WEATHER_DATA_FIELDS = [
+    "temperature", "pressure", "humidity", "dew_point", "visibility", "wind_speed", "wind_gust",
+    "wind_direction", "precip_1h", "precip_3h", "precip_accum", "precip_rate", "solar", "uv",
+    "snow_depth", "nebulosity", "weather_wmo"
+]
+
+# Champs arrondis lors de la construction des documents
+ROUNDED_FIELDS = {"temperature": 2, "dew_point": 2, "wind_speed": 2}
+
+
+def column_to_list(df, field):
+    """
+    Renvoie les valeurs d'une colonne sous forme de liste de types Python natifs,
+    arrondies si nécessaire et avec None à la place des NaN.
+    Une colonne absente du DataFrame renvoie une liste de None.
+
+    L'arrondi utilise round() de Python sur chaque valeur, comme la construction d'origine :
+    celui de pandas/numpy (multiplication puis arrondi au pair) diffère sur certaines
+    valeurs à mi-chemin (12.345 -> 12.34 au lieu de 12.35).
+    """
+    if field not in df.columns:
+        return [None] * len(df)
+
+    values = df[field]
+    if values.dtype.kind == "f":
+        values = values.astype("float64")  # float32 -> float Python, comme to_dict()
+    if values.isna().any():
+        values = values.astype(object).where(values.notna(), None)
+    values = values.tolist()
+
+    if field in ROUNDED_FIELDS:
+        decimals = ROUNDED_FIELDS[field]
+        values = [None if value is None else round(value, decimals) for value in values]
+    return values
+
+
+def build_documents(df, stations_dict):
+    """
+    Construit les documents MongoDB (id_station, station_info, datetime, weather_data)
+    directement à partir des colonnes du DataFrame, en une seule passe.
+
+    Paramètres :
+    - df (DataFrame) : Relevés horaires avec les colonnes 'id_station', 'datetime' et les champs météo.
+    - stations_dict (dict) : Stations indexées par id_station.
+
+    Retourne :
+    - list : Les documents prêts à être sérialisés.
+    """
+    id_stations = df["id_station"].tolist()
+    station_infos = {
+        id_station: stations_dict.get(id_station, {}).get("station_info", {})
+        for id_station in set(id_stations)
+    }
+    columns = [column_to_list(df, field) for field in WEATHER_DATA_FIELDS]
+
+    return [
+        {
+            "id_station": id_station,
+            "station_info": station_infos[id_station],
+            "datetime": date_time,
+            "weather_data": dict(zip(WEATHER_DATA_FIELDS, values)),
+        }
+        for id_station, date_time, *values in zip(id_stations, df["datetime"].tolist(), *columns)
+    ]
+
+
+# %%
+# Transformation par source, station par station
+WEATHER_UNDERGROUND_RENAME = {
+    "Temperature": "temperature",
+    "Pressure": "pressure",
+    "Gust": "wind_gust",
+    "Dew Point": "dew_point",
+    "Precip. Rate.": "precip_rate",
+    "Solar": "solar",
+    "Precip. Accum.": "precip_accum",
+    "Humidity": "humidity",
+    "UV": "uv",
+    "Speed": "wind_speed",
+    "Wind": "wind_direction"
+}
+
+WEATHER_UNDERGROUND_COLUMNS = [
+    "id_station", "datetime", "temperature", "pressure", "humidity", "dew_point", "wind_speed", "wind_gust",
+    "wind_direction", "precip_accum", "precip_rate", "solar", "uv"
+]
+
+INFOCLIMAT_RENAME = {
+    "dh_utc": "datetime",
+    "pression": "pressure",
+    "vent_rafales": "wind_gust",
+    "point_de_rosee": "dew_point",
+    "humidite": "humidity",
+    "vent_moyen": "wind_speed",
+    "vent_direction": "wind_direction",
+    "visibilite": "visibility",
+    "pluie_3h": "precip_3h",
+    "pluie_1h": "precip_1h",
+    "neige_au_sol": "snow_depth",
+    "nebulosite": "nebulosity",
+    "temps_omm": "weather_wmo"
+}
+
+INFOCLIMAT_COLUMNS = [
+    "id_station", "datetime", "temperature", "pressure", "humidity", "dew_point", "visibility", "wind_speed",
+    "wind_gust", "wind_direction", "precip_1h", "precip_3h", "snow_depth", "nebulosity", "weather_wmo"
+]
+
+INFOCLIMAT_FLOAT_COLUMNS = [
+    "temperature", "pressure", "dew_point", "wind_speed", "wind_gust", "wind_direction", "visibility",
+    "precip_1h", "precip_3h", "snow_depth", "nebulosity", "weather_wmo"
+]
+
+
+def transform_weather_underground(df, id_station, start_date_str="2024-10-01"):
+    """
+    Transforme les relevés bruts d'une station Weather Underground : ajout des dates,
+    de l'id station, conversion des unités puis nommage et tri des colonnes.
+
+    Paramètres :
+    - df (DataFrame) : Relevés bruts d'une station.
+    - id_station (str) : Identifiant de la station.
+    - start_date_str (str) : Date du premier jour de relevés (format 'YYYY-MM-DD').
+
+    Retourne :
+    - df (DataFrame) : Relevés transformés, dans l'ordre de WEATHER_UNDERGROUND_COLUMNS.
+    """
+    df = add_dates_df(df, start_date_str=start_date_str)
+    df["id_station"] = id_station
+    df = convert_units(df, WEATHER_UNDERGROUND_CONVERSIONS)
+    df = df.rename(columns=WEATHER_UNDERGROUND_RENAME)
+    return df[WEATHER_UNDERGROUND_COLUMNS]
+
+
+def transform_infoclimat(df):
+    """
+    Transforme les relevés bruts d'une station InfoClimat : nommage et tri des colonnes,
+    puis typage des champs. Le typage ne dépend que des valeurs de la station, ce qui
+    permet de traiter chaque station séparément.
+
+    Paramètres :
+    - df (DataFrame) : Relevés bruts d'une station.
+
+    Retourne :
+    - df (DataFrame) : Relevés transformés, dans l'ordre de INFOCLIMAT_COLUMNS.
+    """
+    df = df.rename(columns=INFOCLIMAT_RENAME)
+    df = df.reindex(columns=INFOCLIMAT_COLUMNS)
+
+    for col in INFOCLIMAT_FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], downcast="float")
+
+    df["humidity"] = df["humidity"].astype(int)
+
+    df["pressure"] = df["pressure"].apply(lambda x: round(x, 2))
+
+    return df
+
+
+def map_in_processes(function, *iterables, max_workers=TRANSFORM_MAX_WORKERS):
+    """
+    Applique une fonction aux éléments (une station par élément) dans un pool de processus
+    et renvoie les résultats dans l'ordre des éléments : la sortie est identique à
+    l'exécution en série, quel que soit le nombre de processus.
+
+    Paramètres :
+    - function (callable) : Fonction de niveau module (sérialisable par pickle).
+    - iterables : Arguments de la fonction, comme pour map().
+    - max_workers (int) : Nombre de processus (1 ou moins = exécution en série, sans pool).
+
+    Retourne :
+    - list : Les résultats, dans l'ordre des éléments.
+    """
+    args = list(zip(*iterables))
+    if max_workers <= 1 or len(args) <= 1:
+        return [function(*arg) for arg in args]
+
+    # Pas de "fork" : le processus parent a déjà des threads (mesure mémoire, pools d'extraction,
+    # boto3), qu'un fork peut laisser bloqués ; les processus de "forkserver" réimportent ce module
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(args)), mp_context=multiprocessing.get_context(start_method)
+    ) as executor:
+        return list(executor.map(function, *zip(*args)))
+
+
+# %%
+# Qualité des données : valeurs nulles, vides et hors bornes, par source, station et colonne
+BLANK_VALUES = ["", "nan", "none"]  # Chaînes considérées comme vides (après suppression des espaces, en minuscules)
+
+
+def quality_bounds(schema=weather_data_schema):
+    """
+    Renvoie, pour chaque champ de weather_data, les bornes du $jsonSchema MongoDB
+    et si la valeur nulle est acceptée : {champ: {"minimum", "maximum", "nullable"}}.
+    """
+    properties = schema["validator"]["$jsonSchema"]["properties"]["weather_data"]["properties"]
+    bounds = {}
+    for field, rule in properties.items():
+        bson_types = rule["bsonType"] if isinstance(rule["bsonType"], list) else [rule["bsonType"]]
+        bounds[field] = {
+            "minimum": rule.get("minimum"),
+            "maximum": rule.get("maximum"),
+            "nullable": "null" in bson_types,
+        }
+    return bounds
+
+
+def profile_columns(df, bounds):
+    """
+    Compte, colonne par colonne et de façon vectorisée, les valeurs nulles, vides et hors
+    des bornes du schéma d'un DataFrame. Seuls les compteurs non nuls sont conservés.
+
+    Paramètres :
+    - df (DataFrame) : Relevés d'une station.
+    - bounds (dict) : Bornes des champs (voir quality_bounds).
+
+    Retourne :
+    - dict : {colonne: {"null", "blank", "below_min", "above_max", "null_rejected"}}
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        counts = {"null": int(values.isna().sum())}
+
+        if values.dtype == "object":
+            strings = values[values.map(type) == str]
+            counts["blank"] = int(strings.str.strip().str.lower().isin(BLANK_VALUES).sum())
+
+        bound = bounds.get(col)
+        if bound is not None:
+            numbers = values if values.dtype.kind in "iuf" else pd.to_numeric(values, errors="coerce")
+            if bound["minimum"] is not None:
+                counts["below_min"] = int((numbers < bound["minimum"]).sum())
+            if bound["maximum"] is not None:
+                counts["above_max"] = int((numbers > bound["maximum"]).sum())
+            if not bound["nullable"]:
+                counts["null_rejected"] = counts["null"]  # null refusé par le schéma : document rejeté au chargement
+
+        counts = {name: count for name, count in counts.items() if count}
+        if counts:
+            columns[col] = counts
+    return columns
+
+
+def build_quality_report(frames, bounds=None):
+    """
+    Construit le rapport qualité en une seule passe sur les DataFrames de chaque station,
+    sans les concaténer : compteurs par source, par station et par colonne, puis totaux
+    par colonne.
+
+    Paramètres :
+    - frames (iterable) : Tuples (source, id_station, DataFrame).
+    - bounds (dict) : Bornes des champs (par défaut, celles du $jsonSchema de weather_data).
+
+    Retourne :
+    - dict : Le rapport, sérialisable en JSON.
+    """
+    bounds = quality_bounds() if bounds is None else bounds
+    sources = {}
+    totals = {}
+    rows = 0
+    for source, id_station, df in frames:
+        columns = profile_columns(df, bounds)
+        sources.setdefault(source, {})[id_station] = {"rows": len(df), "columns": columns}
+        rows += len(df)
+        for col, counts in columns.items():
+            total = totals.setdefault(col, {})
+            for name, count in counts.items():
+                total[name] = total.get(name, 0) + count
+
+    return {"rows": rows, "bounds": bounds, "totals": totals, "sources": sources}
+
+
+def quality_summary(report):
+    """Tableau des totaux par colonne du rapport qualité, avec le % de valeurs nulles ou vides."""
+    summary = pd.DataFrame.from_dict(report["totals"], orient="index").fillna(0).astype(int)
+    if summary.empty:
+        return summary
+    missing = summary.get("null", 0) + summary.get("blank", 0)
+    summary["% NaN"] = (missing / report["rows"] * 100).round(2) if report["rows"] else 0
+    return summary
+